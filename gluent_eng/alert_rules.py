@@ -0,0 +1,360 @@
+#! /usr/bin/env python
+""" AlertRules: React to (parsed) log records with 'local actions'
+
+    Rules are defined in 'rules' section of ptail configuration file, i.e.:
+
+    rules:
+        namenode-errors:
+            log: namenode           # (regex) Log name or label. Default: all logs
+            where:                  # (regex) Field predicates. Default: all records
+                level: ERROR
+            count: 50               # Fire if MORE than 'count' records match ... Default: 0
+            window: 60              # ... within 'window' seconds. Default: 60
+            command: 'echo "$PTAIL_RULE" | mail -s alert oncall'  # Action: run command
+            file: /tmp/ptail-alerts.log                           # Action: append to file
+            debounce: 300           # Do not repeat action more often than every N seconds. Default: 0
+            max_actions: 10         # Do not run more than N actions ...
+            per: 3600               # ... per N seconds. Default: unlimited
+"""
+
+import logging
+import os
+import re
+import subprocess
+import time
+
+from collections import deque
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class AlertRulesException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Rule defaults
+DEFAULT_COUNT = 0
+DEFAULT_WINDOW = 60
+
+# Environment variables, exported to 'command' actions
+ENV_RULE = 'PTAIL_RULE'
+ENV_COUNT = 'PTAIL_COUNT'
+ENV_LOG = 'PTAIL_LOG'
+ENV_LABEL = 'PTAIL_LABEL'
+ENV_TEXT = 'PTAIL_TEXT'
+
+# (Numbered or named) back references and named groups: patterns with these cannot be safely combined
+# (neither can patterns with inline flags, i.e. (?i), as they would apply to the whole combined regex)
+RE_OWN_GROUPS = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+# Group name prefix for rule patterns in 'combined' regex, i.e. (?P<_r3>ERROR)
+RULE_GROUP = '_r'
+
+# Max number of groups in a single 'combined' regex (python 2 allows at most 100), see: LogSetup
+MAX_COMBINED_GROUPS = 99
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class AlertRule(object):
+    """ Single 'rule': predicates, sliding window counter and actions
+    """
+
+    def __init__(self, name, spec):
+        """ CONSTRUCTOR
+
+            name: Rule name
+            spec: Rule definition (dictionary, see: module description)
+        """
+        spec = spec or {}
+
+        self.name = name
+        self.log = re.compile(spec['log']) if spec.get('log') else None
+        self.where = dict((k, str(v)) for k, v in (spec.get('where') or {}).items())
+
+        self.count = int(spec.get('count', DEFAULT_COUNT))
+        self.window = float(spec.get('window', DEFAULT_WINDOW))
+
+        self.command = spec.get('command')
+        self.file = spec.get('file')
+        if not self.command and not self.file:
+            raise AlertRulesException("Rule: %s does not define any actions ('command' or 'file')" % name)
+
+        self.debounce = float(spec.get('debounce', 0))
+        self.max_actions = int(spec['max_actions']) if spec.get('max_actions') else None
+        self.per = float(spec.get('per', 0))
+
+        self._buckets = deque()  # Sliding window: [[second, count], ...]
+        self._matched = 0        # Number of records in the window
+        self._last_action = None # Last time the action was run
+        self._actions = deque()  # Action timestamps (for 'rate limit')
+
+
+    def _expire(self, now):
+        """ Expire window 'buckets' older than 'window'
+        """
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._matched -= self._buckets.popleft()[1]
+
+
+    def _can_act(self, now):
+        """ Check debounce and rate limits
+        """
+        if self._last_action is not None and now - self._last_action < self.debounce:
+            logger.debug("Rule: %s is debounced" % self.name)
+            return False
+
+        if self.max_actions:
+            while self._actions and self._actions[0] <= now - self.per:
+                self._actions.popleft()
+            if len(self._actions) >= self.max_actions:
+                logger.debug("Rule: %s is rate limited: %d actions per %.2f seconds" % \
+                    (self.name, self.max_actions, self.per))
+                return False
+
+        return True
+
+
+    def applies_to(self, log_name, label):
+        """ Return True if rule is relevant for the log, False otherwise
+        """
+        if not self.log:
+            return True
+
+        return bool(self.log.search(log_name) or (label and self.log.search(label)))
+
+
+    def hit(self, now):
+        """ Register matched record
+
+            Returns: True if 'threshold' is crossed and the action should run, False otherwise
+        """
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += 1
+        else:
+            self._buckets.append([second, 1])
+        self._matched += 1
+        self._expire(now)
+
+        if self._matched <= self.count or not self._can_act(now):
+            return False
+
+        self._last_action = now
+        self._actions.append(now)
+        return True
+
+
+    @property
+    def matched(self):
+        return self._matched
+
+
+class AlertRules(object):
+    """ Evaluate a set of rules against (parsed) log records
+
+        All rule 'where' patterns on a particular field are combined into a single regex,
+        so that each field is scanned once (left to right), regardless of how many rules exist
+    """
+
+    def __init__(self, rules):
+        """ CONSTRUCTOR
+
+            rules: {rule name: rule definition, ...} (i.e. 'rules' section of configuration file)
+        """
+        self._rules = [AlertRule(name, rules[name]) for name in rules]
+
+        self._matchers = self._compile_matchers(self._rules)
+        self._rules_by_log = {} # Cache: log name -> relevant rule idxs (until the log is closed)
+        self._running = []      # Running 'command' actions
+
+        logger.debug("AlertRules() successfully initialized with: %d rules" % len(self._rules))
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _compile_matchers(self, rules):
+        """ Combine rule patterns by field. Patterns with their own groups, back references or flags
+            are matched individually
+
+            Returns: {field: ([(combined regex, [rule idx, ...]), ...], {rule idx: regex})}
+        """
+        patterns_by_field = {}
+        for idx, rule in enumerate(rules):
+            for field in rule.where:
+                patterns_by_field.setdefault(field, []).append((idx, rule.where[field]))
+
+        matchers = {}
+        for field in patterns_by_field:
+            alternatives, individual = [], {}
+            for idx, pattern in patterns_by_field[field]:
+                regex = re.compile(pattern)
+                if regex.flags or RE_OWN_GROUPS.search(pattern) or 2 * regex.groups + 1 > MAX_COMBINED_GROUPS:
+                    logger.debug("Rule: %s pattern for field: %s has its own groups or flags. Matching it individually" % \
+                        (rules[idx].name, field))
+                    individual[idx] = regex
+                else:
+                    alternatives.append((idx, pattern, regex.groups))
+
+            try:
+                combined = self._combine(alternatives)
+            except re.error, e:
+                logger.warn("Unable to combine rule patterns for field: %s (%s). Matching rules individually" % (field, e))
+                individual.update((idx, re.compile(pattern)) for idx, pattern, _ in alternatives)
+                combined = []
+
+            matchers[field] = (combined, individual)
+
+        return matchers
+
+
+    def _combine(self, alternatives):
+        """ Combine rule patterns into a (few) regex(es) that find all rules, matching at a position, i.e.:
+
+                (?=p1|p3)(?:(?=(?P<_r1>p1))|)(?:(?=(?P<_r3>p3))|)
+
+            The leading lookahead finds the next position where any rule matches,
+            then every rule is checked at that position (and captures its group, if it matches)
+
+            (python 2 allows at most 100 groups per regex, so patterns are combined in 'chunks')
+
+            Returns: [(combined regex, [rule idx, ...]), ...]
+        """
+        combined = []
+        chunk, groups = [], 0
+
+        for alternative in alternatives + [None]:
+            if chunk and (alternative is None or groups + 2 * alternative[2] + 1 > MAX_COMBINED_GROUPS):
+                regex = "(?=%s)" % "|".join("(?:%s)" % pattern for _, pattern, _ in chunk) + \
+                    "".join("(?:(?=(?P<%s%d>%s))|)" % (RULE_GROUP, idx, pattern) for idx, pattern, _ in chunk)
+                combined.append((re.compile(regex), [_[0] for _ in chunk]))
+                chunk, groups = [], 0
+
+            if alternative is not None:
+                chunk.append(alternative)
+                groups += 2 * alternative[2] + 1
+
+        return combined
+
+
+    def _match_field(self, field, value):
+        """ Return a set of rule idxs that match 'value' of 'field'
+
+            The value is scanned once (left to right) by combined regex, until all rules are matched
+            or there are no more matches
+        """
+        combined, individual = self._matchers[field]
+        matched = set(idx for idx in individual if individual[idx].search(value))
+
+        for regex, idxs in combined:
+            remaining = len(idxs)
+            for m in regex.finditer(value):
+                for name, group in m.groupdict().items():
+                    if group is not None:
+                        idx = int(name[len(RULE_GROUP):])
+                        if idx not in matched:
+                            matched.add(idx)
+                            remaining -= 1
+                if not remaining:
+                    break
+
+        return matched
+
+
+    def _relevant_rules(self, log_name, label):
+        """ Return (cached) rule idxs that are relevant for the log
+        """
+        if log_name not in self._rules_by_log:
+            self._rules_by_log[log_name] = [idx for idx, rule in enumerate(self._rules) if rule.applies_to(log_name, label)]
+
+        return self._rules_by_log[log_name]
+
+
+    def _reap(self):
+        """ Collect finished 'command' actions
+        """
+        self._running = [_ for _ in self._running if _.poll() is None]
+
+
+    def _act(self, rule, log_name, label, text):
+        """ Run rule actions
+        """
+        logger.info("Rule: %s fired: %d records in %.2f seconds" % (rule.name, rule.matched, rule.window))
+
+        if rule.file:
+            try:
+                with open(rule.file, 'a') as f:
+                    f.write("%s rule=%s count=%d log=%s %s\n" % \
+                        (time.strftime('%Y-%m-%d %H:%M:%S'), rule.name, rule.matched, log_name, text))
+            except IOError, e:
+                logger.warn("Rule: %s unable to write to file: %s. Exception: %s" % (rule.name, rule.file, e))
+
+        if rule.command:
+            env = os.environ.copy()
+            env.update({
+                ENV_RULE: rule.name,
+                ENV_COUNT: str(rule.matched),
+                ENV_LOG: log_name,
+                ENV_LABEL: label or '',
+                ENV_TEXT: text,
+            })
+            try:
+                self._running.append(subprocess.Popen(rule.command, shell=True, env=env))
+            except OSError, e:
+                logger.warn("Rule: %s unable to run command: %s. Exception: %s" % (rule.name, rule.command, e))
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    @property
+    def fields(self):
+        """ Record fields that rules look at, see: FileTailer() 'listeners' """
+        return frozenset(self._matchers)
+
+
+    def on_close(self, tailer):
+        """ Forget (cached) relevant rules for the log that is no longer followed, see: FileTailer() 'listeners'
+        """
+        self._rules_by_log.pop(tailer.name, None)
+
+
+    def on_record(self, tailer, items, text):
+        """ Evaluate (parsed) record against the rules and run actions if necessary
+
+            tailer: FileTailer object that produced the record
+            items:  Parsed record fields, i.e. {'level': ..., 'text': ...}
+            text:   Full record text
+        """
+        if self._running:
+            self._reap()
+
+        relevant = self._relevant_rules(tailer.name, tailer.label)
+        if not relevant:
+            return
+
+        # Scan each field once, for all rules
+        matched_by_field = {}
+        for field in self._matchers:
+            if field in items and items[field] is not None:
+                matched_by_field[field] = self._match_field(field, items[field])
+
+        now = time.time()
+        for idx in relevant:
+            rule = self._rules[idx]
+            if all(field in matched_by_field and idx in matched_by_field[field] for field in rule.where):
+                if rule.hit(now):
+                    self._act(rule, tailer.name, tailer.label, text)
@@ -4,12 +4,18 @@
 
 import argparse
 import logging
+import os.path
 import re
 import sys
 import time
 
-from process_logs import METHOD_PID, METHOD_NAME_REGEX
-from .ptail_runner import PtailRunner
+# Start-up time is measured from here (before ptail modules are imported)
+STARTED_AT = time.time()
+
+from process_logs import METHOD_PID, METHOD_NAME_REGEX, DEFAULT_CACHE_DIR
+from .field_predicates import make_predicates, FieldPredicateException, RE_EXPRESSION
+from .record_guard import RecordLimits, check_backtracking, \
+    DEFAULT_MAX_LINE_LENGTH, DEFAULT_MAX_RECORD_SIZE, DEFAULT_MATCH_BUDGET, OVERSIZE_MODES, OVERSIZE_TRUNCATE
 
 
 ###############################################################################
@@ -37,6 +43,9 @@ DEFAULT_CONFIG = "ptail.yaml"
 # Default user to execute linux commands
 DEFAULT_USER = 'root'
 
+# Default 'replay' speed (as fast as possible)
+DEFAULT_REPLAY_SPEED = 0
+
 
 ###############################################################################
 # LOGGING
@@ -62,18 +71,22 @@ def print_title():
     print "%s\n" % PROG_BANNER
 
 
-def make_where_dict(where):
+def make_where_list(where):
     """
-        Take FILTER string in the format: level=DEBUG,text=app_123
-        and transform it into dictionary: {'level': 'DEBUG', 'text': 'app_123'}
-        that can be passed as KWARGS to the function
+        Take FILTER string in the format: level>=WARN,text=app_123
+        and transform it into a list of expressions: ['level>=WARN', 'text=app_123']
+        (see: make_predicates())
     """
-    where_d = {}
-    for l in where.strip().split(','):
-        k, v = l.split('=')
-        where_d[k] = v
+    return [_ for _ in where.strip().split(',') if _]
 
-    return where_d
+
+def warn_backtracking(patterns):
+    """ Warn about (user supplied) regular expressions that are prone to 'catastrophic backtracking'
+    """
+    for pattern in patterns:
+        issues = check_backtracking(pattern)
+        if issues:
+            print "[! REGEX] %s may backtrack catastrophically: %s" % (pattern, ", ".join(issues))
 
 
 def parse_args():
@@ -90,10 +103,38 @@ def parse_args():
 
     parser.add_argument('-b', '--from-top', required=False, action='store_true', \
         help="Scan log files from the beginning")
+    parser.add_argument('-n', '--last', required=False, type=int, \
+        help="Start with the last N records of each log file (then follow)")
 
-    source = parser.add_mutually_exclusive_group(required=True)
+    source = parser.add_mutually_exclusive_group(required=False)
     source.add_argument('-p', '--pid', nargs='+', type=int, help="Select processes with these pids")
     source.add_argument('-N', '--name', help="Select processes with this (regex) name pattern")
+    source.add_argument('--replay', help="Replay session, recorded with --record, from this directory")
+    source.add_argument('--connect', help="Connect to ptail daemon (see: --daemon) on this Unix socket")
+
+    parser.add_argument('--daemon', required=False, \
+        help="Run as a daemon: discover and tail logs once, serve records to clients (see: --connect) on this Unix socket")
+
+    parser.add_argument('-i', '--input', nargs='+', required=False, \
+        help="Also follow these inputs: '-' (stdin), named pipes or files")
+    parser.add_argument('-g', '--glob', nargs='+', required=False, \
+        help="Also follow files matching these glob patterns, including files created later, " + \
+            "i.e. '/var/log/hadoop-yarn/containers/*/*/stderr'")
+    parser.add_argument('--watch', required=False, action='store_true', \
+        help="Watch directories of discovered logs and follow new logs there as soon as they are created")
+
+    parser.add_argument('--record', required=False, help="Record session into this directory")
+    parser.add_argument('--replay-speed', required=False, type=float, default=DEFAULT_REPLAY_SPEED, \
+        help="Replay speed: 0 - as fast as possible, 1 - real time, 2 - twice as fast etc. Default: %s" % DEFAULT_REPLAY_SPEED)
+
+    parser.add_argument('--hosts', nargs='+', required=False, \
+        help="Discover and tail logs on these (remote) hosts instead, with one ssh session (and ptail agent) per host")
+    parser.add_argument('--cgroup', required=False, \
+        help="Only discover processes in this cgroup (directory or glob pattern, relative to /sys/fs/cgroup), " + \
+            "i.e. 'system.slice/docker-3f2a*.scope'. All processes in the cgroup, if -p/--pid or -N/--name is not supplied")
+
+    parser.add_argument('--correlate', required=False, \
+        help="Group records from all logs by this field (from log 'format', i.e. query id) and print groups when they go idle")
 
     parser.add_argument('-L', '--log-filter', required=False, default=None, help="Log name filter")
 
@@ -107,9 +148,32 @@ def parse_args():
         default=DEFAULT_NEWLOGS_WAIT, \
         help='Refresh list of logs every N seconds. Default: %.2f' % DEFAULT_NEWLOGS_WAIT)
 
+    parser.add_argument('--cache-dir', required=False, default=DEFAULT_CACHE_DIR, \
+        help="Keep discovery caches (i.e. detected file types, host names) in this directory ('' to disable). Default: %s" % \
+            DEFAULT_CACHE_DIR)
+
     parser.add_argument('-l', '--log-level', required=False, default=DEFAULT_LOGGING, \
         help="Logging level. Default: %s" % DEFAULT_LOGGING)
 
+    parser.add_argument('-m', '--metrics-port', required=False, type=int, \
+        help="Serve (Prometheus) metrics on this port, i.e. http://host:port/metrics")
+    parser.add_argument('--metrics-address', required=False, \
+        help="Serve metrics on this address ('0.0.0.0': all interfaces). Default: 127.0.0.1 (local connections only)")
+
+    parser.add_argument('--lag-budget', required=False, type=float, \
+        help="Warn if records are read more than N seconds after their timestamps ('ts' field)")
+
+    parser.add_argument('--max-line-length', required=False, type=int, default=DEFAULT_MAX_LINE_LENGTH, \
+        help="Truncate lines longer than that. Default: %d" % DEFAULT_MAX_LINE_LENGTH)
+    parser.add_argument('--max-record-size', required=False, type=int, default=DEFAULT_MAX_RECORD_SIZE, \
+        help="Max size of (multi line) record. Default: %d" % DEFAULT_MAX_RECORD_SIZE)
+    parser.add_argument('--oversize', required=False, choices=OVERSIZE_MODES, default=OVERSIZE_TRUNCATE, \
+        help="What to do with records larger than --max-record-size. Default: %s" % OVERSIZE_TRUNCATE)
+    parser.add_argument('--match-budget', required=False, type=float, default=DEFAULT_MATCH_BUDGET, \
+        help="Time budget (in seconds) for matching a line against log format. " + \
+            "Logs with formats that are repeatedly slower than that are switched to plain text. Default: %s" % \
+            DEFAULT_MATCH_BUDGET)
+
     parser.add_argument('-H', '--highlight', required=False, \
         help='Highlight specified entries (supports regular expressions)')
     parser.add_argument('-C', '--full-color', required=False, action='store_true', \
@@ -118,12 +182,14 @@ def parse_args():
     filters = parser.add_mutually_exclusive_group(required=False)
     filters.add_argument('-F', '--filters', nargs='+', help="""
         (line) 'Structured' line selection filters, i.e.: --filters level=INFO text=Driver
+        or typed comparisons: --filters 'level>=WARN' 'duration>500' 'ts>2016-06-07T17:50' '!text=heartbeat'
 
         If 'line format' is defined (in configuration file), and incoming log line matches 
         log line is broken down into 'columns' with each column becoming individually 'searchable' (see above)
         Line is output is it passes ALL filters
         (if 'line format' is not supplied, default is: 'whole line' is a 'text' column)
-        Values are regular expressions
+        Values are regular expressions for '=' and '!=', '>', '>=', '<', '<=' compare
+        log levels, numbers, timestamps or strings (depending on the value). '!' negates the filter
 
         [EXPERIMENTAL]
     """)
@@ -142,25 +208,68 @@ def parse_args():
     if not args.show_logs and not args.continuous:
         args.continuous = True
 
-    # Search by either 'pid' or 'name regex'
+    # Search by either 'pid' or 'name regex' (or replay recorded session)
     if args.pid:
         args.method = METHOD_PID
         args.search_key = args.pid
-    else:
+    elif args.name:
         args.method = METHOD_NAME_REGEX
         args.search_key = args.name
+    elif args.cgroup:
+        args.method = METHOD_NAME_REGEX
+        args.search_key = '.'
+    elif args.replay or args.input or args.glob or args.connect:
+        args.method = None
+        args.search_key = None
+    else:
+        parser.error("one of the arguments -p/--pid -N/--name --replay --connect -i/--input -g/--glob is required")
+
+    if args.connect and (args.input or args.glob or args.record or args.show_logs or args.daemon):
+        parser.error("--connect cannot be combined with --input, --glob, --record, --show-logs or --daemon")
+    if args.daemon and (args.show_logs or args.replay or args.correlate):
+        parser.error("--daemon cannot be combined with --show-logs, --replay or --correlate")
+    if args.correlate and (args.connect or args.grep):
+        parser.error("--correlate cannot be combined with --connect or --grep")
+
+    if args.replay and (args.record or args.show_logs or args.input or args.glob):
+        parser.error("--replay cannot be combined with --record, --show-logs, --input or --glob")
+    if args.last is not None and (args.last <= 0 or args.from_top):
+        parser.error("-n/--last must be positive and cannot be combined with -b/--from-top")
+    if args.show_logs and not args.method:
+        parser.error("--show-logs requires -p/--pid or -N/--name")
+    if args.hosts and (not args.method or args.show_logs):
+        parser.error("--hosts requires -p/--pid or -N/--name and cannot be combined with --show-logs")
+    if args.watch and (not args.method or args.hosts or args.show_logs):
+        parser.error("--watch requires -p/--pid or -N/--name and cannot be combined with --hosts or --show-logs")
+    if args.metrics_address and not args.metrics_port:
+        parser.error("--metrics-address requires -m/--metrics-port")
+    if args.cgroup and (args.hosts or args.replay or args.connect):
+        parser.error("--cgroup cannot be combined with --hosts, --replay or --connect")
+
+    # Check user supplied regular expressions for 'catastrophic backtracking'
+    regexes = [args.highlight, args.grep]
+    for expression in make_where_list(",".join(args.filters)) if args.filters else []:
+        matched = RE_EXPRESSION.match(expression)
+        if matched and matched.group('op') in ('=', '!='):
+            regexes.append(matched.group('value'))
+    warn_backtracking([_ for _ in regexes if _])
+
+    args.cache_dir = os.path.expanduser(args.cache_dir) if args.cache_dir else None
+
+    args.limits = RecordLimits(args.max_line_length, args.max_record_size, args.oversize, args.match_budget)
 
     # Making highlight pattern
     if args.highlight:
         args.highlight = re.compile('('+args.highlight+')', re.M)
 
-    # Compile 'filters'
-    if args.filters:
-        filters = make_where_dict(",".join(args.filters))
-        #args.filters = {_: re.compile(filters[_]) for _ in filters} 2.7+
-        args.filters = dict((k, re.compile(filters[k])) for k in filters)
-    elif args.grep:
-        args.filters = {'text': re.compile(args.grep)}
+    # Compile 'filters' into predicate 'tree'
+    try:
+        if args.filters:
+            args.filters = make_predicates(make_where_list(",".join(args.filters)))
+        elif args.grep:
+            args.filters = make_predicates(['text=%s' % args.grep])
+    except FieldPredicateException, e:
+        parser.error(e)
 
     return args
 
@@ -169,6 +278,23 @@ def main():
     print_title()
     set_logging(args.log_level)
 
+    if args.connect:
+        from .ptail_daemon import PtailClient
+        client = PtailClient(
+            socket_path = args.connect,
+            filters = args.filters if not args.grep else None,
+            grep = args.grep,
+            highlight = args.highlight,
+            full_color = args.full_color
+        )
+        try:
+            client.run()
+        except KeyboardInterrupt:
+            print "Detected CTRL+C. Exiting .."
+        sys.exit(0)
+
+    from .ptail_runner import PtailRunner
+
     runner = PtailRunner(
         refresh_interval = args.refresh_interval, 
         method = args.method,
@@ -178,20 +304,48 @@ def main():
         full_color = args.full_color,
         simple_grep = args.grep,
         user = args.user,
-        config_file = args.config_file
+        config_file = args.config_file,
+        metrics_port = args.metrics_port,
+        record_dir = args.record,
+        inputs = args.input,
+        display = not args.daemon,
+        hosts = args.hosts,
+        wait = args.wait,
+        last_records = args.last,
+        lag_budget = args.lag_budget,
+        limits = args.limits,
+        correlate = args.correlate,
+        globs = args.glob,
+        watch_dirs = args.watch,
+        cache_dir = args.cache_dir,
+        cgroup = args.cgroup,
+        metrics_address = args.metrics_address
     )
+    logger.debug("Started in: %.3f seconds" % (time.time() - STARTED_AT))
 
     if args.show_logs:
         runner.show()
+    elif args.daemon:
+        from .ptail_daemon import PtailDaemon
+        try:
+            PtailDaemon(runner, args.daemon).serve(args.wait)
+        except KeyboardInterrupt:
+            print "Detected CTRL+C. Exiting .."
+    elif args.replay:
+        try:
+            runner.replay(args.replay, args.replay_speed, args.filters, args.highlight)
+        except KeyboardInterrupt:
+            print "Detected CTRL+C. Exiting .."
     else:
         try:
             while True:
                 runner.tail(args.filters, args.highlight)
-                if not args.continuous:
+                if not args.continuous or runner.exhausted:
                     break
                 logger.debug("Sleeping: %f seconds" % args.wait)
                 time.sleep(args.wait)
         except KeyboardInterrupt:
             print "Detected CTRL+C. Exiting .."
 
+    runner.close()
     sys.exit(0)
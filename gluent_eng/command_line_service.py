@@ -4,10 +4,15 @@
 
 import argparse
 import logging
+import os.path
 import sys
+import time
+
+# Start-up time is measured from here (before service modules are imported)
+STARTED_AT = time.time()
 
 from .linux_service import LinuxService, LinuxServiceException, DEFAULT_ROOT_USER
-from .process_logs import RE_DEFAULT_LOG_NAME_FILTER
+from .process_logs import RE_DEFAULT_LOG_NAME_FILTER, DEFAULT_CACHE_DIR
 
 
 ###############################################################################
@@ -66,6 +71,9 @@ def parse_args():
         help="Log name filter (regex) for extended output. Default: %s" % RE_DEFAULT_LOG_NAME_FILTER.pattern)
 
     parser.add_argument('-w', '--wait', required=False, type=float, help="Wait (in seconds) after running start/stop command")
+    parser.add_argument('--cache-dir', required=False, default=DEFAULT_CACHE_DIR, \
+        help="Keep discovery caches (i.e. detected file types, host names) in this directory ('' to disable). Default: %s" % \
+            DEFAULT_CACHE_DIR)
 
     parser.add_argument('-l', '--log-level', required=False, default=DEFAULT_LOGGING, \
         help="Logging level. Default: %s" % DEFAULT_LOGGING)
@@ -77,6 +85,7 @@ def parse_args():
 
     # Args post-processing
     args.log_level = args.log_level.upper()
+    args.cache_dir = os.path.expanduser(args.cache_dir) if args.cache_dir else None
 
     #if args.extended and args.command not in ('status'):
     #    raise LinuxServiceException("Extended mode only makes sense with 'status' command")
@@ -102,8 +111,10 @@ def main():
         host = args.host,
         log_filter = args.log_filter,
         extended = args.extended,
-        wait = args.wait
+        wait = args.wait,
+        cache_dir = args.cache_dir
     )
+    logger.info("Started in: %.3f seconds" % (time.time() - STARTED_AT))
 
     # Run service command
     srv.run(args.service, args.command)
@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+""" DirWatcher: Watch directories for new (and removed) files
+
+    Uses Linux inotify (via ctypes): IN_CREATE/IN_MOVED_TO for new files, IN_DELETE/IN_MOVED_FROM for removed ones,
+    so that new logs can be followed as soon as they are created (rather than on the next /proc/<pid>/fd scan).
+
+    Falls back to comparing directory listings on every poll if inotify is not available
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path
+import struct
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class DirWatcherException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# inotify flags and event masks (see: /usr/include/sys/inotify.h)
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_ONLYDIR
+ADDED_MASK = IN_CREATE | IN_MOVED_TO
+REMOVED_MASK = IN_DELETE | IN_MOVED_FROM
+
+# struct inotify_event: wd, mask, cookie, len (+ name, padded with zeros)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Max bytes to read from inotify in one go
+READ_SIZE = 64 * 1024
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def load_inotify():
+    """ Load libc inotify functions
+
+        Returns: (inotify_init1, inotify_add_watch) or None if inotify is not available
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        functions = (libc.inotify_init1, libc.inotify_add_watch)
+    except (OSError, AttributeError), e:
+        logger.info("inotify is not available: %s. Falling back to polling directories" % e)
+        return None
+
+    functions[0].argtypes = [ctypes.c_int]
+    functions[1].argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+    return functions
+
+
+class DirWatcher(object):
+    """ Watch directories for new (and removed) files
+    """
+
+    def __init__(self, use_inotify=True):
+        """ CONSTRUCTOR
+
+            use_inotify: Use inotify (if available). False: compare directory listings on every poll
+        """
+        self._fd = None
+        self._inotify = load_inotify() if use_inotify else None
+        if self._inotify:
+            self._fd = self._inotify[0](IN_NONBLOCK | IN_CLOEXEC)
+            if self._fd < 0:
+                logger.info("Unable to initialize inotify: %s. Falling back to polling directories" % \
+                    os.strerror(ctypes.get_errno()))
+                self._fd, self._inotify = None, None
+
+        self._watches = {}     # {watch descriptor: directory} (inotify) or {directory: set(names)} (polling)
+        self._directories = set()
+        self._overflowed = False
+
+        logger.debug("DirWatcher() successfully initialized. inotify: %s" % (self._fd is not None))
+
+
+    def __del__(self):
+        """ DESTRUCTOR
+        """
+        self.close()
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _list(self, directory):
+        """ List directory (empty if it is gone)
+        """
+        try:
+            return set(os.listdir(directory))
+        except OSError:
+            return set()
+
+
+    def _read_inotify(self):
+        """ Read pending inotify events
+
+            Returns: ([added file, ...], [removed file, ...])
+        """
+        added, removed = [], []
+
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise DirWatcherException("Unable to read inotify events. Exception: %s" % e)
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    logger.warn("inotify event queue overflowed. Some new files may be missed")
+                    self._overflowed = True
+                    continue
+
+                directory = self._watches.get(wd)
+                if mask & IN_IGNORED:
+                    # Watched directory is gone
+                    if directory:
+                        logger.debug("Directory: %s is no longer watched" % directory)
+                        self._directories.discard(directory)
+                        del self._watches[wd]
+                    continue
+
+                if not directory or not name or mask & IN_ISDIR:
+                    continue
+
+                if mask & ADDED_MASK:
+                    added.append(os.path.join(directory, name))
+                elif mask & REMOVED_MASK:
+                    removed.append(os.path.join(directory, name))
+
+        return added, removed
+
+
+    def _read_listings(self):
+        """ Compare directory listings with the previous ones
+
+            Returns: ([added file, ...], [removed file, ...])
+        """
+        added, removed = [], []
+
+        for directory in list(self._watches):
+            names = self._list(directory)
+            previous = self._watches[directory]
+            added.extend(os.path.join(directory, _) for _ in names - previous)
+            removed.extend(os.path.join(directory, _) for _ in previous - names)
+            self._watches[directory] = names
+
+            if not os.path.isdir(directory):
+                logger.debug("Directory: %s is no longer watched" % directory)
+                self._directories.discard(directory)
+                del self._watches[directory]
+
+        return added, removed
+
+
+    ###########################################################################
+    # PROPERTIES
+    ###########################################################################
+
+    @property
+    def directories(self):
+        return self._directories
+
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    def watch(self, directory):
+        """ Start watching directory (if not watched already)
+
+            Returns: True if directory is (now) watched, False otherwise
+        """
+        if directory in self._directories:
+            return True
+
+        if self._fd is not None:
+            wd = self._inotify[1](self._fd, directory, WATCH_MASK)
+            if wd < 0:
+                logger.warn("Unable to watch directory: %s. Error: %s" % (directory, os.strerror(ctypes.get_errno())))
+                return False
+            self._watches[wd] = directory
+        else:
+            if not os.path.isdir(directory):
+                return False
+            self._watches[directory] = self._list(directory)
+
+        logger.debug("Watching directory: %s" % directory)
+        self._directories.add(directory)
+        return True
+
+
+    def poll(self):
+        """ Get files that were added to (or removed from) watched directories since the last poll
+
+            Returns: ([added file, ...], [removed file, ...], overflowed)
+                     overflowed: True if some events were lost (and directories need to be rescanned)
+        """
+        if self._fd is not None:
+            added, removed = self._read_inotify()
+        else:
+            added, removed = self._read_listings()
+
+        overflowed, self._overflowed = self._overflowed, False
+
+        if added or removed:
+            logger.debug("Watched directories: %d files added, %d files removed" % (len(added), len(removed)))
+        return added, removed, overflowed
+
+
+    def close(self):
+        """ Stop watching
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches, self._directories = {}, set()
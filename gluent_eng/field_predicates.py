@@ -0,0 +1,293 @@
+#! /usr/bin/env python
+""" FieldPredicates: Typed 'field' predicates for (parsed) log records, a.k.a. --filters
+
+    Expression syntax: [!]field<operator>value
+
+        =       value is a regex, field matches it (search)
+        !=      value is a regex, field does not match it
+        > >= < <=
+                typed comparison. Type is decided by the value:
+                    log level (TRACE < DEBUG < INFO < WARN < ERROR < FATAL)
+                    number    (field's leading number is compared, i.e. '523ms')
+                    timestamp (digits are compared up to value's precision, i.e. ts>2016-06-07T17:50)
+                    string    (otherwise)
+        !       (prefix) negates the predicate
+
+    i.e.: level>=WARN duration>500 !text=heartbeat
+
+    Predicates are combined (AND) into a predicate 'tree' that evaluates (cheapest, most selective) predicates first.
+    Evaluation order is re-adjusted periodically, based on the rejection rates measured at runtime
+
+    Field values are converted (to numbers, levels etc) only when (and if) a predicate needs them
+
+    IMPORTANT: This module must not import anything outside of python standard library
+               and must run on both: python 2 (2.6+) and python 3 (it is shipped to remote hosts, see: RemoteAgent)
+"""
+
+import logging
+import re
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class FieldPredicateException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Expression: [!]field<operator>value
+RE_EXPRESSION = re.compile(r'^(?P<negate>!?)(?P<field>\w+)(?P<op>>=|<=|!=|=|>|<)(?P<value>.*)$')
+
+# Log levels, in 'severity' order (single letters: glog, see: LogLayouts)
+LOG_LEVELS = {
+    'TRACE': 0, 'FINEST': 0, 'FINER': 0,
+    'DEBUG': 1, 'FINE': 1,
+    'INFO': 2, 'NOTICE': 2, 'I': 2,
+    'WARN': 3, 'WARNING': 3, 'W': 3,
+    'ERROR': 4, 'SEVERE': 4, 'E': 4,
+    'FATAL': 5, 'CRITICAL': 5, 'F': 5,
+}
+
+RE_NUMBER = re.compile(r'^[-+]?\d+(\.\d*)?$')
+RE_LEADING_NUMBER = re.compile(r'^\s*([-+]?\d+(\.\d*)?)')
+RE_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}')
+RE_NON_DIGITS = re.compile(r'\D+')
+
+# Comparison operators
+COMPARISONS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+# (relative) Predicate evaluation 'costs'
+COST_LEVEL = 1
+COST_NUMBER = 2
+COST_STRING = 2
+COST_TIMESTAMP = 3
+COST_REGEX = 5
+
+# Re-order predicates every N evaluations
+REORDER_INTERVAL = 1000
+
+# 'Floor' for the rejection rate (so that predicates that never reject are still ordered by cost)
+MIN_REJECTION_RATE = 0.001
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+###############################################################################
+# CONVERTERS: field value -> comparable value (None: not convertible)
+###############################################################################
+
+def to_level(value):
+    return LOG_LEVELS.get(value.strip().upper())
+
+
+def to_number(value):
+    matched = RE_LEADING_NUMBER.match(value)
+    return float(matched.group(1)) if matched else None
+
+
+def to_timestamp(value):
+    return RE_NON_DIGITS.sub('', value)
+
+
+def to_string(value):
+    return value
+
+
+class RegexPredicate(object):
+    """ field=regex
+    """
+    cost = COST_REGEX
+
+    def __init__(self, field, pattern):
+        self.field = field
+        self._regex = re.compile(pattern)
+
+
+    def evaluate(self, items, converted):
+        """ Returns: True/False or None if the field is not in the record
+        """
+        if self.field not in items:
+            return None
+
+        value = items[self.field]
+        return value is not None and self._regex.search(value) is not None
+
+
+class ComparePredicate(object):
+    """ field<op>value typed comparison
+    """
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self._compare = COMPARISONS[op]
+
+        if value.strip().upper() in LOG_LEVELS:
+            self._converter, self.cost = to_level, COST_LEVEL
+        elif RE_NUMBER.match(value):
+            self._converter, self.cost = to_number, COST_NUMBER
+        elif RE_TIMESTAMP.match(value):
+            self._converter, self.cost = to_timestamp, COST_TIMESTAMP
+        else:
+            self._converter, self.cost = to_string, COST_STRING
+
+        self._value = self._converter(value)
+        # Timestamps are compared with the value's precision, i.e. 2016-06-07T17:50 -> minutes
+        self._precision = len(self._value) if to_timestamp == self._converter else None
+
+
+    def evaluate(self, items, converted):
+        """ Returns: True/False or None if the field is not in the record
+
+            converted: {(field, converter): value} - per record 'conversion' cache
+        """
+        if self.field not in items:
+            return None
+
+        key = (self.field, self._converter)
+        if key not in converted:
+            value = items[self.field]
+            converted[key] = self._converter(value) if value is not None else None
+
+        value = converted[key]
+        if value is None:
+            return False
+        if self._precision:
+            value = value[:self._precision]
+
+        return self._compare(value, self._value)
+
+
+class NotPredicate(object):
+    """ !predicate
+    """
+
+    def __init__(self, predicate):
+        self.field = predicate.field
+        self.cost = predicate.cost
+        self._predicate = predicate
+
+
+    def evaluate(self, items, converted):
+        result = self._predicate.evaluate(items, converted)
+        return None if result is None else not result
+
+
+class AndPredicate(object):
+    """ Predicate 'tree' root: all (applicable) predicates must be True
+
+        Predicates on the fields that are not in the record are 'not applicable' and skipped,
+        but at least one predicate must apply
+    """
+
+    def __init__(self, predicates, expressions):
+        """ CONSTRUCTOR
+
+            predicates:  List of 'leaf' predicates
+            expressions: Source expressions (to re-create the tree elsewhere, i.e. on remote hosts)
+        """
+        self._predicates = sorted(predicates, key=lambda p: p.cost)
+        self._expressions = expressions
+
+        self._stats = dict((id(_), [0, 0]) for _ in predicates)  # {id(predicate): [evaluated, rejected]}
+        self._evaluations = 0
+
+
+    def _reorder(self):
+        """ Order predicates by: cost / rejection rate, i.e. cheap and selective ones go first
+        """
+        def rank(predicate):
+            evaluated, rejected = self._stats[id(predicate)]
+            rate = float(rejected) / evaluated if evaluated else 0
+            return predicate.cost / max(rate, MIN_REJECTION_RATE)
+
+        self._predicates.sort(key=rank)
+
+        # 'Age' statistics, so that the order can follow changes in the data
+        for stats in self._stats.values():
+            stats[0] //= 2
+            stats[1] //= 2
+
+        logger.debug("Predicate order: %s" % [_.field for _ in self._predicates])
+
+
+    @property
+    def expressions(self):
+        return self._expressions
+
+
+    @property
+    def fields(self):
+        """ Record fields that predicates look at """
+        return frozenset(_.field for _ in self._predicates)
+
+
+    def matches(self, items):
+        """ Check if (parsed record) items match all (applicable) predicates
+        """
+        self._evaluations += 1
+        if 0 == self._evaluations % REORDER_INTERVAL:
+            self._reorder()
+
+        converted = {}
+        applied = False
+
+        for predicate in self._predicates:
+            result = predicate.evaluate(items, converted)
+            if result is None:
+                continue
+
+            stats = self._stats[id(predicate)]
+            stats[0] += 1
+            if not result:
+                stats[1] += 1
+                return False
+            applied = True
+
+        return applied
+
+
+def make_predicate(expression):
+    """ Make 'leaf' predicate from expression: [!]field<operator>value
+    """
+    matched = RE_EXPRESSION.match(expression)
+    if not matched:
+        raise FieldPredicateException("Invalid filter: %s. Expected: [!]field<operator>value" % expression)
+
+    field, op, value = matched.group('field'), matched.group('op'), matched.group('value')
+
+    try:
+        if '=' == op:
+            predicate = RegexPredicate(field, value)
+        elif '!=' == op:
+            predicate = NotPredicate(RegexPredicate(field, value))
+        else:
+            predicate = ComparePredicate(field, op, value)
+    except re.error as e:
+        raise FieldPredicateException("Invalid regular expression in filter: %s. Exception: %s" % (expression, e))
+
+    return NotPredicate(predicate) if matched.group('negate') else predicate
+
+
+def make_predicates(expressions):
+    """ Make predicate 'tree' from expressions, i.e. ['level>=WARN', 'text=Driver']
+
+        Returns: None if there are no expressions
+    """
+    if not expressions:
+        return None
+
+    return AndPredicate([make_predicate(_) for _ in expressions], list(expressions))
@@ -5,12 +5,15 @@
 """
 
 import logging
-import os.path
 import re
+import time
 
 from termcolor import colored
 
 from .color_chooser import colorize
+from .log_setup import DEFAULT_LOG_ENTRY, reduce_format
+from .log_source import FileSource
+from .record_guard import RecordLimits, OVERSIZE_SPLIT, TRUNCATED_RECORD, MAX_BUDGET_OVERRUNS, MIN_TIMED_LINE_LENGTH
 
 
 ###############################################################################
@@ -32,11 +35,32 @@ logger = logging.getLogger(__name__)
 #logger.addHandler(logging.NullHandler()) # Disabling logging by default
 
 
+def filter_match(parsed_items, filters):
+    """ Check if (parsed line) items match user supplied "filters" (predicate 'tree', see: make_predicates())
+        Return True if so, False otherwise
+
+        Filters on fields that are not in 'parsed items' are skipped, but at least one filter must apply
+    """
+    if not filters:
+        logger.debug("Filters not supplied. Passing all through")
+        return True
+
+    matches = filters.matches(parsed_items)
+
+    if matches:
+        logger.debug("MATCHED filters: %s" % filters.expressions)
+    else:
+        logger.debug("NOT MATCHED filters: %s" % filters.expressions)
+
+    return matches
+
+
 class FileTailer(object):
     """ File "tail" interface
     """
 
-    def __init__(self, file_name, color, full_color, format, label):
+    def __init__(self, file_name, color, full_color, format, label, listeners=None, source=None, display=True,
+        limits=None, fields=None):
         """ CONSTRUCTOR
 
             file_name:  File name to tail
@@ -45,15 +69,41 @@ class FileTailer(object):
             format:     (regex, i.e. [(?P<id>[^\]]+)\]: (?P<msg>.*))
                         Line structure, see: http://www.regular-expressions.info/named.html
             label:      File label (usually, file name) to be prepended/colorized
+            listeners:  Objects to be notified of every (parsed) record, before filtering
+                        Must implement: on_record(tailer, items, text), i.e. AlertRules()
+                        May implement: on_close(tailer), to be notified when the log is no longer followed
+            source:     Where to read lines from (see: log_source). Default: FileSource(file_name)
+            display:    (True/False) Whether to print (filtered) records or only notify listeners
+            limits:     Line/record size limits and 'format' time budget (see: RecordLimits())
+            fields:     Record fields that are actually used (by filters and listeners). None: all fields
+                        Other 'format' fields are not captured (and the line is not parsed at all, if none are needed)
         """
 
         self._file_name = file_name
         self._color = color
         self._full_color = full_color
-        self._format = re.compile(format)
+        self._fields = fields
+        self._set_format(format)
+        self._raw_label = label
         self._label = colorize("[%s]" % label, self._color)
+        self._listeners = listeners or []
+        self._display = display
+
+        self._source = source or FileSource(file_name)
+        self._limits = limits or RecordLimits()
+        self._budget_overruns = 0   # Consecutive lines that took longer than 'time budget' to match
+
+        # Record that is still being assembled (more 'continuation' lines may follow)
+        self._pending_items = None  # ... parsed 'head' line
+        self._pending_lines = []    # ... (head + continuation) lines
+        self._pending_size = 0      # ... total size of (head + continuation) lines
+        self._pending_truncated = False
 
-        self._file_handle = None
+        # The latest filters and highlight, to emit the 'pending' record with, outside of tail() (see: flush())
+        self._filters, self._highlight = None, None
+
+        # True if records are read 'live', as they are written (rather than history, i.e. read 'from the top' or 'replayed')
+        self._live = False
 
         logger.debug("FileTailer() successfully initialized for file: %s" % file_name)
 
@@ -70,28 +120,24 @@ class FileTailer(object):
     def _close(self):
         """ Close file
         """
-        if self._file_handle:
-            logger.info("Closing log file: %s" % self._file_name)
-            self._file_handle.close()
-
+        self._source.close()
 
-    def _open_at(self, file_name, open_at_top):
-        """ Open file name either "at the top" or "at_the_end"
 
-            returns False if the file cannot be open
+    def _set_format(self, format):
+        """ Compile format, only capturing the fields that are needed
         """
+        self._format = re.compile(reduce_format(format, self._fields))
 
-        if not os.path.isfile(file_name):
-            logger.warn("Unable to locate file: %s" % file_name)
-            return False
+        # Captured fields: [name, ...] and their group indexes: [idx, ...]
+        captured = sorted(self._format.groupindex.items(), key=lambda _: _[1])
+        self._group_names = [_[0] for _ in captured]
+        self._group_indexes = [_[1] for _ in captured]
 
-        logger.debug("Opening file: %s" % file_name)
-        self._file_handle = open(file_name)
+        # Multi line records are only possible with 'non trivial' format
+        self._multi_line = format != DEFAULT_LOG_ENTRY
 
-        if not open_at_top:
-            self._file_handle.seek(0, 2) # Set position to the end of the file
-
-        return True
+        # Every line is a (single line) record with trivial format. No need to match, if no fields are needed
+        self._parse = self._multi_line or self._fields is None or bool(self._fields)
 
 
     def _format_line(self, line, line_format):
@@ -102,49 +148,82 @@ class FileTailer(object):
 
             [(?P<id>[^\]]+)\]: (?P<msg>.*)
             see: http://www.regular-expressions.info/named.html
+
+            Only 'needed' fields are returned (see: 'fields')
         """
+        if not self._parse:
+            return {}
+
         ret = None
 
         logger.debug("Matching line: %s with format: %s" % (line, line_format.pattern))
 
-        matches = line_format.match(line)
+        if self._multi_line and len(line) >= MIN_TIMED_LINE_LENGTH:
+            started = time.time()
+            matches = line_format.match(line)
+            self._check_budget(line, time.time() - started)
+        else:
+            matches = line_format.match(line)
 
         if matches:
             logger.debug("Line: %s matches format: %s" % (line, line_format.pattern))
-            ret = matches.groupdict()
+            if self._fields is None:
+                ret = matches.groupdict()
+            elif not self._group_indexes:
+                ret = {}
+            elif 1 == len(self._group_indexes):
+                ret = {self._group_names[0]: matches.group(self._group_indexes[0])}
+            else:
+                ret = dict(zip(self._group_names, matches.group(*self._group_indexes)))
         else:
             logger.debug("Line: %s DOES NOT match format: %s" % (line, line_format.pattern))
 
         return ret
 
 
-    def _filter_match(self, parsed_items, filters):
-        """ Check if (parsed line) items match user supplied "filters"
-            Return True if so, False otherwise
+    def _check_budget(self, line, elapsed):
+        """ Fall back to plain text format if matching lines repeatedly takes longer than 'time budget'
         """
-        if not filters:
-            logger.debug("Filters not supplied. Passing all through")
-            return True
+        if elapsed <= self._limits.match_budget:
+            self._budget_overruns = 0
+            return
 
-        common_keys = list(set(parsed_items.keys()) & set(filters.keys()))
+        self._budget_overruns += 1
+        logger.warn("Matching line of: %d characters from: %s took: %.3f seconds (budget: %.3f)" % \
+            (len(line), self._file_name, elapsed, self._limits.match_budget))
 
-        if not common_keys:
-            msg = "No common keys between 'parsed items': %s and 'filters': %s" % \
-                (parsed_items, filters)
-            msg += ". Skipping by default"
-            logger.debug(msg)
-            return False
+        if self._budget_overruns >= MAX_BUDGET_OVERRUNS:
+            print "[! LOG] %s %s" % (self._label, self._color_line("Format is too slow: %s. Switching to plain text" % \
+                self._format.pattern))
+            self._set_format(DEFAULT_LOG_ENTRY)
 
-        logger.debug("Matching filters: %s with 'parsed items': %s on common keys: %s" % \
-            (filters, parsed_items, common_keys))
-        matches = all([filters[_].search(parsed_items[_]) for _ in common_keys])
 
-        if matches:
-            logger.debug('MATCHED on common keys: %s' % common_keys)
-        else:
-            logger.debug('NOT MATCHED on common keys: %s' % common_keys)
+    def _start_record(self, items, line):
+        """ Start new 'pending' record
+        """
+        self._pending_items, self._pending_lines = items, [line]
+        self._pending_size, self._pending_truncated = len(line), False
 
-        return matches
+
+    def _add_continuation(self, line, filters, highlight):
+        """ Add continuation line to the 'pending' record, respecting 'max record size'
+        """
+        if self._pending_size + len(line) > self._limits.max_record_size:
+            if OVERSIZE_SPLIT == self._limits.oversize:
+                logger.debug("Record from: %s exceeds: %d bytes. Splitting" % \
+                    (self._file_name, self._limits.max_record_size))
+                items = self._pending_items
+                self._emit_record(filters, highlight)
+                self._start_record(items, line)
+            elif not self._pending_truncated:
+                logger.debug("Record from: %s exceeds: %d bytes. Truncating" % \
+                    (self._file_name, self._limits.max_record_size))
+                self._pending_lines.append(TRUNCATED_RECORD)
+                self._pending_truncated = True
+            return
+
+        self._pending_lines.append(line)
+        self._pending_size += len(line) + 1
 
 
     def _highlight_line(self, line, hi_pattern):
@@ -171,45 +250,63 @@ class FileTailer(object):
         return colorize(line, self._color) if self._full_color else line
 
 
-    def _process_lines(self, lines, filters, highlight):
-        """ Process lines, a.k.a.: filter, highlight and emit them
+    def _emit_record(self, filters, highlight):
+        """ Emit 'pending' record, a.k.a.: notify listeners, filter, highlight and print it
+        """
+        if self._pending_items is None:
+            return
+
+        matched_items, current_line = self._pending_items, "\n".join(self._pending_lines)
+        self._pending_items, self._pending_lines = None, []
+
+        for listener in self._listeners:
+            listener.on_record(self, matched_items, current_line)
+
+        if not self._display:
+            return
+
+        # Match parsed line items to user suppplied "filters"
+        if not filter_match(matched_items, filters):
+            logger.debug("Line: %s does not match filters: %s. Skipping" % \
+                (current_line, filters.expressions))
+            return
+
+        # MAIN output of FileTailer
+        print self.render(current_line, highlight)
+
+
+    def _process_lines(self, lines, filters, highlight, flush):
+        """ Process lines, a.k.a.: assemble them into records, filter, highlight and emit them
             based on what the user requested
+
+            A record is a line that matches 'format' + all the following lines that do not
+
+            flush: True - emit the last record right away
+                   False - keep it 'pending' as more continuation lines may follow
         """
-        logger.debug("Found: %d new lines in file: %s" % (len(lines), self._file_handle.name))
+        logger.debug("Found: %d new lines in file: %s" % (len(lines), self._file_name))
 
-        current_line = ""
         for line in lines:
             line = line.strip()
             logger.debug("Processing line: %s" % line)
             matched_items = self._format_line(line, self._format)
 
             # If line is not formatted, we treat it as a continuation of previous line
-            if not matched_items:
+            if matched_items is None:
                 msg = "Line: %s does not match format: %s" % (line, self._format.pattern)
                 msg += "Assuming, it's a continuation of previous line"
                 logger.debug(msg)
-                current_line += "\n%s" % line
-                continue
-            else:
-                current_line = line
-
-            # Match parsed line items to user suppplied "filters"
-            filter_match = self._filter_match(matched_items, filters)
-
-            if filter_match:
-                if highlight:
-                    current_line = self._highlight_line(current_line, highlight)
+                if self._pending_items is not None:
+                    self._add_continuation(line, filters, highlight)
                 else:
-                    current_line = self._color_line(current_line)
-            else:
-                logger.debug("Line: %s does not match filters: %s. Skipping" % \
-                    (current_line, filters))
-                current_line = ""
+                    logger.debug("Line: %s does not have a 'start of the record'. Skipping" % line)
                 continue
 
-            # MAIN output of FileTailer
-            print "%s %s" % (self._label, current_line)
-            current_line = ""
+            self._emit_record(filters, highlight)
+            self._start_record(matched_items, line)
+
+        if flush:
+            self._emit_record(filters, highlight)
 
 
     ###############################################################################
@@ -221,25 +318,70 @@ class FileTailer(object):
         return self._file_name
 
 
+    @property
+    def label(self):
+        return self._raw_label
+
+
+    @property
+    def color(self):
+        return self._color
+
+
+    @property
+    def exhausted(self):
+        return self._source.exhausted
+
+
+    @property
+    def bytes_behind(self):
+        return self._source.bytes_behind
+
+
+    @property
+    def live(self):
+        return self._live
+
+
     ###############################################################################
     # PUBLIC ROUTINES
     ###############################################################################
 
-    def open(self, open_at_top):
+    def open(self, open_at_top, last_records=None):
         """ Open file
 
+            last_records: Start from the last N records (rather than from the top or from the end)
+
             return False if the file cannot be opened for some reason
         """
-        if not self._file_handle:
-            print "[+ LOG] %s %s" % (self._label, self._color_line("Following log file: %s" % self._file_name))
+        if not self._source.is_open:
+            print "[+ LOG] %s %s" % (self._label, self._color_line("Following %s: %s" % \
+                (self._source.DESCRIPTION, self._file_name)))
             # logger.info("Opening log file: %s" % self._file_name)
-            return self._open_at(self._file_name, open_at_top)
+            if not self._source.open(open_at_top):
+                return False
+
+            # Otherwise, records are 'history' until the first time we catch up with the writer (see: tail())
+            self._live = not open_at_top and not last_records
+
+            if last_records:
+                self._source.seek_last_records(last_records, lambda line: self._format.match(line.strip()))
+
+            return True
 
 
     def close(self):
         """ Close file
+
+            'Pending' record (i.e. the last stack trace, before the process closed its log) is emitted first
         """
-        print "[- LOG] %s %s" % (self._label, self._color_line("Unfollowing log file: %s" % self._file_name))
+        self.flush()
+        for listener in self._listeners:
+            on_close = getattr(listener, 'on_close', None)
+            if on_close:
+                on_close(self)
+        print "[- LOG] %s %s" % (self._label, self._color_line("Unfollowing %s: %s" % \
+            (self._source.DESCRIPTION, self._file_name)))
         self._close()
 
 
@@ -253,15 +395,43 @@ class FileTailer(object):
 
         # If for whatever reason the file was not open (open() not called) -> force open
         # And go to the end of the file
-        if not self._file_handle:
-            self._open_at(self._file_name, open_at_top=False)
+        if not self._source.is_open:
+            self._live = self._source.open(open_at_top=False)
+
+        self._filters, self._highlight = filters, highlight
+
+        logger.debug("Tailing: %s file" % self._file_name)
+        lines = self._source.read_lines(self._limits.max_line_length)
+
+        if not lines:
+            self._emit_record(filters, highlight)
+            self._live = True
+            return
 
-        logger.debug("Tailing: %s file" % self._file_handle.name)
-        where = self._file_handle.tell()
-        lines = self._file_handle.readlines()
+        # Records are 'complete' when the next record starts or when no more lines are coming
+        self._process_lines(lines, filters, highlight, flush=not self._multi_line or self.exhausted)
 
-        if lines:
-            self._process_lines(lines, filters, highlight)
+
+    def render(self, text, highlight):
+        """ Render record text for output: prepend label, colorize and highlight
+        """
+        if highlight:
+            text = self._highlight_line(text, highlight)
         else:
-            logger.debug("No new lines in file: %s" % self._file_handle.name)
-            self._file_handle.seek(where)
+            text = self._color_line(text)
+
+        return "%s %s" % (self._label, text)
+
+
+    def feed(self, lines, filters, highlight):
+        """ Process lines that were not read from the file, i.e. 'replayed'
+        """
+        self._filters, self._highlight = filters, highlight
+        self._process_lines([self._limits.truncate_line(_) for _ in lines], filters, highlight, flush=True)
+
+
+    def flush(self):
+        """ Emit 'pending' record right away (with the latest filters and highlight),
+            i.e. before exiting, as no more continuation lines are coming
+        """
+        self._emit_record(self._filters, self._highlight)
@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+""" LagTracker: Measure how far behind the 'writers' ptail is, for each followed log
+
+    Two 'lag' measurements:
+        bytes behind: file size - current read offset (sampled on each poll, before reading)
+        time behind:  wall clock - record timestamp ('ts' field, if log 'format' has one)
+
+    Recent samples are kept per log, so that p50/p99 can be reported (see: PtailMetrics())
+    and checked against the 'lag budget'
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+
+from collections import deque
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# 'Timestamp' field name (see: 'format' in LogSetup)
+TIMESTAMP_FIELD = 'ts'
+
+# Timestamp 'prefix': 2016-06-05 18:08:43,972 or 2016-06-05T18:08:43.972 (local time is assumed)
+RE_TIMESTAMP = re.compile(r'^\s*(\d{4})-(\d{2})-(\d{2})[T\s]+(\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?')
+
+# glog timestamp (no year): 0605 18:08:43.972000 (the latest year, that does not put it in the future, is assumed)
+RE_GLOG_TIMESTAMP = re.compile(r'^\s*(\d{2})(\d{2})\s+(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?')
+
+# How far in the future (i.e. clock skew) a year-less timestamp may be, before it is considered to be from the last year
+MAX_FUTURE_SKEW = 86400
+
+# Number of (most recent) samples to keep per log
+LAG_WINDOW = 1024
+
+# Reported quantiles
+QUANTILES = (0.5, 0.99)
+
+# Lag 'kinds'
+LAG_BYTES = 'bytes'
+LAG_SECONDS = 'seconds'
+
+# How often to repeat 'lag budget exceeded' warning (for the same log), in seconds
+WARNING_INTERVAL = 60
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def _to_epoch(year, month, day, hour, minute, second, fraction):
+    """ (local time) timestamp parts -> epoch seconds (None: invalid timestamp)
+    """
+    try:
+        epoch = time.mktime((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+    return epoch + (float("0." + fraction) if fraction else 0)
+
+
+def parse_timestamp(value, now=None):
+    """ Parse (log record) timestamp into epoch seconds
+
+        now: 'Current' time, to complete year-less (glog) timestamps with (default: time.time())
+
+        Returns: None if the value does not look like a timestamp
+    """
+    matched = RE_TIMESTAMP.match(value) if value else None
+    if matched:
+        return _to_epoch(*matched.groups())
+
+    matched = RE_GLOG_TIMESTAMP.match(value) if value else None
+    if not matched:
+        return None
+
+    now = now or time.time()
+    year = time.localtime(now).tm_year
+    epoch = _to_epoch(year, *matched.groups())
+    if epoch is not None and epoch > now + MAX_FUTURE_SKEW:
+        # i.e. December records, read in January
+        epoch = _to_epoch(year - 1, *matched.groups())
+
+    return epoch
+
+
+def quantile(sorted_values, q):
+    """ 'Nearest rank' quantile of (sorted) values
+    """
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LagTracker(object):
+    """ Per log 'ingest lag' samples: bytes and seconds behind the writer
+    """
+
+    def __init__(self, budget=None):
+        """ CONSTRUCTOR
+
+            budget: Max acceptable 'time behind', in seconds (None: do not check)
+        """
+        self._budget = budget
+
+        self._samples = {}     # {(label, kind): deque([lag, ...])}
+        self._lock = threading.Lock()  # Samples are read by 'metrics' thread
+
+        self._last_ts_lag = {}  # {label: latest 'time behind' since the last budget check}
+        self._warned = {}       # {label: last 'budget exceeded' warning time}
+
+        logger.debug("LagTracker() successfully initialized with budget: %s" % budget)
+
+
+    def _add_sample(self, label, kind, value):
+        key = (label, kind)
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=LAG_WINDOW)
+            self._samples[key].append(value)
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    def on_poll(self, tailer):
+        """ Sample 'bytes behind' for the log, right before it is read
+        """
+        behind = tailer.bytes_behind
+        if behind is not None:
+            self._add_sample(tailer.label, LAG_BYTES, behind)
+
+
+    @property
+    def fields(self):
+        """ Record fields that lag is calculated from, see: FileTailer() 'listeners' """
+        return frozenset((TIMESTAMP_FIELD,))
+
+
+    def on_record(self, tailer, items, text):
+        """ Sample 'time behind' from record timestamp, see: FileTailer() 'listeners'
+
+            Only 'live' records are sampled: history (-b/--from-top, -n/--last or replay) is behind by definition
+        """
+        if not tailer.live:
+            return
+
+        ts = parse_timestamp(items.get(TIMESTAMP_FIELD)) if items else None
+        if ts is None:
+            return
+
+        lag = max(0, time.time() - ts)
+        self._add_sample(tailer.label, LAG_SECONDS, lag)
+        self._last_ts_lag[tailer.label] = lag
+
+
+    def on_close(self, tailer):
+        """ Forget the log when it is closed, see: FileTailer() 'listeners'
+        """
+        self.forget(tailer.label)
+
+
+    def forget(self, label):
+        """ Drop samples and budget state for the log
+        """
+        with self._lock:
+            for kind in (LAG_BYTES, LAG_SECONDS):
+                self._samples.pop((label, kind), None)
+
+        self._last_ts_lag.pop(label, None)
+        self._warned.pop(label, None)
+
+
+    def quantiles(self):
+        """ Lag quantiles: {(label, kind): [(quantile, value), ...]}
+        """
+        with self._lock:
+            samples = [(k, sorted(v)) for k, v in self._samples.items() if v]
+
+        return dict((k, [(q, quantile(v, q)) for q in QUANTILES]) for k, v in samples)
+
+
+    def check_budget(self):
+        """ Return [(label, lag), ...] for logs, whose latest 'time behind' (since the last check) exceeds 'lag budget'
+
+            The same log is reported at most every WARNING_INTERVAL seconds
+        """
+        exceeded = []
+        if not self._budget:
+            return exceeded
+
+        now = time.time()
+        for label, lag in self._last_ts_lag.items():
+            if lag > self._budget and now - self._warned.get(label, 0) >= WARNING_INTERVAL:
+                self._warned[label] = now
+                exceeded.append((label, lag))
+        self._last_ts_lag = {}
+
+        return exceeded
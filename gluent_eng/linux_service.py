@@ -59,7 +59,8 @@ class LinuxService(object):
     """
     SUPPORTED_COMMANDS = ['start', 'stop', 'status']
 
-    def __init__(self, config_file, root_user=DEFAULT_ROOT_USER, host=None, log_filter=None, extended=False, wait=None):
+    def __init__(self, config_file, root_user=DEFAULT_ROOT_USER, host=None, log_filter=None, extended=False, wait=None,
+        cache_dir=None):
         """ CONSTRUCTOR
             
             Parameters:
@@ -74,6 +75,7 @@ class LinuxService(object):
                 4: extended: True|False - whether to display 'extended' service info,
                        such as ports, log files etc
                 5: wait: Default 'wait' in seconds after each command is run (None: 'do not wait')
+                6: cache_dir: Directory to keep (extended output) discovery caches in, see: ProcessLogs()
         """
         self._services = self._read_config(config_file)
 
@@ -86,7 +88,7 @@ class LinuxService(object):
         if extended:
             self._extended = True
             self._ports = self._get_all_ports()
-            self._plogs = ProcessLogs(user=self._root_user, host=self._host, log_filter=log_filter)
+            self._plogs = ProcessLogs(user=self._root_user, host=self._host, log_filter=log_filter, cache_dir=cache_dir)
         else:
             self._extended = False
             self._ports = {}
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+""" LogDiscovery: Discover process logs in a background thread
+
+    so that (potentially slow) discovery: pgrep, ls /proc/<pid>/fd, file etc
+    never blocks 'tailing'
+
+    Each discovery is published as an immutable LogSnapshot() (with its own copy of log metadata),
+    'tailing' thread picks up the latest one whenever it is ready
+"""
+
+import copy
+import logging
+import sys
+import threading
+import time
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# How long to wait before retrying, when 'refresh interval' is not set and no logs were found
+DEFAULT_RETRY_INTERVAL = 0.5
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class LogSnapshot(object):
+    """ Immutable 'log discovery' result
+    """
+    __slots__ = ('_version', '_logs', '_taken_at', '_changes')
+
+    def __init__(self, version, logs, taken_at, changes=None):
+        """ CONSTRUCTOR
+
+            version:  Snapshot sequence number
+            logs:     {log: {'color': ..., 'format': ..., 'label': ..., 'processes': ...}, ...} (see: ProcessLogs())
+            taken_at: Time the snapshot was taken
+            changes:  ([added log, ...], [removed log, ...]) since the previous snapshot (None: unknown)
+        """
+        self._version = version
+        self._logs = logs
+        self._taken_at = taken_at
+        self._changes = changes
+
+
+    @property
+    def version(self):
+        return self._version
+
+
+    @property
+    def logs(self):
+        return self._logs
+
+
+    @property
+    def taken_at(self):
+        return self._taken_at
+
+
+    @property
+    def changes(self):
+        return self._changes
+
+
+class LogDiscovery(object):
+    """ Background log discovery
+    """
+
+    def __init__(self, discover, refresh_interval, changes=None):
+        """ CONSTRUCTOR
+
+            discover:         Callable that returns {log: log metadata} (i.e. ProcessLogs().by_name with bound arguments)
+            refresh_interval: Discover logs every N seconds (None or 0: discover once, or until logs are found)
+            changes:          Callable that returns ([added log, ...], [removed log, ...]) by the latest discovery
+                              (i.e. ProcessLogs().changes). None: snapshots do not carry changes
+        """
+        self._discover = discover
+        self._refresh_interval = refresh_interval
+        self._changes = changes
+
+        self._snapshot = None     # Latest LogSnapshot()
+        self._error = None        # Latest discovery 'exception info' (to be re-raised in the 'tailing' thread)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ptail-discovery')
+        self._thread.daemon = True
+
+        logger.debug("LogDiscovery() successfully initialized")
+
+
+    def _run(self):
+        """ Discovery 'loop'
+        """
+        version = 0
+
+        while not self._stop.isSet():
+            start = time.time()
+            try:
+                logs = self._discover()
+            except Exception:
+                logger.warn("Log discovery failed. Exception: %s" % sys.exc_info()[1])
+                self._error = sys.exc_info()
+                break
+
+            version += 1
+            changes = self._changes() if self._changes else None
+            # Discovery re-uses (and changes) its results on the next refresh, so the snapshot gets a copy
+            self._snapshot = LogSnapshot(version, copy.deepcopy(logs), time.time(), changes)
+            logger.debug("Published log snapshot: %d with: %d logs in: %.3f seconds" % \
+                (version, len(logs), time.time() - start))
+
+            if not self._refresh_interval:
+                if logs:
+                    break
+                self._stop.wait(DEFAULT_RETRY_INTERVAL)
+            else:
+                self._stop.wait(self._refresh_interval)
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    def start(self):
+        """ Start discovery thread
+        """
+        logger.info("Starting background log discovery. Refresh interval: %s" % self._refresh_interval)
+        self._thread.start()
+
+
+    def stop(self):
+        """ Request discovery thread to stop
+        """
+        self._stop.set()
+
+
+    def latest(self):
+        """ Return the latest LogSnapshot() (or None if discovery has not completed yet)
+
+            Re-raises discovery exception (if any)
+        """
+        if self._error:
+            exc_type, exc_value, exc_traceback = self._error
+            raise exc_type, exc_value, exc_traceback
+
+        return self._snapshot
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+""" LogLayouts: Declarative log line 'layouts', an alternative to hand written (named group) regex 'format'
+
+    Layout is a sequence of:
+
+        {name}          Field, up to the next literal (or to the end of the line, if it is the last one)
+        {name:N}        Fixed width field (N characters)
+        {name*}         The rest of the line
+        {name:type}     Field with 'type' (also: {name:N:type}). Types:
+                            ts    - starts and ends with a digit
+                            level - letters, i.e. INFO, WARN or glog's I, W, E, F
+                            num   - digits
+                            word  - no spaces
+        ' ' (space)     One or more spaces (or tabs)
+        anything else   Literal text ('{{' for a literal '{')
+
+    i.e. log4j: '{ts:23:ts} {level:level} [{id}]: {text*}' parses:
+        2016-06-05 18:11:34,797 DEBUG [Thread-0]: ipc.Client (Client.java:stop(1243)) - Stopping client
+
+    Layouts are compiled into anchored regular expressions that cannot backtrack 'catastrophically':
+    fixed width fields, fields delimited by 'anything but the next literal' and no nested quantifiers.
+    That keeps matching in 're' C code (faster than python level str.find/slicing parsers)
+    while making the cost of a match linear in line length
+"""
+
+import logging
+import re
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class LogLayoutException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Built-in layouts
+BUILTIN_LAYOUTS = {
+    # 2016-06-05 18:11:34,797 DEBUG [Thread-0]: ipc.Client (Client.java:stop(1243)) - Stopping client
+    'log4j': '{ts:23:ts} {level:level} [{id}]: {text*}',
+    # I0607 17:56:13.313000  1234 controller.cc:123] leader imbalance ratio is 0.000000
+    'glog': '{level:1:level}{ts:20:ts} {thread:num} {source}] {text*}',
+    # [2016-06-07 17:56:13,313] TRACE [Controller 0]: leader imbalance ratio for broker 0 is 0.000000 (kafka.controller.KafkaController)
+    'kafka': '[{ts:23:ts}] {level:level} {text*}',
+}
+
+# Field types: (fixed width regex with: %(width)d and %(inner)d = width - 2,
+#               variable width regex: as is or (head, character class with: %(stop)s, repeat), see: variable_field())
+FIELD_TYPES = {
+    'ts': (r'\d.{%(inner)d}\d', (r'\d', r'[^%(stop)s]', '*')),
+    'level': (r'[A-Za-z]{%(width)d}', r'[A-Za-z]+'),
+    'num': (r'\d{%(width)d}', r'\d+'),
+    'word': (r'\S{%(width)d}', ('', r'[^\s%(stop)s]', '+')),
+}
+UNTYPED = (r'.{%(width)d}', ('', r'[^%(stop)s]', '*'))
+
+RE_LAYOUT_TOKEN = re.compile(r'\{\{|\{(?P<name>\w+)(?P<rest>\*|(?::\w+){0,2})\}|[ \t]+|[^{ \t]+')
+
+# Token 'kinds'
+LITERAL = 'literal'
+SPACES = 'spaces'
+FIELD = 'field'
+
+SPACES_REGEX = r'[ \t]+'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def tokenize(layout):
+    """ Split layout into tokens: (LITERAL, text), (SPACES, None), (FIELD, (name, width, type, rest))
+    """
+    tokens = []
+    position = 0
+
+    while position < len(layout):
+        matched = RE_LAYOUT_TOKEN.match(layout, position)
+        if not matched:
+            raise LogLayoutException("Invalid layout: %s at: %d" % (layout, position))
+        position = matched.end()
+        token = matched.group(0)
+
+        if matched.group('name'):
+            name, rest = matched.group('name'), matched.group('rest')
+            width, field_type = None, None
+            for option in rest.split(':')[1:] if '*' != rest else []:
+                if option.isdigit() and int(option) > 0:
+                    width = int(option)
+                elif option in FIELD_TYPES:
+                    field_type = option
+                else:
+                    raise LogLayoutException("Invalid field option: %s in layout: %s" % (option, layout))
+            if 'ts' == field_type and width and width < 2:
+                raise LogLayoutException("Timestamp field: %s must be at least 2 characters wide" % name)
+            tokens.append((FIELD, (name, width, field_type, '*' == rest)))
+        elif token[0] in ' \t':
+            tokens.append((SPACES, None))
+        else:
+            text = '{' if '{{' == token else token
+            if tokens and LITERAL == tokens[-1][0]:
+                tokens[-1] = (LITERAL, tokens[-1][1] + text)
+            else:
+                tokens.append((LITERAL, text))
+
+    return tokens
+
+
+def variable_field(variable, following):
+    """ Variable width field regex, that ends where the 'following' literal (or spaces) starts
+
+        The first character of multi character literal is still allowed in the field,
+        if the rest of the literal does not follow it, i.e. '{a}::{b*}' matches: 'x:y::z' with a: 'x:y'
+    """
+    if isinstance(variable, basestring):
+        return variable
+
+    head, chars, repeat = variable
+    if LITERAL != following[0]:
+        return head + chars % {'stop': r' \t'} + repeat
+
+    literal = following[1]
+    chars = chars % {'stop': re.escape(literal[0])}
+    if len(literal) > 1:
+        chars = '(?:%s|%s(?!%s))' % (chars, re.escape(literal[0]), re.escape(literal[1:]))
+
+    return head + chars + repeat
+
+
+def compile_layout(layout):
+    """ Compile layout (or built-in layout name, see: BUILTIN_LAYOUTS) into (named group) regex 'format'
+    """
+    layout = BUILTIN_LAYOUTS.get(layout, layout)
+    tokens = tokenize(layout)
+    parts = ['^']
+
+    for i, (kind, arg) in enumerate(tokens):
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+
+        if LITERAL == kind:
+            parts.append(re.escape(arg))
+        elif SPACES == kind:
+            parts.append(SPACES_REGEX)
+        else:
+            name, width, field_type, rest = arg
+            fixed, variable = FIELD_TYPES[field_type] if field_type else UNTYPED
+
+            if rest or (not width and not following):
+                field = '.*'
+            elif width:
+                field = fixed % {'width': width, 'inner': width - 2}
+            elif FIELD == following[0]:
+                raise LogLayoutException("Field: %s in layout: %s must have a width, as it is followed by another field" % \
+                    (name, layout))
+            else:
+                field = variable_field(variable, following)
+            parts.append('(?P<%s>%s)' % (name, field))
+
+    if not (tokens and FIELD == tokens[-1][0] and (tokens[-1][1][3] or not tokens[-1][1][1])):
+        parts.append('$')
+
+    regex = "".join(parts)
+    logger.debug("Compiled layout: %s into format: %s" % (layout, regex))
+
+    return regex
@@ -5,17 +5,21 @@
 import logging
 import os.path
 import re
-import yaml
+import threading
 
 from collections import OrderedDict
 
 from .color_chooser import ColorChooser
+from .log_layouts import compile_layout, LogLayoutException
+from .record_guard import check_backtracking
 
 
 ###############################################################################
 # EXCEPTIONS
 ###############################################################################
 
+class LogSetupException(Exception): pass
+
 
 ###############################################################################
 # CONSTANTS
@@ -24,6 +28,22 @@ from .color_chooser import ColorChooser
 # Default 'log entry' format
 DEFAULT_LOG_ENTRY = '^(?P<text>.*)$'
 
+# Named group (or escaped character, to skip over) in 'format'
+RE_NAMED_GROUP = re.compile(r'\\.|\(\?P<(\w+)>')
+
+# Group name prefix for patterns in 'combined' pattern (see: LogSetup._make_dispatch())
+PATTERN_GROUP = '_p'
+
+# Max number of groups in 'combined' pattern (python 2 limit is 100)
+MAX_DISPATCH_GROUPS = 99
+
+# (Numbered or named) back references: patterns with these cannot be safely combined
+RE_BACK_REFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+# Reserved (non 'log pattern') setup file sections
+SECTION_RULES = 'rules'
+RESERVED_SECTIONS = (SECTION_RULES,)
+
 
 ###############################################################################
 # LOGGING
@@ -32,15 +52,41 @@ logger = logging.getLogger(__name__)
 #logger.addHandler(logging.NullHandler()) # Disabling logging by default
 
 
+def reduce_format(line_format, fields):
+    """ Reduce format to only capture 'fields', i.e. for: fields=['level']
+            ^(?P<ts>\S+) (?P<level>\w+) (?P<text>.*)$ -> ^(?:\S+) (?P<level>\w+) (?:.*)$
+
+        Groups that are 'back referenced' (?P=name) are kept
+        fields: None - keep all named groups
+    """
+    if fields is None:
+        return line_format
+
+    def replace(matched):
+        name = matched.group(1)
+        if not name or name in fields or '(?P=%s)' % name in line_format:
+            return matched.group(0)
+        return '(?:'
+
+    return RE_NAMED_GROUP.sub(replace, line_format)
+
+
 class LogSetup(object):
     """ Manage relevant "log setup" metadata, i.e. colors, formats and labels
+
+        Thread safe: log metadata is requested by both 'tailing' and 'log discovery' threads
     """
 
     def __init__(self, setup_file):
         """ CONSTRUCTOR
         """
+        self._sections = {}                        # 'Reserved' sections from setup file (i.e. 'rules')
+        self._warnings = []                        # Setup problems, i.e. 'backtracking prone' formats
         self._setup = self._read_setup(setup_file) # 'Metadata' from setup file (generic: 'log patterns')
+        self._patterns = list(self._setup)         # ... log patterns in 'match' order
+        self._dispatch = self._make_dispatch()     # ... log patterns, combined into 'alternation' regex(es)
         self._log_meta = {}                        # Final 'log file' metadata  (specific: 'log files')
+        self._lock = threading.RLock()             # Guards: _log_meta and _colors
 
         # Supporting objects
         self._colors = ColorChooser()  # Chose random colors, if colors are not specified
@@ -52,10 +98,12 @@ class LogSetup(object):
     # PRIVATE ROUTINES
     ###########################################################################
 
-    def _ordered_yaml_load(self, stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
+    def _ordered_yaml_load(self, stream, Loader=None, object_pairs_hook=OrderedDict):
         """ Load YAML entries in the order they appear in the file
         """
-        class OrderedLoader(Loader):
+        import yaml  # Slow to import, only needed if there is a setup file
+
+        class OrderedLoader(Loader or yaml.Loader):
             pass
 
         def construct_mapping(loader, node):
@@ -73,15 +121,20 @@ class LogSetup(object):
             Expected contents:
                 log name pattern:
                     color: ...
-                    format: ...
+                    format: ... (or: layout: ..., see: LogLayouts)
                     label: ...
                 ...
 
+                rules: ...
+                ...
+
             All keys are optional
+            'Reserved' keys (see: RESERVED_SECTIONS) are not log patterns
+            and are kept separately (see: get_section())
         """
         if not setup_file:
             logger.debug("Setup file (YAML) is not specified. Returning: 'empty setup'")
-            return {}
+            return OrderedDict()
 
         data = {}
         logger.info("Reading log metadata from config file (YAML): %s" % setup_file)
@@ -94,14 +147,100 @@ class LogSetup(object):
 
         logger.debug("Setup data: %s" % data)
 
+        data = data or {}
+        for section in RESERVED_SECTIONS:
+            if section in data:
+                self._sections[section] = data.pop(section)
+                logger.debug("Extracted reserved section: %s from setup" % section)
+
         return self._compile_setup_patterns(data)
 
 
     def _compile_setup_patterns(self, setup):
         """ Regex compile setup patterns
+
+            (compile 'layouts' into formats and replace 'catastrophic backtracking' prone formats with plain text)
+        """
+        for pattern in setup:
+            layout = setup[pattern].get('layout') if setup[pattern] else None
+            if layout:
+                try:
+                    setup[pattern]['format'] = compile_layout(layout)
+                except LogLayoutException, e:
+                    raise LogSetupException("Invalid layout for: %s. Exception: %s" % (pattern, e))
+                logger.debug("Layout: %s for: %s compiled into format: %s" % (layout, pattern, setup[pattern]['format']))
+                continue  # Compiled layouts do not backtrack
+
+            line_format = setup[pattern].get('format') if setup[pattern] else None
+            issues = check_backtracking(line_format) if line_format else []
+            if issues:
+                # python 're' cannot be interrupted mid-match, so such formats are not used at all
+                self._warnings.append("Format for: %s may backtrack catastrophically: %s. Using plain text instead" % \
+                    (pattern, ", ".join(issues)))
+                logger.warn(self._warnings[-1])
+                setup[pattern]['format'] = DEFAULT_LOG_ENTRY
+
+        # Keep patterns in the order they appear in the file (the first match wins)
+        return OrderedDict((re.compile(k), setup[k]) for k in setup)
+
+
+    def _make_dispatch(self):
+        """ Combine log patterns into a (few) 'alternation' regex(es), so that all patterns are scanned in one pass, i.e.:
+
+            (?:hive)(?P<_p0>)|(?:hive-metadata)(?P<_p1>)
+
+            (python 2 allows at most 100 groups per regex, so patterns are combined in 'chunks')
+
+            Returns: [(combined regex, index of the first pattern in it), ...]
+                     or None (and patterns are matched one by one) if patterns cannot be combined,
+                     i.e. they use flags, numbered back references or the same group names
         """
-        #return {re.compile(_): setup[_] for _ in setup} 2.7+ only
-        return dict((re.compile(k), setup[k]) for k in setup)
+        if any(_.flags or RE_BACK_REFERENCE.search(_.pattern) for _ in self._patterns):
+            logger.warn("Flags or back references in log patterns. Matching them one by one")
+            return None
+
+        dispatch = []
+        chunk, groups, first = [], 0, 0
+
+        for i, pattern in enumerate(self._patterns + [None]):
+            if chunk and (pattern is None or groups + pattern.groups + 1 > MAX_DISPATCH_GROUPS):
+                try:
+                    dispatch.append((re.compile("|".join(chunk)), first))
+                except (re.error, AssertionError), e:
+                    logger.warn("Unable to combine log patterns: %s. Matching them one by one" % e)
+                    return None
+                chunk, groups, first = [], 0, i
+
+            if pattern is not None:
+                chunk.append("(?:%s)(?P<%s%d>)" % (pattern.pattern, PATTERN_GROUP, i))
+                groups += pattern.groups + 1
+
+        return dispatch
+
+
+    def _dispatch_pattern(self, log_file):
+        """ Find the first (in setup order) pattern that matches log file name, with 'combined' regex(es)
+
+            Combined regex finds the leftmost match, where alternatives are tried in order.
+            Patterns that come earlier in setup may still match further in the name,
+            so the search continues from the next position, until the best pattern is known
+        """
+        for combined, first in self._dispatch:
+            found = None
+            matched = combined.search(log_file)
+
+            while matched:
+                idx = int(matched.lastgroup[len(PATTERN_GROUP):])
+                if found is None or idx < found:
+                    found = idx
+                if first == found:
+                    break
+                matched = combined.search(log_file, matched.start() + 1)
+
+            if found is not None:
+                return self._patterns[found]
+
+        return None
 
 
     def _get_setup(self, log_file):
@@ -121,12 +260,19 @@ class LogSetup(object):
                     color: red
         """
         meta = {}
+        found = None
 
-        for pattern in self._setup:
-            if pattern.search(log_file):
-                logger.debug("Found pattern: %s for log_file: %s" % (pattern.pattern, log_file))
-                meta = self._setup[pattern]
-                break
+        if self._dispatch:
+            found = self._dispatch_pattern(log_file)
+        else:
+            for pattern in self._patterns:
+                if pattern.search(log_file):
+                    found = pattern
+                    break
+
+        if found:
+            logger.debug("Found pattern: %s for log_file: %s" % (found.pattern, log_file))
+            meta = self._setup[found]
 
         logger.debug("Metadata for log file: %s is: %s" % (log_file, meta))
         return meta
@@ -134,6 +280,8 @@ class LogSetup(object):
 
     def _init_log_entry(self, log_file):
         """ Initialize log entry for a specific log from 'setup' or otherwise
+
+            (must be called with _lock held)
         """
         if log_file not in self._log_meta:
             log_meta = self._get_setup(log_file)
@@ -161,13 +309,57 @@ class LogSetup(object):
     # PUBLIC ROUTINES
     ###########################################################################
 
+    def get_section(self, section):
+        """ Get 'reserved' (non log pattern) section from setup file, i.e. 'rules'
+
+            Default: None
+        """
+        assert section in RESERVED_SECTIONS
+        return self._sections.get(section)
+
+
+    @property
+    def warnings(self):
+        return self._warnings
+
+
+    def get_formats(self):
+        """ Get (log pattern, format) pairs from setup, in 'match' order,
+            i.e. to be 'pushed down' to remote agents (see: RemoteAgent())
+
+            Format is None if not specified
+        """
+        return [(_.pattern, self._setup[_].get('format') if self._setup[_] else None) for _ in self._setup]
+
+
+    def get_meta(self, log_file):
+        """ Get 'color', 'format' and 'label' for specific log file in one go
+
+            Returns: {'color': ..., 'format': ..., 'label': ...} (see: get_color(), get_format(), get_label())
+        """
+        with self._lock:
+            self._init_log_entry(log_file)
+            log_meta = self._log_meta[log_file]
+
+            return {'color': log_meta['color'], 'format': log_meta['format'], 'label': log_meta['label']}
+
+
+    def forget(self, log_files):
+        """ Drop cached metadata for log files that are gone
+        """
+        with self._lock:
+            for log_file in log_files:
+                self._log_meta.pop(log_file, None)
+
+
     def get_color(self, log_file):
         """ Get 'color' for specific log file
 
             Default: random color
         """
-        self._init_log_entry(log_file)
-        return self._log_meta[log_file]['color']
+        with self._lock:
+            self._init_log_entry(log_file)
+            return self._log_meta[log_file]['color']
 
 
     def get_format(self, log_file):
@@ -175,8 +367,9 @@ class LogSetup(object):
 
             Default: DEFAULT_LOG_ENTRY
         """
-        self._init_log_entry(log_file)
-        return self._log_meta[log_file]['format']
+        with self._lock:
+            self._init_log_entry(log_file)
+            return self._log_meta[log_file]['format']
 
 
     def get_label(self, log_file):
@@ -184,5 +377,6 @@ class LogSetup(object):
 
             Default: None (which means it should be replaced later)
         """
-        self._init_log_entry(log_file)
-        return self._log_meta[log_file]['label']
+        with self._lock:
+            self._init_log_entry(log_file)
+            return self._log_meta[log_file]['label']
@@ -0,0 +1,400 @@
+#! /usr/bin/env python
+""" LogSource: Where FileTailer() reads lines from
+
+        FileSource:   Regular file (seekable, can be read 'from the top' or 'from the end')
+        StreamSource: stdin or named pipe (non-seekable, read in non-blocking 'chunks')
+
+    Both sources only return 'complete' lines. Incomplete last line is kept until the rest of it arrives.
+    Sources read in bounded 'chunks' and truncate long lines as they are read (see: LineBuffer)
+"""
+
+import atexit
+import errno
+import fcntl
+import logging
+import os
+import os.path
+import stat
+import sys
+
+from .record_guard import TRUNCATED_LINE
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class LogSourceException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# 'Source name' for stdin
+STDIN_SOURCE = '-'
+STDIN_NAME = 'stdin'
+
+# Read 'chunk' size and max number of chunks to read from a stream in one go (so that one stream cannot starve the others)
+READ_CHUNK_SIZE = 64 * 1024
+READ_MAX_CHUNKS = 16
+
+# Block size for 'backward' reads (when looking for the last N records)
+BACKWARD_BLOCK_SIZE = 64 * 1024
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class LineBuffer(object):
+    """ Assemble 'complete' lines from data chunks
+
+        Lines longer than max_line_length are truncated as they are read,
+        so that the incomplete last line never grows beyond max_line_length
+    """
+
+    def __init__(self):
+        """ CONSTRUCTOR
+        """
+        self._partial = []       # Incomplete (i.e. still being written) last line, in pieces
+        self._partial_size = 0   # ... its (kept) size
+        self._dropped = 0        # ... and how many characters were dropped from it
+
+
+    def _append(self, piece, max_line_length):
+        """ Append piece to the incomplete line, dropping what does not fit into max_line_length
+        """
+        if max_line_length is not None and self._partial_size + len(piece) > max_line_length:
+            room = max(0, max_line_length - self._partial_size)
+            self._dropped += len(piece) - room
+            piece = piece[:room]
+
+        if piece:
+            self._partial.append(piece)
+            self._partial_size += len(piece)
+
+
+    def _take(self):
+        """ Return the incomplete line as 'complete' and start a new one
+        """
+        line = "".join(self._partial)
+        if self._dropped:
+            line += TRUNCATED_LINE % self._dropped
+
+        self._partial, self._partial_size, self._dropped = [], 0, 0
+
+        return line + '\n'
+
+
+    @property
+    def pending(self):
+        """ True if there is an incomplete line """
+        return bool(self._partial_size or self._dropped)
+
+
+    def add(self, data, max_line_length=None):
+        """ Add data chunk and return 'complete' lines (truncated to max_line_length + TRUNCATED_LINE marker)
+        """
+        pieces = data.split('\n')
+        last = pieces.pop()
+        lines = []
+
+        if pieces:
+            self._append(pieces[0], max_line_length)
+            lines.append(self._take())
+
+            for piece in pieces[1:]:
+                if max_line_length is not None and len(piece) > max_line_length:
+                    piece = piece[:max_line_length] + TRUNCATED_LINE % (len(piece) - max_line_length)
+                lines.append(piece + '\n')
+
+        self._append(last, max_line_length)
+
+        return lines
+
+
+    def flush(self):
+        """ Return the incomplete line (as 'complete'), i.e. when no more data is coming
+        """
+        return [self._take()] if self.pending else []
+
+
+class FileSource(object):
+    """ Regular file source
+    """
+    DESCRIPTION = 'log file'
+
+    def __init__(self, file_name):
+        """ CONSTRUCTOR
+        """
+        self._file_name = file_name
+        self._file_handle = None
+        self._buffer = LineBuffer()
+
+
+    def _open_at(self, file_name, open_at_top):
+        """ Open file name either "at the top" or "at_the_end"
+
+            returns False if the file cannot be open
+        """
+
+        if not os.path.isfile(file_name):
+            logger.warn("Unable to locate file: %s" % file_name)
+            return False
+
+        logger.debug("Opening file: %s" % file_name)
+        self._file_handle = open(file_name)
+
+        if not open_at_top:
+            self._file_handle.seek(0, 2) # Set position to the end of the file
+
+        return True
+
+
+    @property
+    def name(self):
+        return self._file_name
+
+
+    @property
+    def is_open(self):
+        return self._file_handle is not None
+
+
+    @property
+    def exhausted(self):
+        """ Files can always grow """
+        return False
+
+
+    @property
+    def bytes_behind(self):
+        """ How many bytes are written, but not read yet (None: file is not open) """
+        if not self._file_handle:
+            return None
+        return max(0, os.fstat(self._file_handle.fileno()).st_size - self._file_handle.tell())
+
+
+    def open(self, open_at_top):
+        """ Open file
+
+            returns False if the file cannot be open
+        """
+        return self._open_at(self._file_name, open_at_top)
+
+
+    def seek_last_records(self, count, is_head):
+        """ Position file at the start of the last 'count' records
+            by reading it backwards from the end, in BACKWARD_BLOCK_SIZE blocks
+
+            is_head: Callable, True if the line starts a new record (other lines are 'continuations')
+
+            Only reads as much of the file as necessary, regardless of file size
+        """
+        handle = self._file_handle
+        handle.seek(0, 2)
+        position = handle.tell()
+        carry = ""  # (possibly incomplete) first line of the previous block
+        heads = 0
+
+        while position > 0:
+            size = min(BACKWARD_BLOCK_SIZE, position)
+            position -= size
+            handle.seek(position)
+            lines = (handle.read(size) + carry).split('\n')
+
+            # The first line is incomplete, unless we are at the top of the file
+            carry = lines.pop(0) if position > 0 else None
+            offset = position + (len(carry) + 1 if carry is not None else 0)
+
+            starts = []
+            for line in lines:
+                starts.append(offset)
+                offset += len(line) + 1
+
+            for line, start in reversed(zip(lines, starts)):
+                if line and is_head(line):
+                    heads += 1
+                    if heads >= count:
+                        logger.debug("Found: %d last records in file: %s at: %d" % (count, self._file_name, start))
+                        handle.seek(start)
+                        return
+
+        logger.debug("Found only: %d records in file: %s. Reading from the top" % (heads, self._file_name))
+        handle.seek(0)
+
+
+    def close(self):
+        """ Close file
+        """
+        if self._file_handle:
+            logger.info("Closing log file: %s" % self._file_name)
+            self._file_handle.close()
+            self._file_handle = None
+
+
+    def read_lines(self, max_line_length=None):
+        """ Read new (complete) lines, in READ_CHUNK_SIZE chunks, up to the end of file
+
+            max_line_length: Truncate longer lines as they are read (None: do not truncate)
+        """
+        lines = []
+
+        while True:
+            chunk = self._file_handle.read(READ_CHUNK_SIZE)
+            lines.extend(self._buffer.add(chunk, max_line_length))
+
+            if len(chunk) < READ_CHUNK_SIZE:
+                # End of file: 'reset' it, so that the next read sees new data
+                self._file_handle.seek(self._file_handle.tell())
+                break
+
+        if not lines:
+            logger.debug("No new lines in file: %s" % self._file_name)
+
+        return lines
+
+
+class StreamSource(object):
+    """ stdin or named pipe (FIFO) source
+
+        Reads are non-blocking, so that streams can be followed alongside regular files
+    """
+    DESCRIPTION = 'stream'
+
+    def __init__(self, source_name):
+        """ CONSTRUCTOR
+
+            source_name: '-' for stdin or named pipe path
+        """
+        self._source_name = source_name
+        self._fd = None
+        self._buffer = LineBuffer()
+        self._exhausted = False
+        self._stdin_flags = None  # Original stdin flags (restored on close and on exit)
+
+
+    @property
+    def name(self):
+        return STDIN_NAME if STDIN_SOURCE == self._source_name else self._source_name
+
+
+    @property
+    def is_open(self):
+        return self._fd is not None
+
+
+    @property
+    def exhausted(self):
+        """ stdin is 'exhausted' after EOF. Named pipes are not, as new writers may (re)connect """
+        return self._exhausted
+
+
+    @property
+    def bytes_behind(self):
+        """ Unknown for streams """
+        return None
+
+
+    def seek_last_records(self, count, is_head):
+        """ Streams cannot be 'rewound'. Only new records are read
+        """
+        pass
+
+
+    def open(self, open_at_top):
+        """ Open stream (open_at_top is irrelevant for streams)
+
+            returns False if the stream cannot be open
+        """
+        if STDIN_SOURCE == self._source_name:
+            self._fd = sys.stdin.fileno()
+            self._stdin_flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+            # stdin is shared with the parent shell (and other processes), so leave it the way we found it
+            atexit.register(self._restore_stdin)
+            fcntl.fcntl(self._fd, fcntl.F_SETFL, self._stdin_flags | os.O_NONBLOCK)
+            return True
+
+        try:
+            if not stat.S_ISFIFO(os.stat(self._source_name).st_mode):
+                logger.warn("Stream: %s is not a named pipe" % self._source_name)
+                return False
+            # Non-blocking 'open' of the 'read end' does not wait for writers
+            self._fd = os.open(self._source_name, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError, e:
+            logger.warn("Unable to open stream: %s. Exception: %s" % (self._source_name, e))
+            return False
+
+        return True
+
+
+    def _restore_stdin(self):
+        """ Restore original stdin flags (i.e. make it 'blocking' again)
+        """
+        if self._stdin_flags is None:
+            return
+
+        try:
+            fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFL, self._stdin_flags)
+        except (IOError, OSError, ValueError), e:
+            logger.warn("Unable to restore stdin flags. Exception: %s" % e)
+        self._stdin_flags = None
+
+
+    def close(self):
+        """ Close stream
+        """
+        if self._fd is not None:
+            logger.info("Closing stream: %s" % self.name)
+            if STDIN_SOURCE != self._source_name:
+                os.close(self._fd)
+            else:
+                self._restore_stdin()
+            self._fd = None
+
+
+    def read_lines(self, max_line_length=None):
+        """ Read new (complete) lines, up to READ_MAX_CHUNKS chunks at a time
+
+            max_line_length: Truncate longer lines as they are read (None: do not truncate)
+        """
+        lines = []
+
+        for _ in range(READ_MAX_CHUNKS):
+            try:
+                chunk = os.read(self._fd, READ_CHUNK_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            if not chunk:
+                # EOF: no (more) writers
+                if STDIN_SOURCE == self._source_name and not self._exhausted:
+                    logger.info("Reached the end of stdin")
+                    self._exhausted = True
+                break
+
+            lines.extend(self._buffer.add(chunk, max_line_length))
+
+        if self._exhausted:
+            # Nothing else is coming, last line is as complete as it will ever be
+            lines.extend(self._buffer.flush())
+
+        return lines
+
+
+def make_source(source_name):
+    """ Make appropriate 'source' for: '-' (stdin), named pipe or regular file
+    """
+    if STDIN_SOURCE == source_name:
+        return StreamSource(source_name)
+
+    if os.path.exists(source_name) and stat.S_ISFIFO(os.stat(source_name).st_mode):
+        return StreamSource(source_name)
+
+    return FileSource(source_name)
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+""" MetricsExporter: Serve ptail 'log rate', 'ingest lag' and discovery metrics in Prometheus text format
+
+    Counters are updated incrementally, as records flow through FileTailer(s)
+    and are only 'rendered' when scraped (no rescans of logs or processes)
+"""
+
+import logging
+import threading
+
+from .field_predicates import LOG_LEVELS
+from .lag_tracker import LAG_BYTES, LAG_SECONDS
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class MetricsExporterException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Metrics 'path'
+METRICS_PATH = '/metrics'
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 'Level' field name (see: 'format' in LogSetup)
+LEVEL_FIELD = 'level'
+
+# 'Level' label for values that are not known log levels (so that 'free text' cannot blow up the number of series)
+OTHER_LEVEL = 'OTHER'
+
+# Address to serve metrics on (local connections only)
+DEFAULT_METRICS_ADDRESS = '127.0.0.1'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def escape_label(value):
+    """ Escape Prometheus label value
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PtailMetrics(object):
+    """ ptail metrics: record counters (by log label and level) + discovery statistics
+
+        Counters are updated by the 'tailing' thread and read by the 'http' thread.
+        Each update is a single dictionary assignment (atomic under GIL)
+        and rendering works on a copy, so no explicit locking is required
+    """
+
+    def __init__(self, stats_provider=None, lag_tracker=None):
+        """ CONSTRUCTOR
+
+            stats_provider: Callable that returns discovery statistics, i.e. ProcessLogs().stats
+            lag_tracker:    LagTracker() to report 'ingest lag' quantiles from
+        """
+        self._records = {}          # {label: count}
+        self._records_by_level = {} # {(label, level): count}, level: one of LOG_LEVELS or OTHER_LEVEL
+
+        self._stats_provider = stats_provider
+        self._lag_tracker = lag_tracker
+
+        logger.debug("PtailMetrics() successfully initialized")
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _render_counter(self, name, help_text, label_names, values):
+        """ Render 'counter' metric family
+        """
+        lines = ["# HELP %s %s" % (name, help_text), "# TYPE %s counter" % name]
+
+        for key, value in sorted(values):
+            key = key if isinstance(key, tuple) else (key,)
+            labels = ",".join('%s="%s"' % (k, escape_label(v)) for k, v in zip(label_names, key))
+            lines.append("%s{%s} %d" % (name, labels, value))
+
+        return lines
+
+
+    def _render_stats(self):
+        """ Render discovery statistics
+        """
+        lines = []
+        if not self._stats_provider:
+            return lines
+
+        stats = self._stats_provider()
+        for name, metric_type, help_text, key in (
+            ('ptail_discovery_processes', 'gauge', 'Processes found by the last log discovery', 'processes'),
+            ('ptail_discovery_logs', 'gauge', 'Logs found by the last log discovery', 'logs'),
+            ('ptail_discovery_refresh_seconds', 'gauge', 'Duration of the last log discovery', 'refresh_seconds'),
+            ('ptail_discovery_refreshes_total', 'counter', 'Number of log discoveries', 'refreshes'),
+        ):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            lines.append("%s %s" % (name, stats.get(key, 0)))
+
+        return lines
+
+
+    def _render_lag(self):
+        """ Render 'ingest lag' quantiles (as Prometheus 'summary' without sum and count)
+        """
+        lines = []
+        if not self._lag_tracker:
+            return lines
+
+        quantiles = self._lag_tracker.quantiles()
+        for kind, help_text in (
+            (LAG_BYTES, 'Bytes written to the log, but not read yet'),
+            (LAG_SECONDS, 'Time between the record timestamp and the moment it was read'),
+        ):
+            name = 'ptail_lag_%s' % kind
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s summary" % name)
+            for label, _ in sorted(k for k in quantiles if kind == k[1]):
+                for q, value in quantiles[(label, kind)]:
+                    lines.append('%s{log="%s",quantile="%s"} %s' % (name, escape_label(label), q, value))
+
+        return lines
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    @property
+    def fields(self):
+        """ Record fields that metrics are 'labeled' by, see: FileTailer() 'listeners' """
+        return frozenset((LEVEL_FIELD,))
+
+
+    def on_record(self, tailer, items, text):
+        """ Count (parsed) record, see: FileTailer() 'listeners'
+        """
+        label = tailer.label
+        self._records[label] = self._records.get(label, 0) + 1
+
+        level = items.get(LEVEL_FIELD) if items else None
+        if level:
+            level = level.strip().upper()
+            key = (label, level if level in LOG_LEVELS else OTHER_LEVEL)
+            self._records_by_level[key] = self._records_by_level.get(key, 0) + 1
+
+
+    def render(self):
+        """ Render all metrics in Prometheus text format
+        """
+        lines = []
+
+        lines.extend(self._render_counter('ptail_records_total', 'Log records read',
+            ('log',), self._records.items()))
+        lines.extend(self._render_counter('ptail_records_level_total', 'Log records read by level',
+            ('log', 'level'), self._records_by_level.items()))
+        lines.extend(self._render_lag())
+        lines.extend(self._render_stats())
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """ Serve PtailMetrics() over http in a background thread
+    """
+
+    def __init__(self, metrics, port, address=DEFAULT_METRICS_ADDRESS):
+        """ CONSTRUCTOR
+
+            metrics:      PtailMetrics() object
+            port:         Port to listen on
+            address:      Address to bind to ('' or '0.0.0.0': all interfaces). Default: local connections only
+        """
+        self._metrics = metrics
+        self._port = port
+        self._address = address
+
+        self._server = None
+        self._thread = None
+
+        logger.debug("MetricsServer() successfully initialized for port: %d" % port)
+
+
+    def _make_handler(self):
+        """ Make http request handler class, bound to self._metrics
+        """
+        from BaseHTTPServer import BaseHTTPRequestHandler  # Only needed if metrics are requested
+
+        metrics = self._metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request: %s" % (format % args))
+
+        return MetricsHandler
+
+
+    def start(self):
+        """ Start serving metrics in a background (daemon) thread
+        """
+        from BaseHTTPServer import HTTPServer
+
+        try:
+            self._server = HTTPServer((self._address, self._port), self._make_handler())
+        except Exception, e:
+            raise MetricsExporterException("Unable to serve metrics on port: %d. Exception: %s" % (self._port, e))
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='ptail-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info("Serving metrics on: http://%s:%d%s" % (self._address or '0.0.0.0', self._port, METRICS_PATH))
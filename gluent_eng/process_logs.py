@@ -4,14 +4,21 @@
     Logs = text files with 'relevant' (user controlled) extensions, i.e. .txt or .log
 """
 
+import errno
+import getpass
+import glob
+import json
 import logging
 import os
 import os.path
 import re
 import socket
+import time
 
+from collections import OrderedDict
 from .linux_cmd import LinuxCmd
 from .log_setup import LogSetup
+from .text_detector import TextDetector, LOG_TYPE_TEXT, LOG_TYPE_BINARY, LOG_TYPE_EMPTY
 
 
 ###############################################################################
@@ -35,16 +42,51 @@ RE_DEFAULT_LOG_NAME_FILTER = re.compile('\.(log|trc|out)')
 RE_REMOVE_NON_ESSENTIAL = re.compile('[\d]')
 # Non-essential 'last in the name' symbols
 RE_LAST_NON_ESSENTIAL = re.compile('[\.\-\_\*]+$')
+# Repeated separators, i.e. '..' or '--'
+RE_REPEATED_SEPARATORS = re.compile('([\.\-\_\*])\\1+')
 
 # Log acquire methods
 METHOD_PID = 'pid'
 METHOD_NAME_REGEX = 'name'
 ALLOWED_METHODS = (METHOD_PID, METHOD_NAME_REGEX)
 
-# Log types
-LOG_TYPE_TEXT = 'text'
-LOG_TYPE_BINARY = 'binary'
-LOG_TYPE_EMPTY = 'empty'
+# 'ls -l' symbolic link marker, i.e.: ... 9 -> /var/log/my app.log
+LINK_MARKER = ' -> '
+
+# Max length of file names to detect types of with one 'file' command
+MAX_FILE_ARGS_LENGTH = 64 * 1024
+# Characters to escape in file names (see: shell_escape())
+RE_SHELL_UNSAFE = re.compile(r'([^\w@%+=:,./-])')
+# ... and characters that cannot be escaped reliably, as commands may be wrapped in: sudo -c "..." or ssh '...'
+RE_SHELL_UNESCAPABLE = re.compile(r'[\'"`$\\\n]')
+
+# Re-read all /proc/<pid>/fd links (rather than only the changed ones) every N refreshes
+FULL_RESCAN_REFRESHES = 10
+
+# Max number of memoized process names and short log names (the oldest are dropped first)
+MAX_MEMO_ENTRIES = 10000
+
+# Default directory to keep discovery caches in between runs
+DEFAULT_CACHE_DIR = '~/.cache/ptail'
+
+# Detected file types cache (in 'cache dir', see: TextDetector())
+FILE_TYPES_CACHE = 'file-types.json'
+
+# Host names cache (in 'cache dir'): {host: [resolved at, [host name, ...]]} and how long (seconds) it is valid for
+HOST_NAMES_CACHE = 'host-names.json'
+HOST_NAMES_TTL = 24 * 3600
+
+# cgroup file system root (cgroup v2 or a directory of cgroup v1 controller hierarchies)
+# and the file that lists (member) processes of a cgroup
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_PROCS = 'cgroup.procs'
+
+# Process mount namespace and root directory. Logs of processes in other mount namespaces (i.e. containers)
+# are keyed by: <mount namespace><path in the namespace>, i.e. mnt:[4026532312]/var/log/app.log
+# and opened through the root directory of any (live) process in the namespace (see: resolve())
+PROC_MOUNT_NS = '/proc/%s/ns/mnt'
+PROC_ROOT = '/proc/%d/root'
+RE_NAMESPACED_LOG = re.compile(r'^(mnt:\[\d+\])(/.*)$', re.S)
 
 ###############################################################################
 # LOGGING
@@ -53,6 +95,82 @@ logger = logging.getLogger(__name__)
 #logger.addHandler(logging.NullHandler()) # Disabling logging by default
 
 
+def shell_escape(arg):
+    """ Escape (file name) argument for (possibly wrapped) linux command
+
+        Returns: None if the argument cannot be escaped reliably
+    """
+    if RE_SHELL_UNESCAPABLE.search(arg):
+        return None
+
+    return RE_SHELL_UNSAFE.sub(r'\\\1', arg)
+
+
+class Record(object):
+    """ Compact (__slots__ based) record
+
+        Supports dict style access, i.e. record['pid'], as process_info/log_info consumers expect dicts
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+
+    def __contains__(self, name):
+        return name in self.__slots__
+
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, _) == getattr(other, _) for _ in self.__slots__)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join("%s=%r" % (_, getattr(self, _)) for _ in self.__slots__))
+
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+
+    def keys(self):
+        return list(self.__slots__)
+
+
+class ProcessRecord(Record):
+    """ Process: pid, start time (None: unknown), short 'human readable' name, full command line and logs
+    """
+    __slots__ = ('pid', 'start', 'cmd', 'full_cmd', 'logs')
+
+
+class ProcessRef(Record):
+    """ Process, that has the log open
+    """
+    __slots__ = ('pid', 'cmd')
+
+
+class LogRecord(Record):
+    """ Log: metadata (see: LogSetup()), processes, that have the log open, and 'short' names
+    """
+    __slots__ = ('color', 'format', 'label', 'processes', 'log_short', 'cmd_short')
+
+
 class ProcessLogs(object):
     """ ProcessLogs: Discover log files for specified process(es)
 
@@ -63,12 +181,21 @@ class ProcessLogs(object):
         Log files are filtered out by 'log filter'
     """
 
-    def __init__(self, user=None, host=None, setup_file=None, log_filter=None):
+    def __init__(self, user=None, host=None, setup_file=None, log_filter=None, cache_dir=None, cgroup=None):
         """ CONSTRUCTOR
  
             user, host:       Run (process/log discovery) linux commands as user, host
             setup_file:       (YAML) configuration file with log metadata (see LogSetup())
+            cache_dir:        Directory to keep discovery caches in between runs, i.e. detected file types and host names
+                              (None: keep caches in memory only)
+            cgroup:           Only discover processes in this cgroup (and its child cgroups), local host only:
+                              cgroup directory or glob pattern, relative to CGROUP_ROOT (or to its v1 controllers), i.e.
+                                  system.slice/docker-3f2a*.scope
+                                  hadoop-yarn/container_*
         """
+        if cgroup and host:
+            raise ProcessLogsException("cgroup: %s can only be used to discover processes on the local host" % cgroup)
+
         # "returnable" Results
         self._process_info = None
         self._log_info = {}
@@ -86,15 +213,49 @@ class ProcessLogs(object):
         # Linux command 'runner'
         self._linux = LinuxCmd(user=user, host=host)
 
-        # Discover various host names (relevant for log parsing)
-        self._host_names = self._get_host_names()
+        # Read /proc in-process (rather than with linux commands), if possible (local host only)
+        self._local = host is None
+
+        # Remote hosts: discover processes, logs and their types with a single ssh call (see: PtailAgent.snapshot())
+        # Falls back to linux commands (if remote agent cannot run)
+        self._remote_host = "%s@%s" % (user or getpass.getuser(), host) if host else None
+        self._use_snapshots = not self._local
+        self._snapshot = None  # ... snapshot, taken by the current refresh
+
+        # Various host names (relevant for log parsing). Resolved on first use (see: _get_re_host_names())
+        self._host = host
+        self._host_names, self._re_host_names = None, None
+        self._host_names_cache = os.path.join(cache_dir, HOST_NAMES_CACHE) if cache_dir else None
+
+        # Memoized: {full command line: process name} and {log: short log name}
+        self._process_names = OrderedDict()
+        self._short_log_names = OrderedDict()
     
-        # Known logs 'cache'
+        # Known logs 'cache' (for logs, checked with 'file' command)
         self._known_logs = {}
+        # ... and 'in-process' file type detector, with its own (dev, inode) keyed cache
+        self._detector = TextDetector(os.path.join(cache_dir, FILE_TYPES_CACHE) if cache_dir else None)
+        self._seen_files = set()  # ... (candidate) log files, seen by the current refresh
+        self._checked_files = {}  # ... {log file: type} checked with 'file' command by the current refresh (None: gone)
 
         # 'Default' log filter
         self._log_filter = log_filter
 
+        # Process state, kept between refreshes (so that only new or changed processes are re-scanned)
+        # {pid: {'start': ..., 'mount_ns': ..., 'fds': frozenset(fd, ...), 'log_fds': {fd: log file}}}
+        self._procs = {}
+        self._procs_filter = None  # ... 'log filter', that 'log_fds' were selected with
+
+        # cgroup 'selector', to restrict process discovery with (see: _get_cgroup_pids())
+        self._cgroup = cgroup
+        # ... and our own mount namespace, to recognize processes in other namespaces (i.e. containers)
+        self._mount_ns = self._read_mount_ns() if self._local else None
+        self._namespaces = {}  # ... {mount namespace: [pid, ...]} of such processes, seen by the latest refresh
+        self._changes = ([], [])   # ... logs (added, removed) by the latest refresh
+
+        # Discovery statistics
+        self._stats = {'refreshes': 0, 'processes': 0, 'logs': 0, 'refresh_seconds': 0.0}
+
         logger.debug("ProcessLogs() object successfully initialized")
 
 
@@ -158,6 +319,31 @@ class ProcessLogs(object):
         return cmd
 
 
+    def _memoize(self, cache, key, compute):
+        """ Get memoized compute(key) from (OrderedDict) 'cache', keeping at most MAX_MEMO_ENTRIES
+        """
+        if key in cache:
+            return cache[key]
+
+        value = cache[key] = compute(key)
+        if len(cache) > MAX_MEMO_ENTRIES:
+            cache.popitem(last=False)
+
+        return value
+
+
+    def _get_process_name(self, full_cmd):
+        """ Memoized _extract_process_name()
+        """
+        return self._memoize(self._process_names, full_cmd, self._extract_process_name)
+
+
+    def _get_short_log_name(self, log_name):
+        """ Memoized _extract_short_log_name()
+        """
+        return self._memoize(self._short_log_names, log_name, self._extract_short_log_name)
+
+
     def _execute_ps(self, cmd):
         """ Execute ps/pgrep command and process results
         """
@@ -168,40 +354,320 @@ class ProcessLogs(object):
         proc_info = []
         for proc in result.split('\n'):
             pid, name = proc.split(None, 1)
-            proc_info.append({
-                'pid': int(pid),
-                'cmd': self._extract_process_name(name), # Short 'human readable' process name
-                'full_cmd': name,                        # Full command line with options etc
-            })
+            proc_info.append(ProcessRecord(
+                pid=int(pid),
+                cmd=self._get_process_name(name),  # Short 'human readable' process name
+                full_cmd=name,                     # Full command line with options etc
+            ))
+
+        return proc_info
+
+
+    def _read_cmdline(self, pid):
+        """ Read process command line from /proc/<pid>/cmdline (or '[name]' from /proc/<pid>/stat for kernel threads)
+
+            Returns: Command line or None if the process is gone
+        """
+        try:
+            with open("/proc/%d/cmdline" % pid) as f:
+                cmdline = f.read().replace('\0', ' ').strip()
+            if not cmdline:
+                with open("/proc/%d/stat" % pid) as f:
+                    stat = f.read()
+                # pid (name) state ...
+                cmdline = "[%s]" % stat[stat.find('(') + 1:stat.rfind(')')]
+        except IOError:
+            # Process are transitory so, it's ok if we cannot find them in /proc
+            return None
+
+        return cmdline
+
+
+    def _read_start_time(self, pid):
+        """ Read process start time (in clock ticks since boot) from /proc/<pid>/stat
+            (pid + start time identify the process, as pids can be reused)
+
+            Returns: Start time or None if the process is gone
+        """
+        try:
+            with open("/proc/%d/stat" % pid) as f:
+                stat = f.read()
+        except IOError:
+            return None
+
+        # pid (name) state ppid ... starttime (22nd field, name may contain spaces)
+        return int(stat[stat.rfind(')') + 2:].split()[19])
+
+
+    def _find_cgroups(self):
+        """ Find cgroup directories, matching 'cgroup' selector (absolute or relative to CGROUP_ROOT
+            or to any of its cgroup v1 controller hierarchies, i.e. /sys/fs/cgroup/cpu,cpuacct)
+        """
+        if os.path.isabs(self._cgroup):
+            patterns = [self._cgroup]
+        else:
+            patterns = [os.path.join(CGROUP_ROOT, self._cgroup), os.path.join(CGROUP_ROOT, '*', self._cgroup)]
+
+        cgroups = set()
+        for pattern in patterns:
+            cgroups.update(_ for _ in glob.glob(pattern) if os.path.isdir(_))
+
+        return sorted(cgroups)
+
+
+    def _get_cgroup_pids(self):
+        """ Read pids of the processes in 'cgroup' (and its child cgroups) from their cgroup.procs files
+
+            Returns: set(pid, ...)
+        """
+        cgroups = self._find_cgroups()
+        if not cgroups:
+            logger.warn("Unable to find cgroup: %s under: %s" % (self._cgroup, CGROUP_ROOT))
+
+        pids = set()
+        for cgroup in cgroups:
+            for directory, _, files in os.walk(cgroup):
+                if CGROUP_PROCS not in files:
+                    continue
+                try:
+                    with open(os.path.join(directory, CGROUP_PROCS)) as f:
+                        pids.update(int(_) for _ in f.read().split())
+                except IOError:
+                    pass  # cgroup was removed in the meantime
+
+        logger.debug("Found: %d processes in: %d cgroups matching: %s" % (len(pids), len(cgroups), self._cgroup))
+        return pids
+
+
+    def _read_mount_ns(self, pid='self'):
+        """ Read mount namespace of the process, i.e. mnt:[4026531840]
+
+            Returns: None if it cannot be read (process is gone or we do not have the privileges)
+        """
+        try:
+            return os.readlink(PROC_MOUNT_NS % pid)
+        except OSError:
+            return None
+
+
+    def _get_other_mount_ns(self, pid):
+        """ Get mount namespace of the process if it is different from ours (i.e. the process runs in a container)
+
+            fd links of such processes resolve to names inside their namespace, i.e. /var/log/app.log of the container
+
+            Returns: None if the namespace is the same (or cannot be read), so that files can be opened by their names as is
+        """
+        mount_ns = self._read_mount_ns(pid)
+
+        return mount_ns if mount_ns is not None and mount_ns != self._mount_ns else None
+
+
+    def _read_process_table(self, pids=None, re_name=None):
+        """ Read (local) process table from /proc, in-process: processes with 'pids' or (full) command lines matching 're_name'
+
+            Excludes our own process (and its parent, i.e. sudo), same as: pgrep | grep -v <pid>
+            Only processes in 'cgroup' are considered (if requested)
+
+            Returns: [ProcessRecord(), ..] or None if /proc cannot be read (so that linux commands should be used)
+        """
+        if self._cgroup:
+            cgroup_pids = self._get_cgroup_pids()
+            pids = cgroup_pids if pids is None else cgroup_pids.intersection(pids)
+        elif pids is None:
+            try:
+                pids = [int(_) for _ in os.listdir('/proc') if _.isdigit()]
+            except OSError, e:
+                logger.debug("Unable to read process table in-process: %s" % e)
+                return None
+        own_pid = os.getpid()  # Same as 'grep -v <pid>' in the linux command fallback
+
+        proc_info = []
+        for pid in sorted(set(pids)):
+            if pid == own_pid:
+                continue
+            full_cmd = self._read_cmdline(pid)
+            if full_cmd is None or (re_name and not re_name.search(full_cmd)):
+                continue
+            start = self._read_start_time(pid)
+            if start is None:
+                continue
+
+            proc_info.append(ProcessRecord(
+                pid=pid,
+                start=start,                           # Process start time (see: _read_start_time())
+                cmd=self._get_process_name(full_cmd),  # Short 'human readable' process name
+                full_cmd=full_cmd,                     # Full command line with options etc
+            ))
 
         return proc_info
 
 
     def _get_process_info_by_pids(self, pid_list):
-        """ Execute 'ps' command for 'pid_list' and return
+        """ Read process table (or execute 'ps' command) for 'pid_list' and return
 
             [{'pid': .., 'cmd': ..}, ..]
         """
+        if self._local:
+            proc_info = self._read_process_table(pids=[int(_) for _ in pid_list])
+            if proc_info is not None:
+                return proc_info
+
         cmd = "ps -p %s -o pid,cmd --no-headers | grep -v %d" % (",".join([str(_) for _ in pid_list]), os.getpid())
         logger.info("Extracting processes by pid list: %s" % cmd)
         return self._execute_ps(cmd)
 
 
     def _get_process_info_by_name(self, re_name):
-        """ Execute 'pgrep' command for 're_name' name pattern and return
+        """ Read process table (or execute 'pgrep' command) for 're_name' name pattern and return
 
             [{'pid': .., 'cmd': ..}, ..]
         """
-        cmd = "pgrep -fl %s | grep -v %s" % (re_name, os.getpid())
+        if self._local:
+            try:
+                compiled_name = re.compile(re_name)
+            except re.error, e:
+                raise ProcessLogsException("Invalid process name regex: %s. Error: %s" % (re_name, e))
+            proc_info = self._read_process_table(re_name=compiled_name)
+            if proc_info is not None:
+                logger.info("Extracted: %d processes by name regex: %s from /proc" % (len(proc_info), re_name))
+                return proc_info
+
+        cmd = "pgrep -fl %s | grep -v %s" % (shell_escape(re_name) or re_name, os.getpid())
         logger.info("Extracting processes by name regex: %s" % cmd)
         return self._execute_ps(cmd)
 
 
+    def _save_file_type(self, file_name, description):
+        """ Analyze (and remember) 'file -i' result for the file
+
+            Returns: True if file is 'text file', False otherwise
+        """
+        # Examples:
+        # /kafka-logs/__consumer_offsets-24/00000000000000000000.log: application/x-empty; charset=binary
+        # /logs/state-change.log: text/plain; charset=us-ascii
+        if 'x-empty' in description:
+            logger.debug("File: %s is still EMPTY" % file_name)
+            self._known_logs[file_name] = LOG_TYPE_EMPTY
+            return False
+        elif ': text' in description:
+            logger.debug("File: %s is TEXT" % file_name)
+            self._known_logs[file_name] = LOG_TYPE_TEXT
+            return True
+        else:
+            logger.debug("File: %s is NOT TEXT" % file_name)
+            self._known_logs[file_name] = LOG_TYPE_BINARY
+            return False
+
+
+    def _take_snapshot(self, method, search_key, log_filter):
+        """ Take discovery snapshot on remote host: {'host_names': [...], 'processes': [...], 'types': {...}}
+
+            Returns: None (and stops taking snapshots) if remote agent cannot run, so that linux commands should be used
+        """
+        from .remote_agent import RemoteAgent, RemoteAgentException, MODE_DISCOVER  # Only needed for remote hosts
+
+        params = {
+            'mode': MODE_DISCOVER,
+            'method': method,
+            'search_key': search_key,
+            'log_filter': log_filter or RE_DEFAULT_LOG_NAME_FILTER.pattern,
+        }
+
+        try:
+            return RemoteAgent(self._remote_host, None, params).snapshot()
+        except RemoteAgentException, e:
+            logger.warn("Unable to take discovery snapshot. Falling back to linux commands. Exception: %s" % e)
+            self._use_snapshots = False
+            return None
+
+
+    def _get_snapshot_processes(self):
+        """ Extract processes from (remote) snapshot
+
+            [{'pid': .., 'cmd': ..}, ..]
+        """
+        return [ProcessRecord(pid=_['pid'], cmd=self._get_process_name(_['full_cmd']), full_cmd=_['full_cmd']) \
+            for _ in self._snapshot['processes']]
+
+
+    def _needs_file_command(self, file_name):
+        """ Return True if file type can only be detected with 'file' command (and is not known yet)
+        """
+        if self._local and self._detector.get_type(file_name) is not None:
+            return False
+
+        return LOG_TYPE_EMPTY == self._known_logs.get(file_name, LOG_TYPE_EMPTY)
+
+
+    def _classify_files(self, file_names):
+        """ Detect types of (not yet known) files with as few 'file' commands as possible
+            (one per MAX_FILE_ARGS_LENGTH of file names), rather than with one command per file
+
+            Results are saved in: self._known_logs and self._checked_files
+        """
+        self._checked_files = {}
+
+        if self._snapshot:
+            # Already detected by remote agent
+            for file_name in file_names:
+                self._checked_files[file_name] = self._snapshot['types'].get(file_name)
+                if self._checked_files[file_name]:
+                    self._known_logs[file_name] = self._checked_files[file_name]
+            return
+
+        unknown = sorted(_ for _ in file_names if self._needs_file_command(_) and shell_escape(_))
+        if not unknown:
+            return
+
+        chunks, chunk, chunk_length = [], [], 0
+        for file_name in unknown:
+            arg = shell_escape(file_name)
+            if chunk and chunk_length + len(arg) > MAX_FILE_ARGS_LENGTH:
+                chunks.append(chunk)
+                chunk, chunk_length = [], 0
+            chunk.append((file_name, arg))
+            chunk_length += len(arg) + 1
+        chunks.append(chunk)
+
+        logger.debug("Running: %d 'file' command(s) to detect types of: %d files" % (len(chunks), len(unknown)))
+        for chunk in chunks:
+            cmd = "file -i -N -- %s" % " ".join(_[1] for _ in chunk)
+            try:
+                result = self._execute(cmd)
+            except ProcessLogsException, e:
+                # Files, that are left unknown, will be checked one by one
+                logger.warn("Unable to detect types of: %d files. Exception: %s" % (len(chunk), e))
+                continue
+
+            # 'file' prints one line per file, in the order of arguments (names may contain ': ')
+            for (file_name, _), line in zip(chunk, result.splitlines()):
+                line = line.rstrip('\r')
+                if not line.startswith(file_name + ': '):
+                    logger.debug("Unexpected 'file' output: %s for file: %s" % (line, file_name))
+                    continue
+                description = line[len(file_name):]
+                if description.startswith(': cannot open'):
+                    # Logs are transitory so, it's ok if we cannot find them
+                    logger.debug("Unable to find file: %s when analyzing type" % file_name)
+                    self._checked_files[file_name] = None
+                else:
+                    self._save_file_type(file_name, description)
+                    self._checked_files[file_name] = self._known_logs[file_name]
+
+
     def _is_text_file(self, file_name):
         """ Return True if file is 'text file', False otherwise
 
-            Calls UNIX 'file' command
+            Reads file 'head' in-process (see: TextDetector()) if possible (local host and privileges)
+            or calls UNIX 'file' command otherwise
         """
+        log_type = self._detector.get_type(file_name) if self._local else None
+        if log_type is not None:
+            return LOG_TYPE_TEXT == log_type
+
+        if file_name in self._checked_files:
+            return LOG_TYPE_TEXT == self._checked_files[file_name]
+
         if file_name in self._known_logs:
             # Very expensive to run 'file' command, so we avoid it if log was already evaluated
             log_type = self._known_logs[file_name]
@@ -213,8 +679,13 @@ class ProcessLogs(object):
             elif LOG_TYPE_EMPTY != log_type:
                 raise ProcessLogsException("Invalid log type: %s for log: %s" % (log_type, file_name))
 
+        arg = shell_escape(file_name)
+        if not arg:
+            logger.debug("Unable to run 'file' command for: %s. Skipping" % file_name)
+            return False
+
         logger.debug("Running 'file' command to detect if: %s is a text file" % file_name)
-        cmd = "file -i %s" % file_name
+        cmd = "file -i %s" % arg
         try:
             result = self._execute(cmd)
         except ProcessLogsException, e:
@@ -225,29 +696,52 @@ class ProcessLogs(object):
             else:
                 raise
 
-        # Ok, let's analyze 'file' results
-        # Examples:
-        # /kafka-logs/__consumer_offsets-24/00000000000000000000.log: application/x-empty; charset=binary
-        # /logs/state-change.log: text/plain; charset=us-ascii
-        if 'x-empty' in result:
-            logger.debug("File: %s is still EMPTY" % file_name)
-            self._known_logs[file_name] = LOG_TYPE_EMPTY
-            return False
-        elif ': text' in result:
-            logger.debug("File: %s is TEXT" % file_name)
-            self._known_logs[file_name] = LOG_TYPE_TEXT
-            return True
-        else:
-            logger.debug("File: %s is NOT TEXT" % file_name)
-            self._known_logs[file_name] = LOG_TYPE_BINARY
-            return False
+        return self._save_file_type(file_name, result)
+
 
+    def _read_fd_links(self, pid, re_log_filter, known=None):
+        """ Read /proc/<pid>/fd links in-process (os.listdir + os.readlink) and select the ones matching 'log filter'
 
-    def _get_files_by_pid(self, pid, re_log_filter):
-        """ Parse /proc/<pid>/fd and extract 'logs' by applying 'log_filter'
+            known: Process state from the previous refresh (see: self._procs). If the process has the same fds,
+                   only re-read (and verify) its 'log' fds, rather than all of them
+
+            Returns: (frozenset(fd, ...), {fd: log file}) or None if we do not have the privileges
+                     (so that linux command should be used)
         """
-        log_files = []
+        fd_dir = "/proc/%d/fd" % pid
 
+        try:
+            fds = frozenset(os.listdir(fd_dir))
+        except OSError, e:
+            if e.errno in (errno.EACCES, errno.EPERM):
+                logger.debug("Not allowed to read: %s in-process" % fd_dir)
+                return None
+            # Process are transitory so, it's ok if we cannot find them in /proc
+            logger.debug("Unable to find process: %d" % pid)
+            return frozenset(), {}
+
+        def read_links(fds):
+            links = {}
+            for fd in fds:
+                try:
+                    links[fd] = os.readlink(os.path.join(fd_dir, fd))
+                except OSError:
+                    pass  # fd was closed in the meantime
+            return links
+
+        if known and known['fds'] == fds:
+            if read_links(known['log_fds']) == known['log_fds']:
+                return fds, known['log_fds']
+            logger.debug("Log fds of process: %d have changed. Re-reading all fds" % pid)
+
+        return fds, dict((k, v) for k, v in read_links(fds).items() if re_log_filter.search(v))
+
+
+    def _ls_fd_links(self, pid):
+        """ Read /proc/<pid>/fd links with linux command (remote hosts or sudo)
+
+            Returns: [open file, ...]
+        """
         cmd = "ls -l /proc/%d/fd" % pid
         try:
             result = self._execute(cmd)
@@ -263,54 +757,163 @@ class ProcessLogs(object):
             else:
                 raise
   
-        # We only need the last part from:
+        # We only need the 'link target' from (which may contain spaces):
         # lr-x------. 1 zookeeper zookeeper 64 May 28 18:06 9 -> /usr/lib/zookeeper/zookeeper-3.4.5-cdh5.7.0.jar
-        all_files = [_.split()[-1] for _ in result.split('\n')]
+        return [_.split(LINK_MARKER, 1)[1] for _ in result.split('\n') if LINK_MARKER in _]
+
+
+    def _get_files_by_pid(self, proc, re_log_filter, rescan, namespaces):
+        """ Read /proc/<pid>/fd and extract (candidate) 'logs' by applying 'log_filter'
+
+            Only changed fds are re-read for already known processes (unless: 'rescan')
+            Processes in other mount namespaces are added to: 'namespaces' (see: self._namespaces)
+        """
+        pid, start = proc.pid, proc.start
+        known = self._procs.get(pid)
+        if rescan or not known or known['start'] != start:
+            known = None
+
+        mount_ns = None
+        links = self._read_fd_links(pid, re_log_filter, known) if self._local and start is not None else None
+        if links is not None:
+            fds, log_fds = links
+            mount_ns = known['mount_ns'] if known else self._get_other_mount_ns(pid)
+            self._procs[pid] = {'start': start, 'mount_ns': mount_ns, 'fds': fds, 'log_fds': log_fds}
+            all_files = log_fds.values()
+        elif self._snapshot:
+            all_files = self._snapshot['logs'][pid]
+        else:
+            mount_ns = self._get_other_mount_ns(pid) if self._local else None
+            all_files = self._ls_fd_links(pid)
+
+        if mount_ns:
+            namespaces.setdefault(mount_ns, []).append(pid)
 
         # + only names that match 'log filter'
         # + remove duplicates (same files can be 'listened on' on multiple descriptors
-        log_files = list(set([_ for _ in all_files if re_log_filter.search(_)]))
-
-        # + Only allow 'text' files (as 'logs' should be text files)
-        text_log_files = [_ for _ in log_files if self._is_text_file(_)]
+        # + key files of 'containerized' processes by their mount namespace (see: RE_NAMESPACED_LOG)
+        log_files = list(set([mount_ns + _ if mount_ns and _.startswith('/') else _ \
+            for _ in all_files if re_log_filter.search(_)]))
+        self._seen_files.update(log_files)
 
-        return text_log_files
+        return log_files
 
 
     def _extract_logs(self, process_info, log_filter):
         """ Extract logs for each 'process' in 'process_info'
         """
-        for i, proc in enumerate(process_info):
-            process_info[i]['logs'] = self._get_files_by_pid(proc['pid'], log_filter)
-            logger.info("Analyzing process: %s [pid: %d]. Identified: %d logs" % \
-                (proc['cmd'], proc['pid'], len(process_info[i]['logs'])))
+        if log_filter.pattern != self._procs_filter:
+            self._procs, self._procs_filter = {}, log_filter.pattern
+        rescan = 0 == self._stats['refreshes'] % FULL_RESCAN_REFRESHES
+
+        namespaces = {}
+        log_files = [self._get_files_by_pid(_, log_filter, rescan, namespaces) for _ in process_info]
+        self._namespaces = namespaces
+
+        # Forget processes that are gone (or no longer match)
+        current_pids = set(_.pid for _ in process_info)
+        for pid in [_ for _ in self._procs if _ not in current_pids]:
+            del self._procs[pid]
+
+        # Only allow 'text' files (as 'logs' should be text files)
+        # Types of new files (of all processes) are detected in one go, which matters for remote hosts
+        # Files in other mount namespaces are checked through process root directories
+        file_names = dict((_, self.resolve(_)) for _ in self._seen_files)
+        self._seen_files.update(_ for _ in file_names.values() if _)
+        self._classify_files(set(_ for _ in file_names.values() if _))
+
+        for proc, proc_log_files in zip(process_info, log_files):
+            proc.logs = [_ for _ in proc_log_files if file_names[_] and self._is_text_file(file_names[_])]
+            logger.info("Analyzing process: %s [pid: %d]. Identified: %d logs" % (proc.cmd, proc.pid, len(proc.logs)))
 
         return process_info
 
 
+    def _get_re_host_names(self):
+        """ Get (single) pattern to strip host names from log names ('longer' host names go first)
+
+            Host names are resolved on first use (see: _get_host_names())
+        """
+        if self._re_host_names is None:
+            self._host_names = self._get_host_names()
+            self._re_host_names = re.compile("|".join(re.escape(_) for _ in \
+                sorted(set(_ for _ in self._host_names if _), key=len, reverse=True)))
+
+        return self._re_host_names
+
+
+    def _read_host_names_cache(self):
+        """ Read host names cache: {host: [resolved at, [host name, ...]]}
+        """
+        if not self._host_names_cache or not os.path.exists(self._host_names_cache):
+            return {}
+
+        try:
+            with open(self._host_names_cache) as f:
+                return json.load(f)
+        except (IOError, ValueError), e:
+            logger.warn("Unable to load host names from: %s. Exception: %s" % (self._host_names_cache, e))
+            return {}
+
+
+    def _write_host_names_cache(self, cache):
+        """ Write host names cache (see: _read_host_names_cache())
+        """
+        if not self._host_names_cache:
+            return
+
+        temp_file = "%s.%d" % (self._host_names_cache, os.getpid())
+        try:
+            cache_dir = os.path.dirname(self._host_names_cache)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(temp_file, 'w') as f:
+                json.dump(cache, f)
+            os.rename(temp_file, self._host_names_cache)
+        except (IOError, OSError), e:
+            logger.warn("Unable to save host names to: %s. Exception: %s" % (self._host_names_cache, e))
+
+
     def _get_host_names(self):
         """ Get host name(s) by various means, so that to discard them from 'short log names'
                 hostname
                 hostname -f
                 uname -n
 
-            Running actual UNIX commands here so that can be run remotely over ssh
-            Also, should only be run once
+            Local host: in-process. Remote hosts: from discovery snapshot (see: PtailAgent.snapshot())
+            or by running actual UNIX commands over ssh
+
+            Resolved names are cached on disk (for HOST_NAMES_TTL seconds), so should only be run once in a while
         """
+        host_key = self._host or 'localhost'
+        cache = self._read_host_names_cache()
+        if host_key in cache and time.time() - cache[host_key][0] < HOST_NAMES_TTL:
+            logger.debug("Using cached host names for: %s" % host_key)
+            return [_.encode('utf-8') for _ in cache[host_key][1]]
+
         host_cmds = ['hostname -f', 'hostname', 'uname -n']
-        host_names = []
 
-        for cmd in host_cmds:
-            host_names.append(self._execute(cmd))
+        if self._local:
+            host_names = [socket.getfqdn(), socket.gethostname(), os.uname()[1]]
+        elif self._snapshot:
+            host_names = list(self._snapshot['host_names'])
+        else:
+            host_names = [self._execute(_) for _ in host_cmds]
 
         # Add ip addresses (using hostname -f as a baseline)
-        host_names.append(socket.gethostbyname(host_names[0]))
+        try:
+            host_names.append(socket.gethostbyname(host_names[0]))
+        except socket.error, e:
+            logger.debug("Unable to resolve ip address of: %s. Exception: %s" % (host_names[0], e))
 
         # And various 'local hosts' for completeness 
         host_names.append('127.0.0.1')
         host_names.append('localhost.localdomain')
         host_names.append('localhost')
 
+        cache[host_key] = [time.time(), host_names]
+        self._write_host_names_cache(cache)
+
         return host_names
 
 
@@ -321,16 +924,14 @@ class ProcessLogs(object):
         """
         log_name = os.path.basename(log_name)
 
-        # Strip host names ('longer' host names should go first)
-        for host in self._host_names:
-            log_name = log_name.replace(host, '')
+        # Strip host names
+        log_name = self._get_re_host_names().sub('', log_name)
 
         # Drop numbers and special symbols
         log_name = RE_REMOVE_NON_ESSENTIAL.sub('', log_name)
 
         # Transform '..'s to '.'s etc
-        for pat in ('.', '-', '_', '*'):
-            log_name = re.sub("\%s{2,}" % pat, pat, log_name)
+        log_name = RE_REPEATED_SEPARATORS.sub(r'\1', log_name)
 
         # Remove non-essential symbols if they are 'last'
         log_name = RE_LAST_NON_ESSENTIAL.sub('', log_name)
@@ -356,36 +957,50 @@ class ProcessLogs(object):
             }
 
             setup: Additional log metadata (see: by_pid(), by_name() description)
+
+            Records are ProcessRecord(), LogRecord() and ProcessRef() (with dict style access)
+            Entries of logs, that are open by the same processes as before, are re-used from the previous refresh
         """
+        prev_logs = self._log_info
+        processes_by_log = {}
         keyed_by_log = {}
         setup = self._setup
 
-        # Create 'initial' structure
         for proc in process_info:
-            for log in proc['logs']:
-                if log not in keyed_by_log:
-                    keyed_by_log[log] = {
-                        'processes': [],
-                        'color': setup.get_color(log),
-                        'format': setup.get_format(log),
-                        'label': setup.get_label(log),
-                        'log_short': self._extract_short_log_name(log),
-                    }
-
-                keyed_by_log[log]['processes'].append({'pid': proc['pid'], 'cmd': proc['cmd']})
-
-        # Construct log 'labels' that require post-processing:
-        for log in keyed_by_log:
-            cmds = keyed_by_log[log]['processes']
-            keyed_by_log[log]['cmd_short'] = cmds[0]['cmd'] if 1 == len(cmds) else '[proc: %d]' % len(cmds)
+            for log in proc.logs:
+                processes_by_log.setdefault(log, []).append(ProcessRef(pid=proc.pid, cmd=proc.cmd))
+
+        for log, cmds in processes_by_log.items():
+            prev = prev_logs.get(log)
+            if prev and prev.processes == cmds:
+                keyed_by_log[log] = prev
+                continue
+
+            entry = keyed_by_log[log] = LogRecord(processes=cmds, log_short=self._get_short_log_name(log),
+                **setup.get_meta(log))
+
+            # Construct log 'labels' that require post-processing:
+            entry.cmd_short = cmds[0].cmd if 1 == len(cmds) else '[proc: %d]' % len(cmds)
 
             # If user did not supply a label, set it to log 'short name'
-            if not keyed_by_log[log]['label']:
-                keyed_by_log[log]['label'] = keyed_by_log[log]['log_short']
+            if not entry.label:
+                entry.label = entry.log_short
 
         return keyed_by_log
 
 
+    def _evict_gone_logs(self, gone):
+        """ Drop cached metadata and 'file types' for logs that are no longer open by any (matching) process
+        """
+        if gone:
+            logger.debug("Evicting metadata for: %d gone logs" % len(gone))
+            self._setup.forget(gone)
+
+        for file_name in [_ for _ in self._known_logs if _ not in self._seen_files]:
+            del self._known_logs[file_name]
+        self._seen_files = set()
+
+
     def _get(self, method, search_key, log_filter):
         """ 'Main' method: get 'process logs' data, while accounting for 'refresh interval'
 
@@ -395,16 +1010,36 @@ class ProcessLogs(object):
         """
         assert method in ALLOWED_METHODS and search_key
         get_call = self._get_process_info_by_pids if METHOD_PID == method else self._get_process_info_by_name
+        start = time.time()
+
+        self._snapshot = self._take_snapshot(method, search_key, log_filter) if self._use_snapshots else None
+        if self._snapshot:
+            self._snapshot['logs'] = dict((_['pid'], _['logs']) for _ in self._snapshot['processes'])
 
         # Search processes for (pid or name) and return (pid, full_cmd)
-        process_data = get_call(search_key)
+        process_data = self._get_snapshot_processes() if self._snapshot else get_call(search_key)
 
         # Get process logs by searching through /proc/<pid>/fd
         re_log_filter = re.compile(log_filter) if log_filter else RE_DEFAULT_LOG_NAME_FILTER
         self._process_info = self._extract_logs(process_data, re_log_filter)
 
         # Transform 'process view' into 'log view' (as we care mostly about logs)
+        prev_logs = self._log_info
         self._log_info = self._key_by_log(self._process_info) 
+        self._changes = (
+            [_ for _ in self._log_info if _ not in prev_logs],
+            [_ for _ in prev_logs if _ not in self._log_info],
+        )
+
+        self._evict_gone_logs(self._changes[1])
+        self._detector.save()
+
+        self._stats = {
+            'refreshes': self._stats['refreshes'] + 1,
+            'processes': len(self._process_info),
+            'logs': len(self._log_info),
+            'refresh_seconds': time.time() - start,
+        }
 
         return self._log_info
 
@@ -423,10 +1058,48 @@ class ProcessLogs(object):
         return self._log_info
 
 
+    @property
+    def changes(self):
+        """ Logs: ([added log, ...], [removed log, ...]) by the latest refresh
+        """
+        return self._changes
+
+
+    @property
+    def setup(self):
+        return self._setup
+
+
+    @property
+    def stats(self):
+        """ Discovery statistics: {'refreshes': ..., 'processes': ..., 'logs': ..., 'refresh_seconds': ...}
+        """
+        return self._stats
+
+
     ###########################################################################
     # PUBLIC ROUTINES
     ###########################################################################
 
+    def resolve(self, log):
+        """ Get the name to open the log with: logs in other mount namespaces (see: RE_NAMESPACED_LOG) are opened
+            through the root directory of any live process in the namespace, other logs - by their names as is
+
+            Returns: None if no processes are left in the namespace
+        """
+        matched = RE_NAMESPACED_LOG.match(log)
+        if not matched:
+            return log
+
+        mount_ns, path = matched.groups()
+        for pid in self._namespaces.get(mount_ns, []):
+            # The process may be gone (and its pid reused) since the latest refresh
+            if self._read_mount_ns(pid) == mount_ns:
+                return (PROC_ROOT % pid) + path
+
+        return None
+
+
     def by_pid(self, pids, log_filter=None):
         """ Get 'logs' for the list of pids
 
@@ -0,0 +1,488 @@
+#! /usr/bin/env python
+""" PtailAgent: Self contained (remote) ptail 'agent'
+
+    Shipped to remote hosts (see: RemoteAgent) and run there with a single ssh session:
+
+        1. Discovers logs for processes (by pids or name regex) through /proc
+        2. Tails them, assembles records by 'format' (within line/record size limits) and applies user filters and grep
+        3. Streams matching records back as 'frames':
+               <4 byte length, big endian><zlib compressed JSON: [event, ...]>
+           where event is:
+               {"e": "open", "f": <log>}
+               {"e": "close", "f": <log>}
+               {"e": "record", "f": <log>, "x": <record text>}
+
+    or, in 'discover' mode, discovers logs once and writes back a (JSON) snapshot and exits (see: PtailAgent.snapshot())
+
+    Filters are evaluated by field_predicates and file types are detected by text_detector (same as on the local host),
+    which are shipped together with the agent (their sources are executed first, in the same namespace, see: RemoteAgent)
+
+    IMPORTANT: This module must not import anything outside of python standard library
+               and must run on both: python 2 (2.6+) and python 3 (remote hosts may have either)
+"""
+
+import base64
+import json
+import os
+import re
+import socket
+import struct
+import sys
+import time
+import zlib
+
+if 'make_predicates' not in globals():
+    # Not shipped together with field_predicates, i.e. run as a file
+    from field_predicates import make_predicates
+if 'detect_type' not in globals():
+    # Not shipped together with text_detector, i.e. run as a file
+    from text_detector import detect_type, SAMPLE_SIZE, LOG_TYPE_TEXT, LOG_TYPE_EMPTY
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Default 'log entry' format (see: LogSetup)
+DEFAULT_LOG_ENTRY = '^(?P<text>.*)$'
+
+# Default 'log name' filter (see: ProcessLogs)
+DEFAULT_LOG_NAME_FILTER = r'\.(log|trc|out)'
+
+# Block size for 'backward' reads (when looking for the last N records)
+BACKWARD_BLOCK_SIZE = 64 * 1024
+
+# Read 'chunk' size (see: LogSource)
+READ_CHUNK_SIZE = 64 * 1024
+
+# Line/record size limits (see: RecordGuard)
+OVERSIZE_SPLIT = 'split'
+TRUNCATED_LINE = " ... [truncated: %d characters]"
+TRUNCATED_RECORD = "... [record truncated]"
+
+# Log text is 'bytes' of unknown encoding. latin-1 maps each byte to a character (and back) as is
+WIRE_ENCODING = 'latin-1'
+
+# Agent modes: tail logs and stream records or discover logs once
+MODE_TAIL = 'tail'
+MODE_DISCOVER = 'discover'
+
+# File types (see: ProcessLogs)
+TYPE_TEXT = 'text'
+TYPE_BINARY = 'binary'
+TYPE_EMPTY = 'empty'
+
+
+def to_wire(name):
+    """ File name as (JSON serializable) text
+    """
+    return name.decode(WIRE_ENCODING) if isinstance(name, bytes) else name
+
+
+class AgentLog(object):
+    """ Single log being tailed: file handle + record assembly state
+    """
+
+    def __init__(self, name, line_format, from_top, last_records=None):
+        self.name = name
+        self.format = re.compile(line_format)
+        self.handle = open(name, 'rb')
+        if last_records:
+            self._seek_last_records(last_records)
+        elif not from_top:
+            self.handle.seek(0, 2)
+
+        self.partial = ''
+        self.partial_dropped = 0  # Characters dropped from (too long) partial line
+        self.pending_items = None
+        self.pending_lines = []
+        self.pending_size = 0
+        self.pending_truncated = False
+
+
+    def _seek_last_records(self, count):
+        """ Position file at the start of the last 'count' records (same as ptail's FileSource)
+        """
+        self.handle.seek(0, 2)
+        position = self.handle.tell()
+        carry = b''
+        heads = 0
+
+        while position > 0:
+            size = min(BACKWARD_BLOCK_SIZE, position)
+            position -= size
+            self.handle.seek(position)
+            lines = (self.handle.read(size) + carry).split(b'\n')
+
+            carry = lines.pop(0) if position > 0 else None
+            offset = position + (len(carry) + 1 if carry is not None else 0)
+
+            starts = []
+            for line in lines:
+                starts.append(offset)
+                offset += len(line) + 1
+
+            for line, start in reversed(list(zip(lines, starts))):
+                if line and self.format.match(line.decode(WIRE_ENCODING).strip()):
+                    heads += 1
+                    if heads >= count:
+                        self.handle.seek(start)
+                        return
+
+        self.handle.seek(0)
+
+
+class PtailAgent(object):
+    """ Discover, tail and filter logs, stream back (compressed) frames
+    """
+
+    def __init__(self, params, output):
+        """ CONSTRUCTOR
+
+            params: {'method': 'pid'|'name', 'search_key': ..., 'log_filter': ...,
+                     'formats': [[log pattern, format], ...], 'filters': [expression, ...], 'grep': regex,
+                     'from_top': bool, 'last_records': N, 'refresh_interval': seconds, 'wait': seconds,
+                     'limits': {'max_line_length': ..., 'max_record_size': ..., 'oversize': ...} (see: RecordLimits),
+                     'mode': 'tail'|'discover'}
+            output: Binary 'stream' to write frames to
+        """
+        self._params = params
+        self._output = output
+
+        self._log_filter = re.compile(params.get('log_filter') or DEFAULT_LOG_NAME_FILTER)
+        self._formats = [(re.compile(p), f) for p, f in params.get('formats') or []]
+        self._filters = make_predicates(params.get('filters'))
+        self._grep = re.compile(params['grep']) if params.get('grep') else None
+
+        limits = params.get('limits') or {}
+        self._max_line_length = limits.get('max_line_length')
+        self._max_record_size = limits.get('max_record_size')
+        self._oversize = limits.get('oversize')
+
+        self._logs = {}        # {log name: AgentLog()}
+        self._bad_logs = {}    # Logs that could not be opened
+        self._file_types = {}  # {log name: TYPE_TEXT | TYPE_BINARY}
+        self._events = []
+
+
+    ###########################################################################
+    # DISCOVERY
+    ###########################################################################
+
+    def _read_cmdline(self, pid):
+        try:
+            f = open('/proc/%d/cmdline' % pid, 'rb')
+            try:
+                return f.read().replace(b'\0', b' ').strip().decode(WIRE_ENCODING)
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return None
+
+
+    def _find_pids(self):
+        """ Find 'relevant' pids by pid list or by (full command line) name regex
+        """
+        my_pid = os.getpid()
+
+        if 'pid' == self._params['method']:
+            return [int(_) for _ in self._params['search_key'] if int(_) != my_pid]
+
+        re_name = re.compile(self._params['search_key'])
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit() or int(entry) == my_pid:
+                continue
+            cmdline = self._read_cmdline(int(entry))
+            if cmdline and re_name.search(cmdline):
+                pids.append(int(entry))
+
+        return pids
+
+
+    def _file_type(self, name):
+        """ Check if file 'looks like' text, by its first SAMPLE_SIZE bytes (see: text_detector.detect_type())
+
+            Returns: TYPE_TEXT, TYPE_BINARY, TYPE_EMPTY or None if the file cannot be read
+            Empty files are not 'decided' yet (and are checked again later)
+        """
+        if name in self._file_types:
+            return self._file_types[name]
+
+        try:
+            f = open(name, 'rb')
+            try:
+                sample = f.read(SAMPLE_SIZE)
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return None
+
+        log_type = detect_type(sample)
+        if LOG_TYPE_EMPTY == log_type:
+            return TYPE_EMPTY
+
+        self._file_types[name] = TYPE_TEXT if LOG_TYPE_TEXT == log_type else TYPE_BINARY
+        return self._file_types[name]
+
+
+    def _is_text_file(self, name):
+        return TYPE_TEXT == self._file_type(name)
+
+
+    def _find_logs(self, pid):
+        """ Return (candidate) logs, opened by the process: files, matching 'log filter'
+        """
+        logs = set()
+
+        fd_dir = '/proc/%d/fd' % pid
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            return logs
+
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith('/') and self._log_filter.search(target):
+                logs.add(target)
+
+        return logs
+
+
+    def _discover(self):
+        """ Return a set of (text) logs opened by 'relevant' processes
+        """
+        logs = set()
+
+        for pid in self._find_pids():
+            logs.update(self._find_logs(pid))
+
+        return set([_ for _ in logs if self._is_text_file(_)])
+
+
+    def _get_format(self, name):
+        """ First matching 'log pattern' wins (see: LogSetup)
+        """
+        for pattern, line_format in self._formats:
+            if pattern.search(name):
+                return line_format or DEFAULT_LOG_ENTRY
+
+        return DEFAULT_LOG_ENTRY
+
+
+    def _refresh(self):
+        """ Open new and close 'disappeared' logs
+        """
+        current = self._discover()
+
+        for name in current - set(self._logs.keys()):
+            if name in self._bad_logs:
+                continue
+            try:
+                self._logs[name] = AgentLog(name, self._get_format(name), self._params.get('from_top'),
+                    self._params.get('last_records'))
+                self._events.append({'e': 'open', 'f': name})
+            except (IOError, OSError):
+                self._bad_logs[name] = True
+
+        for name in set(self._logs.keys()) - current:
+            self._logs[name].handle.close()
+            del self._logs[name]
+            self._events.append({'e': 'close', 'f': name})
+
+
+    ###########################################################################
+    # TAILING
+    ###########################################################################
+
+    def _filter_match(self, items, text):
+        """ Same semantics as ptail's filter_match() + grep on the whole record
+        """
+        if self._grep and not self._grep.search(text):
+            return False
+
+        return not self._filters or self._filters.matches(items)
+
+
+    def _emit(self, log):
+        if log.pending_items is None:
+            return
+
+        text = '\n'.join(log.pending_lines)
+        if self._filter_match(log.pending_items, text):
+            self._events.append({'e': 'record', 'f': log.name, 'x': text})
+
+        log.pending_items, log.pending_lines = None, []
+
+
+    def _truncate_line(self, line, dropped=0):
+        """ Truncate line to 'max line length' (same as ptail's RecordLimits.truncate_line())
+
+            dropped: Characters that were already dropped from the line (while it was read)
+        """
+        if self._max_line_length is not None and len(line) > self._max_line_length:
+            dropped += len(line) - self._max_line_length
+            line = line[:self._max_line_length]
+
+        return line + TRUNCATED_LINE % dropped if dropped else line
+
+
+    def _start_record(self, log, items, line):
+        log.pending_items, log.pending_lines = items, [line]
+        log.pending_size, log.pending_truncated = len(line), False
+
+
+    def _add_continuation(self, log, line):
+        """ Add continuation line to the 'pending' record, respecting 'max record size' (same as ptail's FileTailer)
+        """
+        if self._max_record_size is not None and log.pending_size + len(line) > self._max_record_size:
+            if OVERSIZE_SPLIT == self._oversize:
+                items = log.pending_items
+                self._emit(log)
+                self._start_record(log, items, line)
+            elif not log.pending_truncated:
+                log.pending_lines.append(TRUNCATED_RECORD)
+                log.pending_truncated = True
+            return
+
+        log.pending_lines.append(line)
+        log.pending_size += len(line) + 1
+
+
+    def _read_lines(self, log):
+        """ Read (up to) READ_CHUNK_SIZE bytes and return new (complete) lines (None: end of file)
+
+            Lines are truncated as they are read, so that the incomplete last line never exceeds 'max line length'
+        """
+        data = log.handle.read(READ_CHUNK_SIZE)
+        if not data:
+            log.handle.seek(0, 1) # Reset 'EOF' condition
+            return None
+
+        lines = data.decode(WIRE_ENCODING).split('\n')
+        last = lines.pop()
+
+        if lines:
+            lines[0] = self._truncate_line(log.partial + lines[0], log.partial_dropped)
+            lines[1:] = [self._truncate_line(_) for _ in lines[1:]]
+            log.partial, log.partial_dropped = '', 0
+
+        log.partial += last
+        if self._max_line_length is not None and len(log.partial) > self._max_line_length:
+            log.partial_dropped += len(log.partial) - self._max_line_length
+            log.partial = log.partial[:self._max_line_length]
+
+        return lines
+
+
+    def _process_lines(self, log, lines):
+        for line in lines:
+            line = line.strip()
+            matched = log.format.match(line)
+            items = matched.groupdict() if matched else None
+            if items is None:
+                if log.pending_items is not None:
+                    self._add_continuation(log, line)
+                continue
+
+            self._emit(log)
+            self._start_record(log, items, line)
+
+
+    def _tail(self, log):
+        lines = self._read_lines(log)
+        if lines is None:
+            self._emit(log)
+            return
+
+        while lines is not None:
+            self._process_lines(log, lines)
+            lines = self._read_lines(log)
+
+        if DEFAULT_LOG_ENTRY == log.format.pattern:
+            self._emit(log)
+
+
+    def _flush(self):
+        """ Write (compressed) frame with all accumulated events
+        """
+        if not self._events:
+            return
+
+        payload = zlib.compress(json.dumps(self._events).encode('utf-8'))
+        self._output.write(struct.pack('>I', len(payload)) + payload)
+        self._output.flush()
+        self._events = []
+
+
+    def snapshot(self):
+        """ Discover logs once ('discover' mode)
+
+            Returns: {'host_names': [hostname -f, hostname, uname -n],
+                      'processes': [{'pid': ..., 'full_cmd': ..., 'logs': [candidate log, ...]}, ...],
+                      'types': {candidate log: 'text'|'binary'|'empty'}}  (logs, that cannot be read, are skipped)
+        """
+        processes, types = [], {}
+
+        for pid in self._find_pids():
+            cmdline = self._read_cmdline(pid)
+            if cmdline is None:
+                continue  # Process is gone
+            logs = self._find_logs(pid)
+            processes.append({'pid': pid, 'full_cmd': cmdline, 'logs': [to_wire(_) for _ in sorted(logs)]})
+            for log in logs:
+                log_type = self._file_type(log)
+                if log_type:
+                    types[to_wire(log)] = log_type
+
+        return {
+            'host_names': [socket.getfqdn(), socket.gethostname(), os.uname()[1]],
+            'processes': processes,
+            'types': types,
+        }
+
+
+    def run(self):
+        """ Agent 'main loop'
+        """
+        refresh_interval = self._params.get('refresh_interval')
+        wait = self._params.get('wait') or 0.5
+        last_refresh = None
+
+        while True:
+            now = time.time()
+            if last_refresh is None or (refresh_interval and now - last_refresh >= refresh_interval) or \
+                    (not refresh_interval and not self._logs):
+                self._refresh()
+                last_refresh = now
+
+            for name in list(self._logs.keys()):
+                self._tail(self._logs[name])
+
+            self._flush()
+            time.sleep(wait)
+
+
+def main():
+    """ Parameters: base64 encoded JSON (see: PtailAgent())
+    """
+    params = json.loads(base64.b64decode(sys.argv[-1]).decode('utf-8'))
+    output = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    if MODE_DISCOVER == params.get('mode'):
+        output.write(json.dumps(PtailAgent(params, output).snapshot()).encode('utf-8'))
+        output.flush()
+        return
+
+    try:
+        PtailAgent(params, output).run()
+    except (KeyboardInterrupt, IOError):
+        # IOError: ssh connection (our stdout) is gone
+        pass
+
+
+if __name__ == '__main__':
+    main()
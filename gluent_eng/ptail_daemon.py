@@ -0,0 +1,367 @@
+#! /usr/bin/env python
+""" PtailDaemon: Share one ptail 'engine' (log discovery + tailing) between multiple local viewers
+
+    Daemon listens on a Unix domain socket. Each client (see: PtailClient) connects and registers
+    its own filters and grep. Filtering happens on the daemon side, every (matched) record is encoded
+    once and the same encoded record is queued to all interested clients.
+
+    Protocol (newline delimited JSON):
+        client -> daemon: {"filters": [expression, ...], "grep": regex}  (see: make_predicates())
+        daemon -> client: {"f": <log>, "l": <label>, "c": <color>, "x": <record text>}
+                          {"dropped": <number of records dropped since the last message>}
+"""
+
+import errno
+import json
+import logging
+import os
+import os.path
+import re
+import select
+import socket
+import time
+
+from collections import deque
+
+from .field_predicates import make_predicates, FieldPredicateException
+from .file_tailer import FileTailer, filter_match
+from .log_setup import DEFAULT_LOG_ENTRY
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class PtailDaemonException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Max number of records queued for a single client. If the client is slower than that, oldest records are dropped
+DEFAULT_CLIENT_QUEUE = 10000
+
+# Max registration message size
+MAX_REGISTRATION_SIZE = 64 * 1024
+
+# Socket read/write 'chunk' size
+SOCKET_CHUNK_SIZE = 64 * 1024
+
+# Log text is 'bytes' of unknown encoding. latin-1 maps each byte to a character (and back) as is
+WIRE_ENCODING = 'latin-1'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class DaemonClient(object):
+    """ Daemon side 'client' state: registration, filters and (bounded) output queue
+    """
+
+    def __init__(self, connection, queue_size):
+        """ CONSTRUCTOR
+        """
+        self.connection = connection
+        self.connection.setblocking(0)
+
+        self.registered = False
+        self.filters = None     # Predicate 'tree'  (see: make_predicates())
+        self.grep = None        # compiled regex
+
+        self._inbox = ""        # Registration message (until fully received)
+        self._queue = deque()   # Encoded records
+        self._queue_size = queue_size
+        self._outbox = ""       # Partially sent data
+        self._dropped = 0       # Records dropped since the last 'dropped' notification
+
+
+    def register(self, data):
+        """ Accumulate registration data and register when complete
+
+            Returns: True if registration is complete, False otherwise
+        """
+        self._inbox += data
+        if '\n' not in self._inbox:
+            if len(self._inbox) > MAX_REGISTRATION_SIZE:
+                raise PtailDaemonException("Registration message is too long")
+            return False
+
+        registration = json.loads(self._inbox.split('\n', 1)[0])
+        filters = registration.get('filters')
+        self.filters = make_predicates(filters)
+        self.grep = re.compile(registration['grep']) if registration.get('grep') else None
+        self.registered = True
+
+        logger.info("Registered client: %s with filters: %s, grep: %s" % \
+            (id(self.connection), filters, registration.get('grep')))
+        return True
+
+
+    def wants(self, items, text):
+        """ Check if client is interested in the record
+        """
+        if not self.registered:
+            return False
+
+        if self.grep and not self.grep.search(text):
+            return False
+
+        return filter_match(items, self.filters)
+
+
+    def enqueue(self, encoded):
+        """ Queue encoded record. Drop the oldest one, if the queue is full
+        """
+        if len(self._queue) >= self._queue_size:
+            self._queue.popleft()
+            self._dropped += 1
+        self._queue.append(encoded)
+
+
+    @property
+    def has_output(self):
+        return bool(self._outbox or self._queue)
+
+
+    def send(self):
+        """ Send (as much as possible of) queued data without blocking
+        """
+        if not self._outbox:
+            chunks = []
+            if self._dropped:
+                chunks.append(json.dumps({'dropped': self._dropped}) + '\n')
+                self._dropped = 0
+
+            size = 0
+            while self._queue and size < SOCKET_CHUNK_SIZE:
+                chunks.append(self._queue.popleft())
+                size += len(chunks[-1])
+            self._outbox = "".join(chunks)
+
+        try:
+            sent = self.connection.send(self._outbox)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+
+        self._outbox = self._outbox[sent:]
+
+
+class PtailDaemon(object):
+    """ Serve records from PtailRunner() to clients over Unix domain socket
+    """
+
+    def __init__(self, runner, socket_path, queue_size=DEFAULT_CLIENT_QUEUE):
+        """ CONSTRUCTOR
+
+            runner:      PtailRunner() (with display=False)
+            socket_path: Unix domain socket to listen on
+            queue_size:  Max number of records queued per client
+        """
+        self._runner = runner
+        self._socket_path = socket_path
+        self._queue_size = queue_size
+
+        self._server = None
+        self._clients = {}  # {connection: DaemonClient()}
+
+        runner.add_listener(self)
+
+        logger.debug("PtailDaemon() successfully initialized for socket: %s" % socket_path)
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _listen(self):
+        """ Create (listening) Unix domain socket
+        """
+        if os.path.exists(self._socket_path):
+            # Stale socket from a previous daemon ? Only remove it if nobody is listening
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._socket_path)
+                raise PtailDaemonException("Another daemon is already listening on: %s" % self._socket_path)
+            except socket.error:
+                logger.info("Removing stale socket: %s" % self._socket_path)
+                os.unlink(self._socket_path)
+            finally:
+                probe.close()
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._socket_path)
+        self._server.listen(16)
+        self._server.setblocking(0)
+
+        print "[DAEMON] Listening on: %s\n" % self._socket_path
+
+
+    def _drop_client(self, connection, reason):
+        """ Disconnect client
+        """
+        logger.info("Disconnecting client: %s. Reason: %s" % (id(connection), reason))
+        connection.close()
+        del self._clients[connection]
+
+
+    def _poll(self, timeout):
+        """ Process socket events (new clients, registrations, sending records) for up to 'timeout' seconds
+        """
+        deadline = time.time() + timeout
+
+        while True:
+            readers = [self._server] + self._clients.keys()
+            writers = [k for k, v in self._clients.items() if v.has_output]
+
+            readable, writable, _ = select.select(readers, writers, [], max(0, deadline - time.time()))
+
+            for conn in readable:
+                if conn is self._server:
+                    connection, _ = self._server.accept()
+                    self._clients[connection] = DaemonClient(connection, self._queue_size)
+                    logger.info("Accepted client: %s" % id(connection))
+                    continue
+
+                try:
+                    data = conn.recv(SOCKET_CHUNK_SIZE)
+                except socket.error, e:
+                    self._drop_client(conn, e)
+                    continue
+
+                if not data:
+                    self._drop_client(conn, 'disconnected')
+                elif not self._clients[conn].registered:
+                    try:
+                        self._clients[conn].register(data)
+                    except (ValueError, re.error, FieldPredicateException, PtailDaemonException), e:
+                        self._drop_client(conn, "invalid registration: %s" % e)
+
+            for conn in writable:
+                if conn not in self._clients:
+                    continue
+                try:
+                    self._clients[conn].send()
+                except socket.error, e:
+                    self._drop_client(conn, e)
+
+            if time.time() >= deadline:
+                break
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    @property
+    def fields(self):
+        """ Record fields to parse, see: FileTailer() 'listeners'
+
+            None (all fields), as clients can register with any filters at any time
+        """
+        return None
+
+
+    def on_record(self, tailer, items, text):
+        """ Fan out record to interested clients, see: FileTailer() 'listeners'
+
+            Record is encoded (at most) once, regardless of the number of clients
+        """
+        encoded = None
+
+        for client in self._clients.values():
+            if client.wants(items, text):
+                if encoded is None:
+                    encoded = json.dumps({'f': tailer.name, 'l': tailer.label, 'c': tailer.color, 'x': text},
+                        encoding=WIRE_ENCODING) + '\n'
+                client.enqueue(encoded)
+
+
+    def serve(self, wait):
+        """ Daemon 'main loop': tail logs every 'wait' seconds and serve clients in between
+        """
+        self._listen()
+
+        try:
+            while True:
+                self._runner.tail(None, None)
+                self._poll(wait)
+        finally:
+            for connection in self._clients.keys():
+                self._drop_client(connection, 'daemon is shutting down')
+            self._server.close()
+            os.unlink(self._socket_path)
+
+
+class PtailClient(object):
+    """ Connect to PtailDaemon(), register filters and print (highlighted) records
+    """
+
+    def __init__(self, socket_path, filters, grep, highlight, full_color):
+        """ CONSTRUCTOR
+
+            socket_path: Daemon's Unix domain socket
+            filters:     Predicate 'tree' (filtered on the daemon side)
+            grep:        regex (filtered on the daemon side)
+            highlight:   compiled regex (highlighted on the client side)
+            full_color:  (True/False) Whether to color 'the entire output' or just the label
+        """
+        self._socket_path = socket_path
+        self._filters = filters
+        self._grep = grep
+        self._highlight = highlight
+        self._full_color = full_color
+
+        self._renderers = {}  # {log: FileTailer()} - to render records exactly as 'local' ptail does
+
+        logger.debug("PtailClient() successfully initialized for socket: %s" % socket_path)
+
+
+    def _print_record(self, record):
+        """ Print record received from the daemon
+        """
+        if 'dropped' in record:
+            print "[! DROPPED] %d records (client is too slow)" % record['dropped']
+            return
+
+        log = record['f'].encode(WIRE_ENCODING)
+        if log not in self._renderers:
+            label = record['l'].encode(WIRE_ENCODING) if record['l'] else log
+            self._renderers[log] = FileTailer(log, record['c'], self._full_color, DEFAULT_LOG_ENTRY, label)
+
+        print self._renderers[log].render(record['x'].encode(WIRE_ENCODING), self._highlight)
+
+
+    def run(self):
+        """ Connect, register and print records until the daemon goes away
+        """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self._socket_path)
+        except socket.error, e:
+            raise PtailDaemonException("Unable to connect to ptail daemon: %s. Exception: %s" % (self._socket_path, e))
+
+        filters = self._filters.expressions if self._filters else None
+        connection.sendall(json.dumps({'filters': filters, 'grep': self._grep}) + '\n')
+        print "[CLIENT] Connected to: %s\n" % self._socket_path
+
+        data = ""
+        try:
+            while True:
+                chunk = connection.recv(SOCKET_CHUNK_SIZE)
+                if not chunk:
+                    print "[CLIENT] Daemon closed the connection"
+                    break
+
+                lines = (data + chunk).split('\n')
+                data = lines.pop()
+                for line in lines:
+                    self._print_record(json.loads(line))
+        finally:
+            connection.close()
@@ -7,13 +7,23 @@
     (i.e. 'relevant logs' might change as processes open/close them)
 """
 
+import fnmatch
+import glob
 import logging
+import os.path
+import re
 
 from datetime import datetime, timedelta
 
 from .file_tailer import FileTailer
-from .log_setup import DEFAULT_LOG_ENTRY
-from .process_logs import ProcessLogs, METHOD_PID, METHOD_NAME_REGEX, ALLOWED_METHODS
+from .log_discovery import LogDiscovery
+from .log_setup import DEFAULT_LOG_ENTRY, SECTION_RULES
+from .log_source import FileSource, make_source
+from .record_guard import RecordLimits
+from .process_logs import ProcessLogs, METHOD_PID, METHOD_NAME_REGEX, ALLOWED_METHODS, RE_DEFAULT_LOG_NAME_FILTER
+
+# 'Feature' modules (alerts, metrics, session capture, remote agents, directory watches etc)
+# are imported where they are used, so that start-up only pays for the features that are requested
 
 
 ###############################################################################
@@ -34,8 +44,11 @@ logger = logging.getLogger(__name__)
 class PtailRunner(object):
     """ High level 'process tail' interface """
 
-    def __init__(self, refresh_interval, method, search_key, log_filter, from_top, full_color, simple_grep, user, config_file):
-        assert method in ALLOWED_METHODS
+    def __init__(self, refresh_interval, method, search_key, log_filter, from_top, full_color, simple_grep, user, config_file,
+        metrics_port=None, record_dir=None, inputs=None, display=True, hosts=None, wait=None, last_records=None,
+        lag_budget=None, limits=None, correlate=None, globs=None, watch_dirs=False, cache_dir=None,
+        cgroup=None, metrics_address=None):
+        assert method is None or method in ALLOWED_METHODS
 
         self._refresh_interval = refresh_interval  # (look for new logs) Refresh interval, in seconds
         self._last_refresh = None                  # Last refresh time
@@ -44,19 +57,64 @@ class PtailRunner(object):
         self._search_key = search_key              # Method appropriate 'search key', i.e. 'list of pids' or 'name regex'
         self._log_filter = log_filter              # Log name filter, i.e. '.log' or '.txt|.xml'
         self._from_top = from_top                  # Boolean: whether to scan from the beginning of log
+        self._last_records = last_records          # Start from the last N records of each log (None: from the end or top)
         self._full_color = full_color              # Boolean: Colorize "the entire line" in 'log color' if True
         self._simple_grep = simple_grep            # Use 'simple grep' model, when filtering log lines to be output
+        self._metrics_port = metrics_port          # Serve (Prometheus) metrics on this port (None: do not serve)
+        self._metrics_address = metrics_address    # ... and address (None: local connections only)
+        self._record_dir = record_dir              # Record session into this directory (None: do not record)
+        self._lag_budget = lag_budget              # Warn if logs are read more than N seconds behind the writers
+        self._limits = limits                      # Line/record size limits and 'format' time budget (see: RecordLimits)
+        self._inputs = inputs or []                # Additional (non discovered) sources: '-' (stdin), named pipes or files
+        self._globs = globs or []                  # Additional (non discovered) files: glob patterns (incl. future files)
+        self._watch_dirs = watch_dirs              # Boolean: Follow new logs in directories of discovered logs right away
+        self._correlate = correlate                # Group records from all logs by this field (None: do not group)
+        # Boolean: Print records (False: only notify 'listeners', i.e. daemon or 'correlate' mode)
+        self._display = display and not correlate
+        self._hosts = hosts or []                  # Remote hosts to discover and tail logs on (with RemoteAgent)
+        self._wait = wait                          # (remote agents) Wait for new log lines, in seconds
+        self._user = user                          # (remote agents) User to run the agent as
 
         # ProcessLogs object to query UNIX processes for logs
-        self._plogs = ProcessLogs(user=user, setup_file=config_file)
+        self._plogs = ProcessLogs(user=user, setup_file=config_file, cache_dir=cache_dir, cgroup=cgroup)
+        for warning in self._plogs.setup.warnings:
+            print "[! SETUP] %s" % warning
 
         # Log handles
         self._logs_current = {}
         self._logs_prev = {}
+        self._inputs_current = None  # ... for 'inputs' (None: not opened yet)
+        self._logs_watched = {}      # ... for files from 'globs' and 'watched' directories, that were not discovered (yet)
+        self._agents = None          # ... for remote hosts: [RemoteAgent(), ...] (None: not started yet)
+        self._remote_logs = {}       # ... for remote hosts: {(host, log): FileTailer()}
+
+        # Background log discovery (for 'tail' mode) and the last 'applied' discovery snapshot
+        self._discovery = None
+        self._snapshot_version = None
+
+        # New files in the directories of 'globs' (and discovered logs) are picked up as soon as they are created
+        self._watcher = None
+        if self._globs or self._watch_dirs:
+            from .dir_watcher import DirWatcher
+            self._watcher = DirWatcher()
+        self._last_glob = None       # Last time 'globs' were expanded (None: not yet)
+        self._re_log_filter = re.compile(log_filter) if log_filter else RE_DEFAULT_LOG_NAME_FILTER
 
         # 'Bad logs' cache - mark files that cannot be opened so that not to process them again
         self._bad_logs = {}
 
+        # Logs that could not be resolved (no processes left in their namespace yet) - to be retried on the next adjust
+        self._logs_unresolved = set()
+
+        # Objects that are notified of every (parsed) log record, i.e. alert rules
+        self._recorder = None
+        self._lag_tracker = None
+        self._correlator = None
+        self._listeners = self._make_listeners()
+
+        # Record fields that are actually used by filters and listeners (None: all fields)
+        self._fields = None
+
         logger.debug("PtailRunner() successfully initialized")
 
 
@@ -64,6 +122,73 @@ class PtailRunner(object):
     # PRIVATE METHODS
     ###############################################################################
 
+    def _make_listeners(self):
+        """ Construct 'record listeners' based on configuration
+        """
+        listeners = []
+
+        rules = self._plogs.setup.get_section(SECTION_RULES)
+        if rules:
+            from .alert_rules import AlertRules
+            logger.info("Found: %d alert rules in configuration" % len(rules))
+            listeners.append(AlertRules(rules))
+
+        if self._metrics_port or self._lag_budget:
+            from .lag_tracker import LagTracker
+            self._lag_tracker = LagTracker(self._lag_budget)
+            listeners.append(self._lag_tracker)
+
+        if self._metrics_port:
+            from .metrics_exporter import PtailMetrics, MetricsServer, DEFAULT_METRICS_ADDRESS
+            metrics = PtailMetrics(stats_provider=lambda: self._plogs.stats, lag_tracker=self._lag_tracker)
+            MetricsServer(metrics, self._metrics_port, self._metrics_address or DEFAULT_METRICS_ADDRESS).start()
+            listeners.append(metrics)
+
+        if self._record_dir:
+            from .session_capture import SessionRecorder
+            self._recorder = SessionRecorder(self._record_dir)
+            listeners.append(self._recorder)
+
+        if self._correlate:
+            from .record_correlator import RecordCorrelator
+            self._correlator = RecordCorrelator(self._correlate)
+            listeners.append(self._correlator)
+
+        return listeners
+
+
+    def _make_tailer(self, log, meta, source=None):
+        """ Make FileTailer() for the log with (LogSetup style) metadata: {'color': ..., 'format': ..., 'label': ...}
+        """
+        color, format, label = meta['color'], meta['format'], meta['label']
+        if self._simple_grep:
+            logger.debug("Simple 'grep' requested. Forcing trivial log line format")
+            format = DEFAULT_LOG_ENTRY
+
+        return FileTailer(log, color, self._full_color, format, label, self._listeners, source, self._display,
+            self._limits, self._fields)
+
+
+    def _set_needed_fields(self, filters):
+        """ Work out record fields that are actually used by filters and listeners,
+            so that tailers do not capture (or even parse) the rest
+
+            Listeners that do not declare 'fields' (or declare None) need all fields
+        """
+        fields = set(filters.fields) if filters else set()
+
+        for listener in self._listeners:
+            listener_fields = getattr(listener, 'fields', None)
+            if listener_fields is None:
+                logger.debug("Listener: %s needs all record fields" % listener.__class__.__name__)
+                self._fields = None
+                return
+            fields.update(listener_fields)
+
+        logger.debug("Needed record fields: %s" % sorted(fields))
+        self._fields = fields
+
+
     def _get_new_logs(self):
         """ Re-query 'processes' for updated list of logs
         """
@@ -73,36 +198,61 @@ class PtailRunner(object):
         return new_logs
 
 
-    def _adjust_logs(self, new_logs):
+    def _adjust_logs(self, new_logs, changes=None):
         """ Compare previous and current list of logs
             Open 'added' logs, Close 'deleted' logs
+
+            changes: ([added log, ...], [removed log, ...]) since the previous list of logs, if already known
+                     (see: ProcessLogs().changes). None: compare the lists
         """
         adjusted = False
 
-        current_logs = set(new_logs.keys())
-        logger.debug("Current logs: %s" % current_logs)
-        prev_logs = set([self._logs_prev[_].name for _ in self._logs_prev])
+        if changes is not None:
+            # 'changes' only report a log once, so logs that could not be resolved last time are retried explicitly
+            added_logs = list(changes[0]) + \
+                [_ for _ in self._logs_unresolved if _ in new_logs and _ not in changes[0]]
+            deleted_logs = [_ for _ in changes[1] if _ in self._logs_current]
+        else:
+            current_logs = set(new_logs.keys())
+            logger.debug("Current logs: %s" % current_logs)
+            prev_logs = set([self._logs_prev[_].name for _ in self._logs_prev])
+
+            added_logs = list(current_logs - prev_logs)
+            deleted_logs = list(prev_logs - current_logs)
 
-        added_logs = list(current_logs - prev_logs)
         logger.info("Identified: %d new logs: %s" % (len(added_logs), added_logs))
-        deleted_logs = list(prev_logs - current_logs)
         logger.info("Identified: %d closed logs: %s" % (len(deleted_logs), deleted_logs))
 
         # Process 'added' logs
+        self._logs_unresolved = set()
         for log in added_logs:
             if log in self._bad_logs:
                 logger.debug("Log: %s is 'bad' (permissions ?). Not processing it" % log)
                 continue
 
-            color, format, label = new_logs[log]['color'], new_logs[log]['format'], new_logs[log]['label']
-            if self._simple_grep:
-                logger.debug("Simple 'grep' requested. Forcing trivial log line format")
-                format = DEFAULT_LOG_ENTRY
+            # Logs in other mount namespaces (i.e. containers) are opened through process root directories
+            file_name = self._plogs.resolve(log)
+            if file_name is None:
+                logger.debug("Log: %s cannot be resolved (no processes are left in its namespace). Retrying later" % log)
+                self._logs_unresolved.add(log)
+                continue
+
+            if self._watch_dirs and file_name == log:
+                self._watcher.watch(os.path.dirname(log))
+
+            if log in self._logs_watched:
+                logger.debug("Log: %s is already followed (found in watched directory)" % log)
+                self._logs_current[log] = self._logs_watched.pop(log)
+                if self._recorder:
+                    self._recorder.register(log, new_logs[log]['processes'])
+                continue
 
             logger.debug("Adding new log: %s" % log)
-            new_log = FileTailer(log, color, self._full_color, format, label)
-            if new_log.open(self._from_top):
+            new_log = self._make_tailer(log, new_logs[log], FileSource(file_name) if file_name != log else None)
+            if new_log.open(self._from_top, self._last_records):
                 self._logs_current[log] = new_log
+                if self._recorder:
+                    self._recorder.register(log, new_logs[log]['processes'])
                 adjusted = True
             else:
                 logger.warn("Unable to open log: %s. Marking as 'bad'" % log)
@@ -118,6 +268,203 @@ class PtailRunner(object):
         return adjusted
 
 
+    def _open_inputs(self):
+        """ Open 'inputs' (stdin, named pipes or files, supplied by the user)
+
+            Colors, formats and labels come from setup, same as for 'discovered' logs
+        """
+        setup = self._plogs.setup
+        self._inputs_current = {}
+
+        for source_name in self._inputs:
+            source = make_source(source_name)
+            log = source.name
+            meta = setup.get_meta(log)
+            meta['label'] = meta['label'] or os.path.basename(log)
+
+            logger.debug("Adding input: %s" % log)
+            new_log = self._make_tailer(log, meta, source)
+            if new_log.open(self._from_top, self._last_records):
+                self._inputs_current[log] = new_log
+            else:
+                logger.warn("Unable to open input: %s" % log)
+
+        if self._inputs_current:
+            print "" # Empty line after all inputs have been announced
+
+
+    def _follow_watched(self, log, open_at_top, last_records=None):
+        """ Start following (not discovered) log from 'globs' or 'watched' directory
+
+            Returns: True if the log was opened, False otherwise
+        """
+        if log in self._logs_current or log in self._logs_watched or log in self._bad_logs:
+            return False
+
+        meta = self._plogs.setup.get_meta(log)
+        meta['label'] = meta['label'] or os.path.basename(log)
+
+        logger.debug("Adding watched log: %s" % log)
+        new_log = self._make_tailer(log, meta)
+        if not new_log.open(open_at_top, last_records):
+            logger.warn("Unable to open log: %s. Marking as 'bad'" % log)
+            self._bad_logs[log] = True
+            return False
+
+        self._logs_watched[log] = new_log
+        return True
+
+
+    def _expand_globs(self):
+        """ Follow files that match 'globs' and watch their directories for new ones
+
+            Globs are re-expanded every 'refresh interval' to pick up new directories
+            (new files in already watched directories are picked up by the watcher right away)
+        """
+        first_time = self._last_glob is None
+        adjusted = False
+
+        for pattern in self._globs:
+            for directory in glob.glob(os.path.dirname(pattern) or '.'):
+                self._watcher.watch(directory)
+            for log in glob.glob(pattern):
+                if os.path.isfile(log):
+                    # Files that appear later are followed from the top, so that no lines are lost
+                    if first_time:
+                        adjusted |= self._follow_watched(log, self._from_top, self._last_records)
+                    else:
+                        adjusted |= self._follow_watched(log, True)
+
+        self._last_glob = datetime.now()
+        return adjusted
+
+
+    def _wants_watched(self, log):
+        """ Check if new file (in one of the watched directories) should be followed
+        """
+        if any(fnmatch.fnmatch(log, _) for _ in self._globs):
+            return True
+
+        return self._watch_dirs and bool(self._re_log_filter.search(log))
+
+
+    def _apply_watched_changes(self):
+        """ Follow new files in watched directories (and stop following removed ones)
+        """
+        adjusted = False
+
+        if self._globs and (self._last_glob is None or \
+            self._last_glob + timedelta(seconds=self._refresh_interval or 0) < datetime.now()):
+            adjusted = self._expand_globs()
+
+        added, removed, overflowed = self._watcher.poll()
+
+        for log in added:
+            if os.path.isfile(log) and self._wants_watched(log):
+                adjusted |= self._follow_watched(log, True)
+
+        for log in removed:
+            if log in self._logs_watched:
+                logger.debug("Watched log: %s was removed" % log)
+                self._logs_watched[log].close()
+                del self._logs_watched[log]
+                adjusted = True
+
+        if overflowed:
+            self._last_glob = None  # Some events were lost: re-expand globs on the next 'tail'
+
+        if adjusted:
+            print "" # Empty line after all logs have been announced
+
+
+    def _start_agents(self, filters):
+        """ Start remote agents (one ssh session per host)
+
+            Log discovery, tailing and filtering happen on remote hosts,
+            only matching records are sent back
+        """
+        setup = self._plogs.setup
+        formats = setup.get_formats()
+        if self._simple_grep:
+            logger.debug("Simple 'grep' requested. Forcing trivial log line format on remote agents")
+            formats = [(_[0], DEFAULT_LOG_ENTRY) for _ in formats]
+        limits = self._limits or RecordLimits()
+
+        params = {
+            'method': self._method,
+            'search_key': self._search_key,
+            'log_filter': self._log_filter,
+            'formats': formats,
+            'filters': filters.expressions if filters else None,
+            'from_top': self._from_top,
+            'last_records': self._last_records,
+            'refresh_interval': self._refresh_interval,
+            'wait': self._wait,
+            'limits': {
+                'max_line_length': limits.max_line_length,
+                'max_record_size': limits.max_record_size,
+                'oversize': limits.oversize,
+            },
+        }
+
+        from .remote_agent import RemoteAgent
+
+        self._agents = []
+        for host in self._hosts:
+            agent = RemoteAgent(host, self._user, params)
+            agent.start()
+            self._agents.append(agent)
+
+
+    def _make_remote_tailer(self, host, log):
+        """ Make FileTailer() to render (already filtered) records from remote log
+        """
+        meta = self._plogs.setup.get_meta(log)
+        meta['label'] = "%s:%s" % (host, meta['label'] or os.path.basename(log))
+
+        return self._make_tailer(log, meta)
+
+
+    def _tail_remote(self, highlight):
+        """ Process events from remote agents
+        """
+        from .remote_agent import EVENT_OPEN, EVENT_CLOSE, EVENT_RECORD
+
+        announced = False
+
+        for agent in self._agents:
+            for event in agent.read_events():
+                key = (agent.host, event['f'])
+                if key not in self._remote_logs:
+                    self._remote_logs[key] = self._make_remote_tailer(agent.host, event['f'])
+
+                if EVENT_OPEN == event['e']:
+                    print "[+ LOG] %s" % self._remote_logs[key].render("Following remote log: %s:%s" % key, None)
+                    announced = True
+                elif EVENT_CLOSE == event['e']:
+                    print "[- LOG] %s" % self._remote_logs[key].render("Unfollowing remote log: %s:%s" % key, None)
+                    del self._remote_logs[key]
+                    announced = True
+                elif EVENT_RECORD == event['e']:
+                    if announced:
+                        print "" # Empty line after all logs have been announced
+                        announced = False
+                    # Records were filtered by the agent already
+                    self._remote_logs[key].feed(event['x'].split('\n'), None, highlight)
+
+        if announced:
+            print "" # Empty line after all logs have been announced
+
+
+    def _tail_log(self, tailer, filters, highlight):
+        """ Tail a single log (sampling 'ingest lag' right before)
+        """
+        if self._lag_tracker:
+            self._lag_tracker.on_poll(tailer)
+
+        tailer.tail(filters, highlight)
+
+
     def _refresh_logs_if_necessary(self, open_logs):
         """ Refresh logs if 1st time or 'refresh interval' expired
         """
@@ -136,21 +483,136 @@ class PtailRunner(object):
             self._last_refresh = now
 
 
+    def _apply_discovered_logs(self):
+        """ Start background log discovery (1st time) and apply the latest discovered logs (if changed)
+
+            Unlike _refresh_logs_if_necessary(), never waits for discovery to complete
+        """
+        if not self._discovery:
+            get_call = self._plogs.by_pid if METHOD_PID == self._method else self._plogs.by_name
+            self._discovery = LogDiscovery(lambda: get_call(self._search_key, self._log_filter), self._refresh_interval,
+                changes=lambda: self._plogs.changes)
+            self._discovery.start()
+
+        snapshot = self._discovery.latest()
+        if not snapshot or snapshot.version == self._snapshot_version:
+            return
+
+        # Changes since the previous snapshot can only be applied, if it was the one applied last
+        changes = snapshot.changes if snapshot.version == (self._snapshot_version or 0) + 1 else None
+
+        self._logs_prev = dict((k, v) for k, v in self._logs_current.items()) # Need a true {} copy
+        if self._adjust_logs(snapshot.logs, changes):  # Open/close files and set new self._logs_current
+            print "" # Empty line after all logs have been announced
+        self._snapshot_version = snapshot.version
+
+
     ###############################################################################
     # PUBLIC METHODS
     ###############################################################################
 
     def tail(self, filters, highlight):
-        """ Tail 'current' logs
+        """ Tail 'current' logs (and inputs)
         """
-        self._refresh_logs_if_necessary(open_logs=True)
+        self._set_needed_fields(filters)
+
+        if self._inputs_current is None:
+            self._open_inputs()
+
+        if self._hosts:
+            if self._agents is None:
+                self._start_agents(filters)
+            self._tail_remote(highlight)
+        elif self._method:
+            self._apply_discovered_logs()
+
+        if self._watcher:
+            self._apply_watched_changes()
 
         if 0 == len(self._logs_current):
             # print "No logs qualified"
             pass
         else:
             for log in self._logs_current:
-                self._logs_current[log].tail(filters, highlight)
+                self._tail_log(self._logs_current[log], filters, highlight)
+
+        for log in self._logs_watched:
+            self._tail_log(self._logs_watched[log], filters, highlight)
+
+        for log in self._inputs_current:
+            self._tail_log(self._inputs_current[log], filters, highlight)
+
+        if self._correlator:
+            self._correlator.flush(filters, highlight)
+
+        if self._lag_tracker:
+            for label, lag in self._lag_tracker.check_budget():
+                print "[! LAG] [%s] Reading %.2f seconds behind the writer (budget: %s seconds)" % \
+                    (label, lag, self._lag_budget)
+
+
+    def add_listener(self, listener):
+        """ Add record 'listener' (see: FileTailer()), i.e. PtailDaemon()
+        """
+        self._listeners.append(listener)
+
+
+    @property
+    def exhausted(self):
+        """ True if there is nothing more to tail, i.e. no process discovery (or globs) and all inputs reached EOF
+        """
+        return not self._method and not self._globs and self._inputs_current is not None and \
+            all(_.exhausted for _ in self._inputs_current.values())
+
+
+    def replay(self, capture_dir, speed, filters, highlight):
+        """ Replay recorded session (see: SessionRecorder()) through the usual filter/highlight pipeline
+
+            speed: 0 - as fast as possible, 1 - 'real time' pace, 2 - twice as fast etc
+        """
+        from .session_capture import SessionReplay
+
+        setup = self._plogs.setup
+        tailers = {}
+        self._set_needed_fields(filters)
+
+        for record in SessionReplay(capture_dir).records(speed):
+            log = record['f']
+            if log not in tailers:
+                # Colors and formats come from the 'current' configuration, labels - from the recording
+                meta = setup.get_meta(log)
+                meta['label'] = record['l']
+                tailers[log] = self._make_tailer(log, meta)
+
+            tailers[log].feed(record['x'].split('\n'), filters, highlight)
+            if self._correlator:
+                self._correlator.flush(filters, highlight)
+
+
+
+    def close(self):
+        """ Release resources, i.e. stop log discovery (and remote agents), finalize session recording
+            and print remaining 'correlated' groups
+        """
+        # Records that are still waiting for continuation lines (i.e. from inputs that reached EOF)
+        for tailers in (self._logs_current, self._logs_watched, self._inputs_current or {}):
+            for tailer in tailers.values():
+                tailer.flush()
+
+        if self._discovery:
+            self._discovery.stop()
+
+        if self._watcher:
+            self._watcher.close()
+
+        for agent in self._agents or []:
+            agent.stop()
+
+        if self._recorder:
+            self._recorder.close()
+
+        if self._correlator:
+            self._correlator.close()
 
 
     def show(self):
@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+""" RecordCorrelator: Group records from all followed logs by 'correlation id' field
+    (i.e. query id or application id) and print per id 'timelines'
+
+    Groups are printed when they go 'idle' (no new records for a while).
+    Memory is bounded:
+        - groups older than 'ttl' are printed (as they are) and started over
+        - least recently updated groups are printed (and dropped) when there are too many of them
+        - records beyond 'max records' per group are counted, but not kept
+"""
+
+import logging
+import time
+
+from collections import OrderedDict
+
+from .file_tailer import filter_match
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Print group after no new records for N seconds
+DEFAULT_IDLE_TIMEOUT = 5
+
+# Print (and restart) group after N seconds, even if it is still active
+DEFAULT_TTL = 600
+
+# Max number of groups to keep
+DEFAULT_MAX_GROUPS = 10000
+
+# Max number of records to keep per group
+DEFAULT_MAX_RECORDS = 1000
+
+# Reasons to print a group
+REASON_IDLE = 'idle'
+REASON_TTL = 'ttl expired'
+REASON_EVICTED = 'evicted'
+REASON_CLOSED = 'closed'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class RecordGroup(object):
+    """ Records that share the same 'correlation id'
+    """
+    __slots__ = ('id', 'first_seen', 'last_seen', 'records', 'dropped')
+
+    def __init__(self, group_id, now):
+        self.id = group_id
+        self.first_seen = now
+        self.last_seen = now
+        self.records = []   # [(tailer, items, text), ...] in arrival order
+        self.dropped = 0    # Records beyond 'max records'
+
+
+class RecordCorrelator(object):
+    """ Correlate records by id field, see: FileTailer() 'listeners'
+    """
+
+    def __init__(self, field, idle_timeout=DEFAULT_IDLE_TIMEOUT, ttl=DEFAULT_TTL, max_groups=DEFAULT_MAX_GROUPS,
+        max_records=DEFAULT_MAX_RECORDS):
+        """ CONSTRUCTOR
+
+            field:        'Correlation id' field name (from log 'format', see: LogSetup)
+            idle_timeout: Print group after no new records for N seconds
+            ttl:          Print (and restart) group after N seconds, even if it is still active
+            max_groups:   Max number of groups to keep (least recently updated are printed and dropped first)
+            max_records:  Max number of records to keep per group
+        """
+        self._field = field
+        self._idle_timeout = idle_timeout
+        self._ttl = ttl
+        self._max_groups = max_groups
+        self._max_records = max_records
+
+        self._groups = OrderedDict()  # {id: RecordGroup()}, least recently updated first
+        self._ready = []              # [(RecordGroup(), reason), ...] to be printed
+        self._filters = None          # Filters and highlight from the last flush() (to be used by close())
+        self._highlight = None
+
+        logger.debug("RecordCorrelator() successfully initialized for field: %s" % field)
+
+
+    def _print_group(self, group, reason, filters, highlight):
+        """ Print group 'timeline' (if any of its records match filters)
+        """
+        if filters and not any(filter_match(items, filters) for _, items, _ in group.records):
+            logger.debug("Group: %s does not match filters. Skipping" % group.id)
+            return
+
+        logs = set([_[0].name for _ in group.records])
+        print "[= %s: %s] %d records from %d logs in %.3f seconds (%s)" % \
+            (self._field, group.id, len(group.records) + group.dropped, len(logs),
+            group.last_seen - group.first_seen, reason)
+        for tailer, _, text in group.records:
+            print "    %s" % tailer.render(text, highlight).replace("\n", "\n    ")
+        if group.dropped:
+            print "    ... %d more records" % group.dropped
+        print ""
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    @property
+    def fields(self):
+        """ Record fields that records are grouped by, see: FileTailer() 'listeners' """
+        return frozenset((self._field,))
+
+
+    def on_record(self, tailer, items, text):
+        """ Add record to its group, see: FileTailer() 'listeners'
+
+            Records without 'correlation id' are ignored
+        """
+        group_id = items.get(self._field) if items else None
+        if not group_id:
+            return
+
+        now = time.time()
+        group = self._groups.pop(group_id, None)
+        if group and now - group.first_seen > self._ttl:
+            self._ready.append((group, REASON_TTL))
+            group = None
+        if not group:
+            group = RecordGroup(group_id, now)
+
+        group.last_seen = now
+        if len(group.records) < self._max_records:
+            group.records.append((tailer, items, text))
+        else:
+            group.dropped += 1
+        self._groups[group_id] = group  # (Re)insert as the most recently updated
+
+        while len(self._groups) > self._max_groups:
+            _, evicted = self._groups.popitem(last=False)
+            self._ready.append((evicted, REASON_EVICTED))
+
+
+    def flush(self, filters, highlight, everything=False):
+        """ Print groups that went 'idle' (or all groups if 'everything')
+        """
+        self._filters, self._highlight = filters, highlight
+        now = time.time()
+
+        while self._groups:
+            group_id, group = next(self._groups.iteritems())
+            if not everything and now - group.last_seen < self._idle_timeout:
+                break  # ... and all the later groups are even 'fresher'
+            del self._groups[group_id]
+            self._ready.append((group, REASON_CLOSED if everything else REASON_IDLE))
+
+        ready, self._ready = self._ready, []
+        for group, reason in ready:
+            self._print_group(group, reason, filters, highlight)
+
+
+    def close(self):
+        """ Print all remaining groups
+        """
+        self.flush(self._filters, self._highlight, everything=True)
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+""" RecordGuard: Guardrails against 'pathological' log lines and regular expressions
+
+    1. RecordLimits(): Max line length, max record size (and what to do with oversized records)
+       and 'time budget' for matching a single line against the log 'format'
+    2. check_backtracking(): Static check for regex constructs, prone to 'catastrophic backtracking',
+       i.e. nested quantifiers: (\w+\s?)* or adjacent wildcards: .*.*
+
+    python 're' cannot be interrupted in the middle of a match, and line length limit does not help
+    against exponential backtracking. Formats flagged by check_backtracking() are therefore replaced
+    with plain text before they are used (see: LogSetup()). Time budget is a safety net for the rest
+    and is enforced 'after the fact': formats that exceed it are replaced with plain text (see: FileTailer())
+"""
+
+import logging
+import sre_constants
+import sre_parse
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Max line length (longer lines are truncated before matching)
+DEFAULT_MAX_LINE_LENGTH = 64 * 1024
+
+# Max record (head + continuation lines) size
+DEFAULT_MAX_RECORD_SIZE = 1024 * 1024
+
+# What to do with oversized records
+OVERSIZE_TRUNCATE = 'truncate'  # Drop the rest of continuation lines
+OVERSIZE_SPLIT = 'split'        # Emit what we have and continue with a new record
+OVERSIZE_MODES = (OVERSIZE_TRUNCATE, OVERSIZE_SPLIT)
+
+# Time budget (in seconds) for matching a single line against the format
+DEFAULT_MATCH_BUDGET = 0.1
+
+# Fall back to plain text for good after this many consecutive 'over the budget' matches
+MAX_BUDGET_OVERRUNS = 3
+
+# Only time matches of lines at least that long (shorter lines are cheap to match with 'checked' formats)
+MIN_TIMED_LINE_LENGTH = 1024
+
+# Markers for truncated lines and records
+TRUNCATED_LINE = " ... [truncated: %d characters]"
+TRUNCATED_RECORD = "... [record truncated]"
+
+MAXREPEAT = getattr(sre_constants, 'MAXREPEAT', 65535)
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class RecordLimits(object):
+    """ Line/record size limits and format 'match' time budget
+    """
+
+    def __init__(self, max_line_length=DEFAULT_MAX_LINE_LENGTH, max_record_size=DEFAULT_MAX_RECORD_SIZE,
+        oversize=OVERSIZE_TRUNCATE, match_budget=DEFAULT_MATCH_BUDGET):
+        """ CONSTRUCTOR
+
+            max_line_length: Lines longer than that are truncated (before matching)
+            max_record_size: Records larger than that are either truncated or split (see: oversize)
+            oversize:        OVERSIZE_TRUNCATE or OVERSIZE_SPLIT
+            match_budget:    Time budget for matching a single line against the format, in seconds
+        """
+        assert oversize in OVERSIZE_MODES
+
+        self.max_line_length = max_line_length
+        self.max_record_size = max_record_size
+        self.oversize = oversize
+        self.match_budget = match_budget
+
+
+    def truncate_line(self, line):
+        """ Truncate line to max_line_length (if necessary)
+        """
+        if len(line) <= self.max_line_length:
+            return line
+
+        return line[:self.max_line_length] + TRUNCATED_LINE % (len(line) - self.max_line_length)
+
+
+def _is_variable_repeat(item):
+    """ Is (parsed) regex item a quantifier that can match a variable number of times, i.e. +, *, {1,5}
+    """
+    op, av = item
+    return op in REPEATS and av[1] > av[0]
+
+
+def _is_wildcard(item):
+    """ Is (parsed) regex item an unbounded 'any character' quantifier, i.e. .* or (.+)
+    """
+    op, av = item
+    if sre_constants.SUBPATTERN == op and 1 == len(av[-1]):
+        return _is_wildcard(av[-1][0])
+
+    return op in REPEATS and MAXREPEAT == av[1] and 1 == len(av[2]) and sre_constants.ANY == av[2][0][0]
+
+
+def _children(av):
+    """ Sub patterns of (parsed) regex item
+    """
+    if isinstance(av, sre_parse.SubPattern):
+        return [av]
+    if isinstance(av, (tuple, list)):
+        children = []
+        for _ in av:
+            children.extend(_children(_))
+        return children
+    return []
+
+
+def _find_issues(subpattern, in_repeat, issues):
+    """ Walk (parsed) regex 'tree' and collect 'backtracking prone' constructs
+    """
+    items = list(subpattern)
+
+    for i, item in enumerate(items):
+        op, av = item
+
+        if i > 0 and _is_wildcard(item) and _is_wildcard(items[i - 1]):
+            issues.append("adjacent wildcards (i.e. .*.*)")
+
+        is_repeat = _is_variable_repeat(item)
+        if is_repeat and in_repeat:
+            issues.append("nested quantifiers (i.e. (a+)*)")
+
+        for child in _children(av):
+            _find_issues(child, in_repeat or (is_repeat and av[1] > 1), issues)
+
+
+def check_backtracking(pattern):
+    """ Check regex for constructs prone to catastrophic backtracking
+
+        Returns: List of issues (empty if none found or pattern is not a valid regex)
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (sre_constants.error, TypeError):
+        return []
+
+    issues = []
+    _find_issues(parsed, False, issues)
+
+    return sorted(set(issues))
@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+""" RemoteAgent: Run PtailAgent (see: ptail_agent) on a remote host over a single ssh session
+    and read back (compressed, framed) records
+
+    or run it once, in 'discover' mode, to take a snapshot of remote processes and their logs (see: snapshot())
+"""
+
+import base64
+import errno
+import fcntl
+import json
+import logging
+import os
+import os.path
+import pipes
+import struct
+import subprocess
+import zlib
+
+from .linux_cmd import SSH_DEFAULTS
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class RemoteAgentException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Agent 'source' files (shipped to remote hosts as is and executed in this order)
+AGENT_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), _) for _ in \
+    ('field_predicates.py', 'text_detector.py', 'ptail_agent.py')]
+
+# Remote 'bootstrap': decompress and run agent source (supplied as the 1st argument)
+AGENT_BOOTSTRAP = "import sys,zlib,base64;exec(zlib.decompress(base64.b64decode(sys.argv[1])))"
+
+# Remote python interpreter (whichever is available)
+REMOTE_PYTHON = "$(command -v python2 || command -v python || command -v python3)"
+
+# Frame 'header': 4 byte length, big endian
+FRAME_HEADER = '>I'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+# Max bytes to read from agent in one go
+READ_CHUNK_SIZE = 256 * 1024
+
+# Log text is 'bytes' of unknown encoding. latin-1 maps each byte to a character (and back) as is
+WIRE_ENCODING = 'latin-1'
+
+# Agent events
+EVENT_OPEN = 'open'
+EVENT_CLOSE = 'close'
+EVENT_RECORD = 'record'
+
+# Agent modes
+MODE_DISCOVER = 'discover'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def read_agent_source():
+    """ Read (and compress) agent sources as a single 'program'
+    """
+    sources = []
+    for source in AGENT_SOURCES:
+        with open(source) as f:
+            sources.append(f.read())
+
+    return base64.b64encode(zlib.compress("\n".join(sources)))
+
+
+class RemoteAgent(object):
+    """ ssh 'session' with remote PtailAgent
+    """
+
+    def __init__(self, host, user, params):
+        """ CONSTRUCTOR
+
+            host:   Host to run the agent on
+            user:   (remote) User to run the agent as (with sudo). None: ssh user
+            params: Agent parameters (see: PtailAgent())
+        """
+        self._host = host
+        self._user = user
+        self._params = params
+
+        self._process = None
+        self._buffer = ""
+        self._finished = False
+
+        logger.debug("RemoteAgent() successfully initialized for host: %s" % host)
+
+
+    def _make_cmd(self):
+        """ Make 'ssh' command (as a list, no local shell is involved)
+        """
+        payload = base64.b64encode(json.dumps(self._params))
+        remote_cmd = "%s -c %s %s %s" % (REMOTE_PYTHON, pipes.quote(AGENT_BOOTSTRAP), read_agent_source(), payload)
+        if self._user:
+            remote_cmd = "sudo -n -u %s %s" % (pipes.quote(self._user), remote_cmd)
+
+        ssh_cmd = ['ssh']
+        for k, v in SSH_DEFAULTS.items():
+            ssh_cmd.extend(['-o', "%s=%s" % (k, v)])
+        ssh_cmd.extend([self._host, remote_cmd])
+
+        return ssh_cmd
+
+
+    def _decode(self, frame):
+        """ Decode (compressed) frame into a list of events
+        """
+        events = json.loads(zlib.decompress(frame))
+        for event in events:
+            event['f'] = event['f'].encode(WIRE_ENCODING)
+            if 'x' in event:
+                event['x'] = event['x'].encode(WIRE_ENCODING)
+
+        return events
+
+
+    @property
+    def host(self):
+        return self._host
+
+
+    @property
+    def finished(self):
+        return self._finished
+
+
+    def start(self):
+        """ Start ssh session
+        """
+        cmd = self._make_cmd()
+        logger.info("Starting remote agent on host: %s" % self._host)
+        logger.debug("Remote agent command: %s" % " ".join(cmd[:-1]))
+
+        try:
+            self._process = subprocess.Popen(cmd, stdin=open(os.devnull), stdout=subprocess.PIPE)
+        except OSError, e:
+            raise RemoteAgentException("Unable to start ssh session to host: %s. Exception: %s" % (self._host, e))
+
+        fd = self._process.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+    def snapshot(self):
+        """ Run agent once in 'discover' mode (params: {'mode': 'discover', ...}) and return its snapshot
+            (see: PtailAgent.snapshot()), with file names as (byte) strings
+        """
+        cmd = self._make_cmd()
+        logger.info("Taking discovery snapshot on host: %s" % self._host)
+
+        try:
+            process = subprocess.Popen(cmd, stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
+        except OSError, e:
+            raise RemoteAgentException("Unable to start ssh session to host: %s. Exception: %s" % (self._host, e))
+
+        if process.returncode:
+            raise RemoteAgentException("Discovery on host: %s failed with: %s. Error: %s" % \
+                (self._host, process.returncode, stderr.strip()))
+
+        try:
+            snapshot = json.loads(stdout)
+        except ValueError, e:
+            raise RemoteAgentException("Invalid discovery snapshot from host: %s. Exception: %s" % (self._host, e))
+
+        snapshot['host_names'] = [_.encode(WIRE_ENCODING) for _ in snapshot['host_names']]
+        for proc in snapshot['processes']:
+            proc['full_cmd'] = proc['full_cmd'].encode(WIRE_ENCODING)
+            proc['logs'] = [_.encode(WIRE_ENCODING) for _ in proc['logs']]
+        snapshot['types'] = dict((k.encode(WIRE_ENCODING), v) for k, v in snapshot['types'].items())
+
+        return snapshot
+
+
+    def stop(self):
+        """ Stop ssh session
+        """
+        if self._process and self._process.poll() is None:
+            logger.info("Stopping remote agent on host: %s" % self._host)
+            self._process.terminate()
+            self._process.wait()
+
+
+    def read_events(self):
+        """ Read (and decode) all available events without blocking
+        """
+        if self._finished:
+            return []
+
+        chunks = [self._buffer]
+        eof = False
+        while True:
+            try:
+                chunk = os.read(self._process.stdout.fileno(), READ_CHUNK_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                eof = True
+                break
+            chunks.append(chunk)
+        data = "".join(chunks)
+
+        events = []
+        while len(data) >= FRAME_HEADER_SIZE:
+            frame_size = struct.unpack(FRAME_HEADER, data[:FRAME_HEADER_SIZE])[0]
+            if len(data) < FRAME_HEADER_SIZE + frame_size:
+                break
+            events.extend(self._decode(data[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + frame_size]))
+            data = data[FRAME_HEADER_SIZE + frame_size:]
+        self._buffer = data
+
+        if eof:
+            self._finished = True
+            logger.warn("Remote agent on host: %s exited with: %s" % (self._host, self._process.wait()))
+
+        return events
@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+""" SessionCapture: Record ptail sessions and replay them later
+
+    Capture = directory with compressed (gzip), append-only 'segment' files
+    Each segment is a sequence of (JSON) records, one per line:
+
+        {"t": <time received>, "f": <log file>, "l": <label>, "p": [<pid>, ...], "c": <cmd>, "x": <record text>}
+
+    Segments are named: ptail-<session start>-<sequence>.jsonl.gz, so that 'name order' is 'time order'
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import os.path
+import time
+import zlib
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class SessionCaptureException(Exception): pass
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Segment file name 'template' and 'search pattern'
+SEGMENT_NAME = 'ptail-%s-%06d.jsonl.gz'
+SEGMENT_GLOB = 'ptail-*.jsonl.gz'
+
+# Start a new segment after this many (uncompressed) bytes
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Make records 'durable' (readable by replay) at least every N seconds
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Log text is 'bytes' of unknown encoding. latin-1 maps each byte to a character (and back) as is
+CAPTURE_ENCODING = 'latin-1'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+class SessionRecorder(object):
+    """ Record (parsed) log records into 'capture' directory
+
+        Implements FileTailer() 'listener' interface
+    """
+
+    def __init__(self, capture_dir, segment_size=DEFAULT_SEGMENT_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """ CONSTRUCTOR
+
+            capture_dir:    Directory to write segments to (created if it does not exist)
+            segment_size:   Start a new segment after this many (uncompressed) bytes
+            flush_interval: Flush records to disk at least every N seconds
+        """
+        self._capture_dir = capture_dir
+        self._segment_size = segment_size
+        self._flush_interval = flush_interval
+
+        self._session = time.strftime('%Y%m%d-%H%M%S')
+        self._sequence = 0
+
+        self._segment = None     # Current segment (GzipFile)
+        self._written = 0        # ... bytes written to current segment
+        self._last_flush = None  # ... last time it was flushed
+
+        self._processes = {}     # {log: ([pid, ...], cmd)}
+
+        if not os.path.isdir(capture_dir):
+            logger.info("Creating capture directory: %s" % capture_dir)
+            os.makedirs(capture_dir)
+
+        logger.debug("SessionRecorder() successfully initialized for: %s" % capture_dir)
+
+
+    def __del__(self):
+        """ DESTRUCTOR
+        """
+        self.close()
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _next_segment(self):
+        """ Close current segment (if any) and open the next one
+        """
+        self.close()
+
+        self._sequence += 1
+        segment_name = os.path.join(self._capture_dir, SEGMENT_NAME % (self._session, self._sequence))
+        if os.path.exists(segment_name):
+            raise SessionCaptureException("Capture segment: %s already exists" % segment_name)
+
+        logger.info("Starting capture segment: %s" % segment_name)
+        self._segment = gzip.open(segment_name, 'wb')
+        self._written = 0
+        self._last_flush = time.time()
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    def register(self, log_name, processes):
+        """ Register processes that have 'log_name' open, i.e. [{'pid': ..., 'cmd': ...}, ...]
+        """
+        pids = [_['pid'] for _ in processes]
+        cmd = processes[0]['cmd'] if 1 == len(processes) else '[proc: %d]' % len(processes)
+        self._processes[log_name] = (pids, cmd)
+
+
+    @property
+    def fields(self):
+        """ Record fields to capture (none, only record text is captured), see: FileTailer() 'listeners' """
+        return frozenset()
+
+
+    def on_record(self, tailer, items, text):
+        """ Record (parsed) record, see: FileTailer() 'listeners'
+        """
+        if not self._segment or self._written >= self._segment_size:
+            self._next_segment()
+
+        now = time.time()
+        pids, cmd = self._processes.get(tailer.name, ([], None))
+        line = json.dumps({'t': now, 'f': tailer.name, 'l': tailer.label, 'p': pids, 'c': cmd, 'x': text},
+            encoding=CAPTURE_ENCODING) + '\n'
+
+        self._segment.write(line)
+        self._written += len(line)
+
+        # 'Sync flush' makes everything written so far readable, even if ptail is killed
+        if now - self._last_flush >= self._flush_interval:
+            self._segment.flush(zlib.Z_SYNC_FLUSH)
+            self._last_flush = now
+
+
+    def close(self):
+        """ Close current segment
+        """
+        if self._segment:
+            logger.debug("Closing capture segment: %s" % self._segment.name)
+            self._segment.close()
+            self._segment = None
+
+
+class SessionReplay(object):
+    """ Read records from 'capture' directory (see: SessionRecorder())
+    """
+
+    def __init__(self, capture_dir):
+        """ CONSTRUCTOR
+
+            capture_dir: Directory with capture segments
+        """
+        if not os.path.isdir(capture_dir):
+            raise SessionCaptureException("Capture directory: %s does not exist" % capture_dir)
+
+        self._capture_dir = capture_dir
+        self._segments = sorted(glob.glob(os.path.join(capture_dir, SEGMENT_GLOB)))
+
+        logger.debug("SessionReplay() successfully initialized for: %s with: %d segments" % \
+            (capture_dir, len(self._segments)))
+
+
+    def _read_segment(self, segment_name):
+        """ Read records from segment
+
+            Segments that were not properly closed (i.e. ptail was killed) are read up to the last complete record
+        """
+        logger.info("Replaying capture segment: %s" % segment_name)
+
+        segment = gzip.open(segment_name, 'rb')
+        try:
+            while True:
+                try:
+                    line = segment.readline()
+                except (IOError, EOFError, zlib.error), e:
+                    logger.debug("Segment: %s is truncated: %s" % (segment_name, e))
+                    break
+
+                if not line.endswith('\n'):
+                    break
+
+                record = json.loads(line)
+                for key in ('f', 'l', 'c', 'x'):
+                    if record[key] is not None:
+                        record[key] = record[key].encode(CAPTURE_ENCODING)
+                yield record
+        finally:
+            segment.close()
+
+
+    @property
+    def segments(self):
+        return self._segments
+
+
+    def records(self, speed=0):
+        """ Yield records (in the order they were recorded)
+
+            speed: 0 - as fast as possible, 1 - 'real time' pace, 2 - twice as fast etc
+        """
+        first_record, replay_start = None, None
+
+        for segment_name in self._segments:
+            for record in self._read_segment(segment_name):
+                if speed:
+                    if first_record is None:
+                        first_record, replay_start = record['t'], time.time()
+                    wait = (record['t'] - first_record) / speed - (time.time() - replay_start)
+                    if wait > 0:
+                        time.sleep(wait)
+
+                yield record
@@ -0,0 +1,239 @@
+#! /usr/bin/env python
+""" TextDetector: Detect whether (log) files are 'text', without running UNIX 'file' command
+
+    Reads a small 'head' sample and checks it for: NUL bytes, 'control' bytes ratio and encoding (utf-8 or 8-bit text)
+
+    Results are cached by: (device, inode), with the size class and modification time they were detected for,
+    in memory and on disk, so that:
+        - files are not re-checked on every refresh (or on every ptail start)
+        - empty files are re-checked only when they get data
+        - small files (that are smaller than the sample) are re-checked when they change
+        - replaced files (new inode, or reused inode that goes through smaller size classes again) are re-checked
+        - anything else is re-checked after CACHE_TTL seconds or after reboot (inode numbers are reused)
+
+    IMPORTANT: This module must not import anything outside of python standard library
+               and must run on both: python 2 (2.6+) and python 3 (detect_type() is shipped to remote hosts,
+               see: RemoteAgent)
+"""
+
+import errno
+import json
+import logging
+import os
+import os.path
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None  # python 2.6 (remote agent only needs detect_type())
+
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+
+# Log types
+LOG_TYPE_TEXT = 'text'
+LOG_TYPE_BINARY = 'binary'
+LOG_TYPE_EMPTY = 'empty'
+
+# 'Head' sample size, in bytes
+SAMPLE_SIZE = 4096
+
+# Max ratio of 'control' bytes (other than whitespace and escape) in text
+MAX_CONTROL_RATIO = 0.1
+# Max ratio of 'high' (non ASCII) bytes in text that is not valid utf-8
+MAX_HIGH_RATIO = 0.3
+
+CONTROL_BYTES = frozenset(range(0, 32)) - frozenset(bytearray(b'\t\n\r\f\b\x1b')) | frozenset([127])
+
+# Max number of cached entries (the oldest are dropped first)
+MAX_CACHE_ENTRIES = 100000
+
+# How long (seconds) cached types are valid for
+CACHE_TTL = 24 * 3600
+
+# Kernel boot id: (device, inode) keys are only meaningful until reboot
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+
+###############################################################################
+# LOGGING
+###############################################################################
+logger = logging.getLogger(__name__)
+#logger.addHandler(logging.NullHandler()) # Disabling logging by default
+
+
+def size_class(size):
+    """ File 'size class': 0 for empty files, otherwise: number of bits in min(size, SAMPLE_SIZE)
+
+        Once the file is larger than the sample, its class (and the sample itself, for append only logs) do not change
+    """
+    return len(bin(min(size, SAMPLE_SIZE))) - 2 if size else 0
+
+
+# 'Size class' of files that are larger than the sample
+FULL_SAMPLE_CLASS = size_class(SAMPLE_SIZE)
+
+
+def read_boot_id():
+    """ Read kernel boot id (None if not available)
+    """
+    try:
+        with open(BOOT_ID_FILE) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def detect_type(sample):
+    """ Detect 'log type' from file 'head' sample
+    """
+    if not sample:
+        return LOG_TYPE_EMPTY
+
+    if b'\0' in sample:
+        return LOG_TYPE_BINARY
+
+    data = bytearray(sample)
+    controls = sum(1 for _ in data if _ in CONTROL_BYTES)
+    if controls > MAX_CONTROL_RATIO * len(data):
+        return LOG_TYPE_BINARY
+
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Sample may end in the middle of a (multi byte) character
+        if e.start < len(sample) - 3:
+            high = sum(1 for _ in data if _ > 127)
+            if high > MAX_HIGH_RATIO * len(data):
+                return LOG_TYPE_BINARY
+
+    return LOG_TYPE_TEXT
+
+
+class TextDetector(object):
+    """ Detect (and cache) file types
+    """
+
+    def __init__(self, cache_file=None):
+        """ CONSTRUCTOR
+
+            cache_file: (JSON) file to keep detected types in between ptail runs (None: in memory only)
+        """
+        self._cache_file = cache_file
+        self._types = OrderedDict()  # {(device, inode): (size class, modification time, log type, detected at)}
+        self._dirty = False          # True if there are new entries, not saved to disk yet
+        self._boot_id = read_boot_id()
+
+        self._load()
+
+        logger.debug("TextDetector() successfully initialized with: %d cached types" % len(self._types))
+
+
+    ###########################################################################
+    # PRIVATE ROUTINES
+    ###########################################################################
+
+    def _load(self):
+        """ Load cached types from disk (if any)
+        """
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return
+
+        try:
+            with open(self._cache_file) as f:
+                cache = json.load(f)
+            if not isinstance(cache, dict) or cache.get('boot_id') != self._boot_id:
+                logger.debug("File types in: %s are from another boot (or version). Ignoring" % self._cache_file)
+                return
+            now = time.time()
+            for device, inode, klass, mtime, log_type, detected_at in cache['types']:
+                if now - detected_at < CACHE_TTL:
+                    self._types[(device, inode)] = (klass, mtime, log_type, detected_at)
+        except (IOError, ValueError, TypeError, KeyError) as e:
+            logger.warn("Unable to load file types from: %s. Exception: %s" % (self._cache_file, e))
+
+
+    def _is_valid(self, entry, klass, mtime):
+        """ Check if cached entry is (still) valid for the file with: 'size class' and 'modification time'
+
+            Files that are larger than the sample are not re-checked when they change (the 'head' of append only logs
+            does not), until the entry expires
+        """
+        cached_class, cached_mtime, _, detected_at = entry
+        if cached_class != klass or time.time() - detected_at >= CACHE_TTL:
+            return False
+
+        return FULL_SAMPLE_CLASS == klass or cached_mtime == mtime
+
+
+    ###########################################################################
+    # PUBLIC ROUTINES
+    ###########################################################################
+
+    def get_type(self, file_name):
+        """ Get 'log type' of the file: LOG_TYPE_TEXT, LOG_TYPE_BINARY or LOG_TYPE_EMPTY
+
+            Returns: None if the file cannot be read (no privileges), so that other means should be used
+        """
+        try:
+            stats = os.stat(file_name)
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EPERM):
+                return None
+            # Logs are transitory so, it's ok if we cannot find them
+            logger.debug("Unable to find file: %s when analyzing type" % file_name)
+            return LOG_TYPE_BINARY
+
+        key, klass = (stats.st_dev, stats.st_ino), size_class(stats.st_size)
+        entry = self._types.get(key)
+        if entry and self._is_valid(entry, klass, stats.st_mtime):
+            return entry[2]
+
+        try:
+            with open(file_name, 'rb') as f:
+                sample = f.read(SAMPLE_SIZE)
+        except IOError as e:
+            if e.errno in (errno.EACCES, errno.EPERM):
+                return None
+            logger.debug("Unable to read file: %s when analyzing type" % file_name)
+            return LOG_TYPE_BINARY
+
+        log_type = detect_type(sample)
+        logger.debug("File: %s is: %s" % (file_name, log_type))
+
+        # (Re)inserted entries go last, so that the oldest are dropped first
+        self._types.pop(key, None)
+        self._types[key] = (klass, stats.st_mtime, log_type, time.time())
+        if len(self._types) > MAX_CACHE_ENTRIES:
+            self._types.popitem(last=False)
+        self._dirty = True
+
+        return log_type
+
+
+    def save(self):
+        """ Save cached types to disk (if there are new ones)
+        """
+        if not self._cache_file or not self._dirty:
+            return
+
+        temp_file = "%s.%d" % (self._cache_file, os.getpid())
+        try:
+            cache_dir = os.path.dirname(self._cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(temp_file, 'w') as f:
+                json.dump({'boot_id': self._boot_id, 'types': [list(k) + list(v) for k, v in self._types.items()]}, f)
+            os.rename(temp_file, self._cache_file)
+            self._dirty = False
+            logger.debug("Saved: %d file types to: %s" % (len(self._types), self._cache_file))
+        except (IOError, OSError) as e:
+            logger.warn("Unable to save file types to: %s. Exception: %s" % (self._cache_file, e))
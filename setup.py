@@ -52,6 +52,8 @@ setup(
 
     install_requires=['termcolor', 'pyyaml'],
 
+    test_suite='tests',
+
     entry_points={
         'console_scripts': [
             'ptail=gluent_eng.command_line_ptail:main',
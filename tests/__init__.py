@@ -0,0 +1,4 @@
+import logging
+
+# Expected warnings (i.e. patterns that cannot be combined) are not printed
+logging.getLogger('gluent_eng').addHandler(logging.NullHandler())
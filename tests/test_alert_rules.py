@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+""" Tests for: alert_rules (combined rule matching)
+"""
+
+import random
+import re
+import unittest
+
+from gluent_eng.alert_rules import AlertRules, MAX_COMBINED_GROUPS
+
+
+def make_rules(patterns):
+    """ Make AlertRules() with one rule per pattern (on 'level' field)
+    """
+    return AlertRules(dict(('r%03d' % i, {'where': {'level': pattern}, 'file': '/dev/null'}) \
+        for i, pattern in enumerate(patterns)))
+
+
+def match(patterns, value):
+    """ Patterns of the rules that match the value
+    """
+    rules = make_rules(patterns)
+    return set(rules._rules[_].where['level'] for _ in rules._match_field('level', value))
+
+
+class TestMatchField(unittest.TestCase):
+
+    def test_same_position(self):
+        # Later rules match at the same position as the earlier ones
+        self.assertEqual(match(['ERROR', 'ERR', 'E'], 'ERROR'), set(['ERROR', 'ERR', 'E']))
+        self.assertEqual(match(['ERR', 'ERROR'], 'ERR'), set(['ERR']))
+
+
+    def test_different_positions(self):
+        self.assertEqual(match(['^x', 'y$', 'z'], 'xaz'), set(['^x', 'z']))
+        self.assertEqual(match(['(?<=a)b', 'ab'], 'cab'), set(['(?<=a)b', 'ab']))
+
+
+    def test_no_match(self):
+        self.assertEqual(match(['ERROR', 'WARN'], 'INFO'), set())
+
+
+    def test_flags_are_not_shared(self):
+        self.assertEqual(match(['ERROR', '(?i)warn'], 'error'), set())
+        self.assertEqual(match(['ERROR', '(?i)warn'], 'WARN'), set(['(?i)warn']))
+        self.assertEqual(match(['ERROR', '(?i)warn'], 'ERROR'), set(['ERROR']))
+
+
+    def test_own_groups(self):
+        self.assertEqual(match(['(?P<x>a)(?P=x)', r'(b)\1', '(c)'], 'aabbc'), set(['(?P<x>a)(?P=x)', r'(b)\1', '(c)']))
+        self.assertEqual(match(['(?P<x>a)(?P=x)', r'(b)\1', '(c)'], 'abc'), set(['(c)']))
+
+
+    def test_chunks(self):
+        # More rules (groups) than a single regex can hold
+        patterns = ['x%03d' % i for i in range(MAX_COMBINED_GROUPS * 2)]
+        rules = make_rules(patterns)
+        self.assertTrue(len(rules._matchers['level'][0]) > 1)
+        self.assertEqual(set(rules._rules[_].where['level'] for _ in rules._match_field('level', 'x005 x150')),
+            set(['x005', 'x150']))
+
+
+    def test_same_as_individual(self):
+        random.seed(1)
+        choices = ['ERROR', 'ERR', 'RO', '^E', 'R$', 'O.', '(a|b)c', 'x(?P<n>y)', r'(z)\1', 'c', 'a+b', r'\d+',
+            '(?<=a)b', '(?i)err']
+        for _ in range(500):
+            patterns = random.sample(choices, random.randint(1, len(choices)))
+            value = "".join(random.choice('ERORabcxyz1 e') for _ in range(random.randint(0, 12)))
+            self.assertEqual(match(patterns, value), set(_ for _ in patterns if re.search(_, value)),
+                "patterns: %s, value: %s" % (patterns, value))
+
+
+class TestOnClose(unittest.TestCase):
+
+    def test_forget_closed_logs(self):
+        class Tailer(object):
+            name, label = '/tmp/namenode.log', 'namenode'
+
+        rules = make_rules(['ERROR'])
+        rules.on_record(Tailer(), {'level': 'INFO'}, 'text')
+        self.assertTrue(Tailer.name in rules._rules_by_log)
+        rules.on_close(Tailer())
+        self.assertFalse(Tailer.name in rules._rules_by_log)
+
+
+if __name__ == '__main__':
+    unittest.main()
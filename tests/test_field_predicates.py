@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+""" Tests for: field_predicates
+"""
+
+import re
+import unittest
+
+from gluent_eng.field_predicates import make_predicates, FieldPredicateException, REORDER_INTERVAL, \
+    COST_LEVEL, COST_REGEX
+from gluent_eng.log_layouts import compile_layout
+
+
+def matches(expressions, **items):
+    return make_predicates(expressions).matches(items)
+
+
+class TestMakePredicates(unittest.TestCase):
+
+    def test_no_expressions(self):
+        self.assertEqual(make_predicates([]), None)
+        self.assertEqual(make_predicates(None), None)
+
+
+    def test_invalid(self):
+        self.assertRaises(FieldPredicateException, make_predicates, ['level'])
+        self.assertRaises(FieldPredicateException, make_predicates, ['text=(unbalanced'])
+
+
+    def test_expressions_and_fields(self):
+        predicates = make_predicates(['level>=WARN', '!text=heartbeat'])
+        self.assertEqual(predicates.expressions, ['level>=WARN', '!text=heartbeat'])
+        self.assertEqual(predicates.fields, frozenset(['level', 'text']))
+
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_regex(self):
+        self.assertTrue(matches(['text=Driv'], text='Driver started'))
+        self.assertFalse(matches(['text=^Driv$'], text='Driver started'))
+        self.assertFalse(matches(['text!=Driv'], text='Driver started'))
+        self.assertTrue(matches(['!text=Driv'], text='Executor started'))
+
+
+    def test_levels(self):
+        self.assertTrue(matches(['level>=WARN'], level='ERROR'))
+        self.assertTrue(matches(['level>=WARN'], level='warning'))
+        self.assertFalse(matches(['level>=WARN'], level='INFO'))
+        self.assertTrue(matches(['level<INFO'], level='DEBUG'))
+        # Not a level
+        self.assertFalse(matches(['level>=WARN'], level='Thread-0'))
+
+
+    def test_glog_levels(self):
+        glog = re.compile(compile_layout('glog'))
+        lines = [
+            "I0607 17:56:13.313000  1234 controller.cc:123] leader imbalance ratio is 0.000000",
+            "W0607 17:56:14.100000  1234 controller.cc:130] slow leader election",
+            "E0607 17:56:15.200000  1235 replica.cc:42] replica lost",
+            "F0607 17:56:16.300000  1235 replica.cc:77] check failed",
+        ]
+        predicates = make_predicates(['level>=WARN'])
+        found = [_ for _ in lines if predicates.matches(glog.match(_).groupdict())]
+        self.assertEqual([_[0] for _ in found], ['W', 'E', 'F'])
+        self.assertTrue(matches(['level<W'], level='I'))
+        self.assertTrue(matches(['level>=E'], level='FATAL'))
+
+
+    def test_numbers(self):
+        # Leading number is compared
+        self.assertTrue(matches(['duration>500'], duration='523ms'))
+        self.assertFalse(matches(['duration>500'], duration='99ms'))
+        self.assertTrue(matches(['duration<=1.5'], duration='1.5'))
+        self.assertFalse(matches(['duration>500'], duration='n/a'))
+
+
+    def test_timestamps(self):
+        # Compared with the value's precision (minutes, here)
+        self.assertTrue(matches(['ts>=2016-06-07T17:50'], ts='2016-06-07 17:50:13,313'))
+        self.assertFalse(matches(['ts>2016-06-07T17:50'], ts='2016-06-07 17:50:13,313'))
+        self.assertTrue(matches(['ts<2016-06-08'], ts='2016-06-07 23:59:59,999'))
+
+
+    def test_strings(self):
+        self.assertTrue(matches(['id>abc'], id='abd'))
+        self.assertFalse(matches(['id>abc'], id='abb'))
+
+
+    def test_all_must_match(self):
+        self.assertTrue(matches(['level>=WARN', 'text=Driver'], level='ERROR', text='Driver failed'))
+        self.assertFalse(matches(['level>=WARN', 'text=Driver'], level='INFO', text='Driver failed'))
+
+
+    def test_missing_fields(self):
+        # Predicates on missing fields are skipped, but at least one must apply
+        self.assertTrue(matches(['level>=WARN', 'id=x'], level='ERROR'))
+        self.assertFalse(matches(['id=x'], level='ERROR'))
+        self.assertFalse(matches(['text=x'], text=None))
+
+
+class TestOrder(unittest.TestCase):
+
+    def order(self, predicates):
+        return [_.field for _ in predicates._predicates]
+
+
+    def test_cost_order(self):
+        # Cheap predicates go first
+        predicates = make_predicates(['text=Driver', 'level>=WARN'])
+        self.assertEqual(self.order(predicates), ['level', 'text'])
+        self.assertTrue(COST_LEVEL < COST_REGEX)
+
+
+    def test_adaptive_order(self):
+        # Selective predicate moves ahead of the cheap one, that never rejects
+        predicates = make_predicates(['text=Driver', 'level>=WARN'])
+        for _ in range(REORDER_INTERVAL):
+            predicates.matches({'level': 'ERROR', 'text': 'Executor'})
+        self.assertEqual(self.order(predicates), ['text', 'level'])
+
+        # ... and back, when the data changes
+        for _ in range(REORDER_INTERVAL * 4):
+            predicates.matches({'level': 'INFO', 'text': 'Driver'})
+        self.assertEqual(self.order(predicates), ['level', 'text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
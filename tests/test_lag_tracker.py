@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+""" Tests for: lag_tracker
+"""
+
+import time
+import unittest
+
+from gluent_eng.lag_tracker import LagTracker, parse_timestamp, LAG_BYTES, LAG_SECONDS
+
+
+class FakeTailer(object):
+
+    def __init__(self, label, bytes_behind=None):
+        self.label = label
+        self.bytes_behind = bytes_behind
+        self.live = True
+
+
+def local_epoch(year, month, day, hour, minute, second):
+    return time.mktime((year, month, day, hour, minute, second, 0, 0, -1))
+
+
+class TestParseTimestamp(unittest.TestCase):
+
+    def test_iso(self):
+        self.assertEqual(parse_timestamp('2016-06-05 18:08:43,500'), local_epoch(2016, 6, 5, 18, 8, 43) + 0.5)
+        self.assertEqual(parse_timestamp('2016-06-05T18:08:43'), local_epoch(2016, 6, 5, 18, 8, 43))
+        self.assertEqual(parse_timestamp('not a timestamp'), None)
+        self.assertEqual(parse_timestamp(None), None)
+
+
+    def test_glog(self):
+        now = local_epoch(2016, 6, 7, 12, 0, 0)
+        self.assertEqual(parse_timestamp('0605 18:08:43.250000', now), local_epoch(2016, 6, 5, 18, 8, 43) + 0.25)
+        # 'Future' timestamps are from the previous year
+        now = local_epoch(2017, 1, 1, 0, 5, 0)
+        self.assertEqual(parse_timestamp('1231 23:59:59.000000', now), local_epoch(2016, 12, 31, 23, 59, 59))
+
+
+class TestForget(unittest.TestCase):
+
+    def test_closed_logs_are_forgotten(self):
+        tracker = LagTracker(budget=1)
+        tailers = [FakeTailer('a', 10), FakeTailer('b', 20)]
+        for tailer in tailers:
+            tracker.on_poll(tailer)
+            tracker.on_record(tailer, {'ts': '2016-06-05 18:08:43,972'}, '')
+
+        tracker.on_close(tailers[0])
+
+        self.assertEqual(sorted(tracker.quantiles()), [('b', LAG_BYTES), ('b', LAG_SECONDS)])
+        self.assertEqual([_[0] for _ in tracker.check_budget()], ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+""" Tests for: log_layouts
+"""
+
+import re
+import unittest
+
+from gluent_eng.log_layouts import compile_layout, tokenize, LogLayoutException, LITERAL, SPACES, FIELD
+
+
+def parse(layout, line):
+    """ Parse line with (compiled) layout. Returns: {field: value} or None if the line does not match
+    """
+    matched = re.match(compile_layout(layout), line)
+    return matched.groupdict() if matched else None
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_tokens(self):
+        self.assertEqual(tokenize('[{id}]: {text*}'), [
+            (LITERAL, '['),
+            (FIELD, ('id', None, None, False)),
+            (LITERAL, ']:'),
+            (SPACES, None),
+            (FIELD, ('text', None, None, True)),
+        ])
+
+
+    def test_escaped_brace(self):
+        # '{{' is a literal '{', merged with the adjacent literal text
+        self.assertEqual(tokenize('{{x{{'), [(LITERAL, '{x{')])
+
+
+    def test_width_and_type(self):
+        self.assertEqual(tokenize('{ts:23:ts}'), [(FIELD, ('ts', 23, 'ts', False))])
+        self.assertEqual(tokenize('{ts:ts:23}'), [(FIELD, ('ts', 23, 'ts', False))])
+
+
+    def test_invalid(self):
+        for layout in ('{a:bogus}', '{a:0}', '{ts:1:ts}', '{a'):
+            self.assertRaises(LogLayoutException, tokenize, layout)
+
+
+class TestCompileLayout(unittest.TestCase):
+
+    def test_builtin_layouts(self):
+        self.assertEqual(parse('log4j', '2016-06-05 18:11:34,797 DEBUG [Thread-0]: ipc.Client (Client.java:stop(1243)) - Stopping client'),
+            {'ts': '2016-06-05 18:11:34,797', 'level': 'DEBUG', 'id': 'Thread-0',
+             'text': 'ipc.Client (Client.java:stop(1243)) - Stopping client'})
+        self.assertEqual(parse('glog', 'I0607 17:56:13.313000  1234 controller.cc:123] leader imbalance ratio is 0.000000'),
+            {'level': 'I', 'ts': '0607 17:56:13.313000', 'thread': '1234', 'source': 'controller.cc:123',
+             'text': 'leader imbalance ratio is 0.000000'})
+        self.assertEqual(parse('kafka', '[2016-06-07 17:56:13,313] TRACE [Controller 0]: ratio (kafka.controller.KafkaController)'),
+            {'ts': '2016-06-07 17:56:13,313', 'level': 'TRACE', 'text': '[Controller 0]: ratio (kafka.controller.KafkaController)'})
+
+
+    def test_escaped_brace(self):
+        self.assertEqual(parse('{{{a}}', '{x}'), {'a': 'x'})
+        self.assertEqual(parse('{{{a}}', 'x}'), None)
+
+
+    def test_field_followed_by_field(self):
+        # Variable width field cannot be followed by another field (where would it end ?)
+        self.assertRaises(LogLayoutException, compile_layout, '{a}{b}')
+        # ... fixed width field can
+        self.assertEqual(parse('{a:2}{b}', 'xyz'), {'a': 'xy', 'b': 'z'})
+
+
+    def test_width_and_type(self):
+        self.assertEqual(parse('{n:3:num} {w:word}', '123 abc'), {'n': '123', 'w': 'abc'})
+        self.assertEqual(parse('{n:3:num} {w:word}', '12x abc'), None)
+        self.assertEqual(parse('{ts:5:ts}|{text*}', '1-2-3|x'), {'ts': '1-2-3', 'text': 'x'})
+        self.assertEqual(parse('{ts:5:ts}|{text*}', '1-2-x|x'), None)
+
+
+    def test_multi_character_literal(self):
+        # The first character of the next literal is allowed in the field, unless the rest of the literal follows it
+        self.assertEqual(parse('{a}::{b*}', 'x:y::z'), {'a': 'x:y', 'b': 'z'})
+        self.assertEqual(parse('{a}::{b*}', 'x::y::z'), {'a': 'x', 'b': 'y::z'})
+        self.assertEqual(parse('{a:word}->{b*}', 'x-y->z'), {'a': 'x-y', 'b': 'z'})
+        self.assertEqual(parse('[{id}]: {text*}', '[a]b]: c'), {'id': 'a]b', 'text': 'c'})
+
+
+    def test_single_character_literal(self):
+        self.assertEqual(parse('{a}:{b*}', 'x:y:z'), {'a': 'x', 'b': 'y:z'})
+
+
+    def test_spaces(self):
+        # One or more spaces (or tabs)
+        self.assertEqual(parse('{a} {b}', 'x \t y'), {'a': 'x', 'b': 'y'})
+        self.assertEqual(parse('{a} {b}', 'xy'), None)
+
+
+    def test_anchored(self):
+        self.assertEqual(parse('{a}:', 'x:y'), None)
+        self.assertEqual(parse('{a}:{b}', 'x:y z'), {'a': 'x', 'b': 'y z'})
+
+
+    def test_linear(self):
+        # Long lines that do not match, do not backtrack 'catastrophically'
+        self.assertEqual(parse('{a}::{b}::{c}::', 'x:' * 50000), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+""" Tests for: log_setup (log pattern 'dispatch')
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from gluent_eng.log_setup import LogSetup, DEFAULT_LOG_ENTRY, MAX_DISPATCH_GROUPS
+
+
+class TestDispatchPattern(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+
+    def make_setup(self, patterns):
+        """ Make LogSetup() from (ordered) log patterns, labeled by their positions
+        """
+        setup_file = os.path.join(self._dir, 'ptail.yaml')
+        with open(setup_file, 'w') as f:
+            for i, pattern in enumerate(patterns):
+                f.write("'%s':\n    label: p%d\n" % (pattern.replace("'", "''"), i))
+
+        return LogSetup(setup_file)
+
+
+    def dispatch(self, setup, log_file):
+        found = setup._dispatch_pattern(log_file)
+        return found.pattern if found else None
+
+
+    def linear(self, patterns, log_file):
+        """ Reference: the first pattern (in setup order) that matches """
+        setup = self.make_setup(patterns)
+        for pattern in setup._patterns:
+            if pattern.search(log_file):
+                return pattern.pattern
+        return None
+
+
+    def test_setup_order_wins(self):
+        setup = self.make_setup(['hive', 'hive-metadata'])
+        self.assertEqual(self.dispatch(setup, '/tmp/hive/hive-metadata.log'), 'hive')
+
+
+    def test_earlier_pattern_matching_further_in_the_name(self):
+        # 'hive' matches first (in the name), but 'metadata' comes first in setup
+        setup = self.make_setup(['metadata', 'hive'])
+        self.assertEqual(self.dispatch(setup, '/tmp/hive/hive-metadata.log'), 'metadata')
+
+
+    def test_same_position(self):
+        setup = self.make_setup(['hive-server', 'hive'])
+        self.assertEqual(self.dispatch(setup, '/tmp/hive-server.log'), 'hive-server')
+        setup = self.make_setup(['hive', 'hive-server'])
+        self.assertEqual(self.dispatch(setup, '/tmp/hive-server.log'), 'hive')
+
+
+    def test_no_match(self):
+        setup = self.make_setup(['hive', 'impala'])
+        self.assertEqual(self.dispatch(setup, '/tmp/kafka.log'), None)
+        self.assertEqual(setup.get_meta('/tmp/kafka.log')['label'], None)
+
+
+    def test_meta(self):
+        setup = self.make_setup(['impala', 'hive'])
+        self.assertEqual(setup.get_meta('/tmp/hive.log')['label'], 'p1')
+
+
+    def test_chunks(self):
+        # More patterns (and groups) than a single regex can hold
+        patterns = ['(x)(%03d)' % i for i in range(MAX_DISPATCH_GROUPS * 2)]
+        setup = self.make_setup(patterns)
+        self.assertTrue(len(setup._dispatch) > 1)
+        self.assertEqual(self.dispatch(setup, '/tmp/x150-x005.log'), '(x)(005)')
+        self.assertEqual(self.dispatch(setup, '/tmp/x150.log'), '(x)(150)')
+
+
+    def test_not_combined(self):
+        # Back references: patterns are matched one by one (same result)
+        setup = self.make_setup(['(h)\\1', 'hh-x'])
+        self.assertEqual(setup._dispatch, None)
+        self.assertEqual(setup.get_meta('/tmp/hh-x.log')['label'], 'p0')
+
+
+    def test_same_as_linear(self):
+        random.seed(1)
+        choices = ['a', 'ab', 'b.', '^/t', 'c$', 'a+b', '(a|c)b', 'ba', 'x']
+        for _ in range(100):
+            patterns = random.sample(choices, random.randint(1, len(choices)))
+            log_file = '/t/' + "".join(random.choice('abcx') for _ in range(random.randint(0, 8)))
+            self.assertEqual(self.dispatch(self.make_setup(patterns), log_file), self.linear(patterns, log_file),
+                "patterns: %s, log: %s" % (patterns, log_file))
+
+
+
+class TestBacktrackingFormats(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+
+    def test_backtracking_format_is_replaced(self):
+        setup_file = os.path.join(self._dir, 'ptail.yaml')
+        with open(setup_file, 'w') as f:
+            f.write("'slow':\n    format: '(?P<msg>(\\w+\\s?)*)$'\n")
+            f.write("'fast':\n    format: '(?P<level>\\w+) (?P<msg>.*)'\n")
+        setup = LogSetup(setup_file)
+
+        self.assertEqual(setup.get_meta('/tmp/slow.log')['format'], DEFAULT_LOG_ENTRY)
+        self.assertEqual(setup.get_meta('/tmp/fast.log')['format'], r'(?P<level>\w+) (?P<msg>.*)')
+        self.assertEqual(dict(setup.get_formats())['slow'], DEFAULT_LOG_ENTRY)
+        self.assertEqual(len(setup.warnings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+""" Tests for: log_source (bounded reads and 'while reading' line truncation)
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gluent_eng.log_source import LineBuffer, FileSource, READ_CHUNK_SIZE
+from gluent_eng.record_guard import TRUNCATED_LINE
+
+
+class TestLineBuffer(unittest.TestCase):
+
+    def test_complete_lines(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.add("a\nbb\nc"), ["a\n", "bb\n"])
+        self.assertEqual(buf.add("c\n"), ["cc\n"])
+        self.assertFalse(buf.pending)
+
+
+    def test_truncate(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.add("abcdef\nxy\n", 4), ["abcd" + TRUNCATED_LINE % 2 + "\n", "xy\n"])
+
+
+    def test_partial_line_is_bounded(self):
+        buf = LineBuffer()
+        for _ in range(100):
+            self.assertEqual(buf.add("x" * 1000, 10), [])
+        self.assertEqual(buf._partial_size, 10)
+        self.assertEqual(buf.add("y\nz", 10), ["x" * 10 + TRUNCATED_LINE % 99991 + "\n"])
+        self.assertEqual(buf.flush(), ["z\n"])
+        self.assertEqual(buf.flush(), [])
+
+
+class TestFileSource(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._file_name = os.path.join(self._dir, 'test.log')
+        open(self._file_name, 'w').close()
+        self._source = FileSource(self._file_name)
+        self._source.open(open_at_top=True)
+
+
+    def tearDown(self):
+        self._source.close()
+        shutil.rmtree(self._dir)
+
+
+    def write(self, data):
+        with open(self._file_name, 'a') as f:
+            f.write(data)
+
+
+    def test_incomplete_line(self):
+        self.write("one\ntw")
+        self.assertEqual(self._source.read_lines(), ["one\n"])
+        self.assertEqual(self._source.read_lines(), [])
+        self.write("o\n")
+        self.assertEqual(self._source.read_lines(), ["two\n"])
+
+
+    def test_read_to_the_end(self):
+        line = "x" * 1000 + "\n"
+        self.write(line * (3 * READ_CHUNK_SIZE / len(line) + 10))
+
+        self.assertEqual(self._source.read_lines(), [line] * (3 * READ_CHUNK_SIZE / len(line) + 10))
+        self.assertEqual(self._source.read_lines(), [])
+
+
+    def test_long_line_is_truncated_while_reading(self):
+        self.write("y" * (3 * READ_CHUNK_SIZE))
+        self.assertEqual(self._source.read_lines(100), [])
+        self.write("\n")
+        self.assertEqual(self._source.read_lines(100), ["y" * 100 + TRUNCATED_LINE % (3 * READ_CHUNK_SIZE - 100) + "\n"])
+
+
+if __name__ == '__main__':
+    unittest.main()